@@ -0,0 +1,217 @@
+""" End to end benchmark: webhooks are posted to the real webhook route, a stub
+gateway echoes every message and the answers are sent to a local fake Chatwoot.
+
+Reports webhooks/s, webhook to first send latency percentiles, the memory
+high-water mark and the sockets opened to Chatwoot.
+
+    python -m benchmarks.e2e --webhooks 2000 --concurrency 50
+    python -m benchmarks.e2e --latency 0.05 --rate-limit-rate 0.02 --output e2e.json
+"""
+import argparse
+import asyncio
+import copy
+import json
+import math
+import platform
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional
+import httpx
+from fastapi import FastAPI
+from loguru import logger as log
+from celai_chatwoot.connector.woo_connector import WootConnector
+from celai_chatwoot.connector.routing import InboxRoute
+from celai_chatwoot.connector.retry import RetryPolicy
+from celai_chatwoot.connector.tracing import JsonlSpanExporter, Tracer
+from celai_chatwoot.connector.webhook_filter import WebhookFilter
+from benchmarks.fake_chatwoot import FakeChatwoot
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+DEFAULT_FIXTURES = ["tests/data/incoming_text_msg_from_web.json",
+                    "tests/data/incoming_img_msg_from_web.json",
+                    "tests/data/incoming_audio_msg_tg.json",
+                    "tests/data/incoming_file_msg_tg.json",
+                    "tests/data/incoming_location_tg.json"]
+
+
+class EchoGateway:
+    """ Stub gateway, answers every message with its text """
+
+    def __init__(self, connector: WootConnector):
+        self.connector = connector
+
+    async def process_message(self, message, mode=None):
+        text = f"re: {message.text}"
+        await self.connector.send_text_message(message.lead, text)
+        yield text
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """ Nearest rank percentile """
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values), math.ceil(p / 100 * len(values))) - 1)
+    return values[index]
+
+
+def max_rss_kb() -> Optional[int]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def routes_for(payloads: Iterable[Any]) -> List[InboxRoute]:
+    """ A route for every inbox of the webhooks, inboxes without a known account are skipped """
+    accounts = {}
+    for payload in payloads:
+        account_id, inbox_id = WebhookFilter.route_of(payload)
+        if account_id and inbox_id:
+            accounts.setdefault(inbox_id, account_id)
+    return [InboxRoute(account_id=account_id, inbox_id=inbox_id, access_key=f"key-{account_id}")
+            for inbox_id, account_id in accounts.items()]
+
+
+def webhook(template: dict, i: int) -> dict:
+    """ Copy of a fixture with an unique message and conversation """
+    payload = copy.deepcopy(template)
+    conversation_id = 1_000_000 + i
+    message_id = 10_000_000 + i
+    payload["id"] = message_id
+    payload["content"] = f"message {i}"
+    payload["conversation"]["id"] = conversation_id
+    for message in payload["conversation"].get("messages") or []:
+        message["id"] = message_id
+        message["content"] = f"message {i}"
+        message["conversation_id"] = conversation_id
+    return payload
+
+
+async def run(args) -> Dict[str, Any]:
+    fixtures = []
+    for path in args.fixtures:
+        with open(path) as f:
+            fixtures.append(json.load(f))
+
+    fake = FakeChatwoot(latency=args.latency,
+                        jitter=args.jitter,
+                        rate_limit_rate=args.rate_limit_rate,
+                        error_rate=args.error_rate,
+                        seed=args.seed)
+    await fake.start()
+
+    conn = WootConnector(bot_name="Benchmark Bot",
+                         account_id=None, access_key=None, inbox_id=None,
+                         chatwoot_url=fake.url,
+                         routes=routes_for(fixtures),
+                         security_token="benchmark",
+                         bot_cache_path=None,
+                         webhook_queue_size=args.webhooks,
+                         webhook_workers=args.workers,
+                         outbound_concurrency=args.outbound_concurrency,
+                         retry_policy=RetryPolicy(max_attempts=8, deadline=60, base_delay=0.01, max_delay=0.5),
+                         tracer=Tracer(JsonlSpanExporter(args.trace)) if getattr(args, "trace", None) else None)
+    conn.gateway = EchoGateway(conn)
+    conn.http.open()
+
+    app = FastAPI()
+    app.include_router(conn.get_router())
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    payloads = [webhook(fixtures[i % len(fixtures)], i) for i in range(args.webhooks)]
+    posted_at: Dict[str, float] = {}
+    statuses: Dict[int, int] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def post(client: httpx.AsyncClient, payload: dict):
+        async with semaphore:
+            posted_at[str(payload["conversation"]["id"])] = time.perf_counter()
+            res = await client.post(url, json=payload)
+            statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        await asyncio.gather(*(post(client, p) for p in payloads))
+    posted = time.perf_counter()
+    await conn.webhook_queue.join()
+    await conn.outbound.flush()
+    finished = time.perf_counter()
+
+    first_send: Dict[str, float] = {}
+    for message in fake.messages:
+        first_send.setdefault(message.conversation_id, message.received_at)
+    latencies = [first_send[conv] - at for conv, at in posted_at.items() if conv in first_send]
+    elapsed = finished - started
+
+    await conn.webhook_queue.close()
+    await conn.outbound.close()
+    await conn.http.close()
+    conn.tracer.close()
+    await fake.close()
+
+    return {
+        "benchmark": "e2e",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "trace")},
+        "webhooks": args.webhooks,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "answered": len(latencies),
+        "elapsed": round(elapsed, 4),
+        "post_elapsed": round(posted - started, 4),
+        "webhooks_per_sec": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+        },
+        "max_rss_kb": max_rss_kb(),
+        "chatwoot": fake.stats.to_dict(),
+        "webhook_queue": conn.webhook_stats(),
+        "retries": conn.retry_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhooks", type=int, default=1000, help="Webhooks posted, one conversation each")
+    parser.add_argument("--concurrency", type=int, default=50, help="Webhooks posted at the same time")
+    parser.add_argument("--workers", type=int, default=8, help="webhook_workers of the connector")
+    parser.add_argument("--outbound-concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every Chatwoot response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Max random seconds added to the latency")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered 502")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures", nargs="+", default=DEFAULT_FIXTURES)
+    parser.add_argument("--output", help="Json file to save the results")
+    parser.add_argument("--trace", help="JSONL file to save the spans of every webhook")
+    parser.add_argument("--verbose", action="store_true", help="Keep the connector logs")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        log.disable("celai_chatwoot")
+    results = asyncio.run(run(args))
+
+    latency = {k: f"{v * 1000:.1f}ms" if v is not None else "-" for k, v in results["latency"].items()}
+    print(f"answered {results['answered']}/{results['webhooks']} webhooks in {results['elapsed']}s "
+          f"({results['webhooks_per_sec']} webhooks/s)")
+    print(f"webhook to first send: p50 {latency['p50']}, p95 {latency['p95']}, p99 {latency['p99']}, max {latency['max']}")
+    print(f"max rss: {results['max_rss_kb']} KB, sockets opened: {results['chatwoot']['sockets_opened']}, "
+          f"429: {results['chatwoot']['rate_limited']}, 5xx: {results['chatwoot']['errors']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
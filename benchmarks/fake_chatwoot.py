@@ -0,0 +1,187 @@
+""" In process fake of the Chatwoot API used by the connector, with injectable
+latency, rate limits and server errors. Records every message it receives. """
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+from aiohttp import web
+
+
+@dataclass
+class ReceivedMessage:
+    account_id: str
+    conversation_id: str
+    content: Optional[str]
+    content_attributes: Dict[str, Any]
+    attachment_bytes: int
+    # time.perf_counter() when the request was received
+    received_at: float
+
+
+@dataclass
+class FakeChatwootStats:
+    requests: int = 0
+    messages: int = 0
+    rate_limited: int = 0
+    errors: int = 0
+    peers: Set[Tuple[str, int]] = field(default_factory=set)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"requests": self.requests,
+                "messages": self.messages,
+                "rate_limited": self.rate_limited,
+                "errors": self.errors,
+                # every client socket has its own peer port
+                "sockets_opened": len(self.peers)}
+
+
+class FakeChatwoot:
+    """ Chatwoot API server listening on 127.0.0.1.
+
+    Args:
+        - latency[float]: Seconds added to every response
+        - jitter[float]: Max random seconds added to latency
+        - rate_limit_rate[float]: Fraction of requests answered 429 with Retry-After
+        - error_rate[float]: Fraction of requests answered 502
+        - retry_after[float]: Retry-After of the 429 responses
+        - seed[int]: Seed of the fault injection
+    """
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 rate_limit_rate: float = 0.0,
+                 error_rate: float = 0.0,
+                 retry_after: float = 0.05,
+                 seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.messages: List[ReceivedMessage] = []
+        self.stats = FakeChatwootStats()
+        self.bots: Dict[int, Dict[str, Any]] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+    def app(self) -> web.Application:
+        prefix = "/api/v1/accounts/{account_id}"
+        app = web.Application(middlewares=[self.__faults], client_max_size=64 * 1024 * 1024)
+        app.router.add_post(prefix + "/conversations/{conversation_id}/messages", self.__create_message)
+        app.router.add_get(prefix + "/conversations/{conversation_id}/messages", self.__list_messages)
+        app.router.add_get(prefix + "/agent_bots", self.__list_bots)
+        app.router.add_post(prefix + "/agent_bots", self.__create_bot)
+        app.router.add_get(prefix + "/agent_bots/{bot_id}", self.__get_bot)
+        app.router.add_patch(prefix + "/agent_bots/{bot_id}", self.__update_bot)
+        app.router.add_post(prefix + "/inboxes/{inbox_id}/set_agent_bot", self.__assign_bot)
+        return app
+
+    async def start(self) -> str:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> 'FakeChatwoot':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+    @web.middleware
+    async def __faults(self, request: web.Request, handler):
+        self.stats.requests += 1
+        peer = request.transport.get_extra_info("peername") if request.transport else None
+        if peer:
+            self.stats.peers.add(tuple(peer[:2]))
+        delay = self.latency + (self.random.random() * self.jitter if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            self.stats.rate_limited += 1
+            return web.json_response({"error": "Too many requests"}, status=429,
+                                     headers={"Retry-After": str(self.retry_after)})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.stats.errors += 1
+            return web.json_response({"error": "Bad gateway"}, status=502)
+        return await handler(request)
+
+
+    # Messages
+    # -------------------------------------------------------------
+    async def __create_message(self, request: web.Request):
+        received_at = time.perf_counter()
+        content, attributes, attachment_bytes = None, {}, 0
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name == "attachments[]":
+                    while chunk := await part.read_chunk():
+                        attachment_bytes += len(chunk)
+                elif part.name == "content":
+                    content = await part.text()
+                elif part.name == "content_attributes":
+                    attributes = json.loads(await part.text() or "{}")
+        else:
+            data = await request.json()
+            content = data.get("content")
+            attributes = data.get("content_attributes") or {}
+
+        self.stats.messages += 1
+        message = ReceivedMessage(account_id=request.match_info["account_id"],
+                                  conversation_id=request.match_info["conversation_id"],
+                                  content=content,
+                                  content_attributes=attributes,
+                                  attachment_bytes=attachment_bytes,
+                                  received_at=received_at)
+        self.messages.append(message)
+        return web.json_response({"id": len(self.messages),
+                                  "content": content,
+                                  "content_attributes": attributes,
+                                  "conversation_id": int(message.conversation_id)})
+
+    async def __list_messages(self, request: web.Request):
+        conversation_id = request.match_info["conversation_id"]
+        payload = [{"id": i + 1, "content": m.content, "content_attributes": m.content_attributes}
+                   for i, m in enumerate(self.messages) if m.conversation_id == conversation_id]
+        return web.json_response({"payload": payload})
+
+
+    # Agent bots
+    # -------------------------------------------------------------
+    async def __list_bots(self, request: web.Request):
+        return web.json_response(list(self.bots.values()))
+
+    async def __create_bot(self, request: web.Request):
+        bot = {"id": len(self.bots) + 1, "description": "", "outgoing_url": "", **await request.json()}
+        self.bots[bot["id"]] = bot
+        return web.json_response(bot)
+
+    async def __get_bot(self, request: web.Request):
+        bot = self.bots.get(int(request.match_info["bot_id"]))
+        if bot is None:
+            return web.json_response({"error": "not found"}, status=404)
+        return web.json_response(bot)
+
+    async def __update_bot(self, request: web.Request):
+        bot = self.bots[int(request.match_info["bot_id"])]
+        bot.update(await request.json())
+        return web.json_response(bot)
+
+    async def __assign_bot(self, request: web.Request):
+        return web.json_response({})
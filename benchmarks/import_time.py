@@ -0,0 +1,67 @@
+""" Cold import time of the connector, measured in fresh interpreters.
+Lists the slowest top level packages of the last run and checks that the
+heavy dependencies are loaded on first use, not on import.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --module celai_chatwoot.connector.woo_connector --runs 20
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+# loaded on first use by the connector, shortuuid is deferred too
+# but the cel lead model imports it anyway
+DEFERRED = ("aiohttp", "filetype", "cel.gateway.message_gateway")
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(module: str) -> tuple:
+    """ Returns the total import time in seconds, the self time by
+    top level package and the modules loaded, from a fresh interpreter """
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, env=env, check=True)
+    total = 0
+    packages = Counter()
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        own, cumulative, indent, name = int(match.group(1)), int(match.group(2)), len(match.group(3)), match.group(4)
+        packages[name.split(".")[0]] += own
+        # nested imports are included in the cumulative time of the top level ones
+        if indent == 1:
+            total += cumulative
+    return total / 1e6, packages, set(proc.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="celai_chatwoot.connector")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    # the first run warms the OS file cache
+    measure(args.module)
+    runs = [measure(args.module) for _ in range(args.runs)]
+    times = sorted(total for total, _, _ in runs)
+    _, packages, modules = runs[-1]
+
+    print(f"import {args.module} ({args.runs} runs)")
+    print(f"  min {times[0] * 1000:7.1f} ms  median {statistics.median(times) * 1000:7.1f} ms  max {times[-1] * 1000:7.1f} ms")
+    print("slowest packages (last run):")
+    for name, micros in packages.most_common(args.top):
+        print(f"  {name:<24} {micros / 1000:7.1f} ms")
+    loaded = [name for name in DEFERRED if name in modules]
+    print(f"deferred modules loaded on import: {', '.join(loaded) if loaded else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+""" Encode/decode throughput of WootLead: the dict path (to_dict + json)
+against the binary path (to_bytes/from_bytes).
+
+    python -m benchmarks.lead_codec --seconds 1
+"""
+import argparse
+import json
+import time
+from celai_chatwoot.connector.model.woot_lead import WootLead
+
+
+def rate(fn, seconds: float) -> float:
+    """ Calls per second of fn """
+    calls = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            fn()
+        calls += 100
+    return calls / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--payload", default="tests/data/incoming_text_msg_from_web.json")
+    args = parser.parse_args()
+
+    with open(args.payload) as f:
+        payload = json.load(f)
+    # to_dict() decodes the packed raw payload, each path gets its own lead
+    dict_lead = WootLead.from_chatwoot_message(payload, connector_name="chatwoot:benchmark")
+    bytes_lead = WootLead.from_chatwoot_message(payload, connector_name="chatwoot:benchmark")
+    as_json = json.dumps(dict_lead.to_dict())
+    as_bytes = bytes_lead.to_bytes()
+
+    results = {
+        "dict encode": rate(lambda: json.dumps(dict_lead.to_dict()), args.seconds),
+        "dict decode": rate(lambda: WootLead.from_dict(json.loads(as_json)), args.seconds),
+        "bytes encode": rate(lambda: bytes_lead.to_bytes(), args.seconds),
+        "bytes decode": rate(lambda: WootLead.from_bytes(as_bytes), args.seconds),
+    }
+    print(f"dict: {len(as_json)} bytes, binary: {len(as_bytes)} bytes")
+    for name, ops in results.items():
+        print(f"{name:>13}: {ops:12,.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
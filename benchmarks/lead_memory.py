@@ -0,0 +1,50 @@
+""" Memory kept per live conversation by the lead of its last webhook, 
+for every RawPayloadMode.
+
+    python -m benchmarks.lead_memory --sessions 100000
+"""
+import argparse
+import gc
+import tracemalloc
+from celai_chatwoot.connector.model.compact import RawPayloadMode
+from celai_chatwoot.connector.model.woot_lead import WootLead
+from celai_chatwoot.connector.webhook_filter import loads
+
+
+def measure(body: bytes, sessions: int, mode: str) -> int:
+    """ Bytes retained by `sessions` leads, each one built from its own decoded webhook """
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    leads = []
+    for i in range(sessions):
+        payload = loads(body)
+        payload["conversation"]["id"] = i + 1
+        leads.append(WootLead.from_chatwoot_message(payload, raw_mode=mode))
+        del payload
+    gc.collect()
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return end - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--payload", default="tests/data/incoming_text_msg_from_web.json")
+    args = parser.parse_args()
+
+    with open(args.payload, "rb") as f:
+        body = f.read()
+
+    print(f"{args.sessions} sessions, webhook body {len(body)} bytes")
+    full = None
+    for mode in (RawPayloadMode.FULL, RawPayloadMode.COMPACT, RawPayloadMode.TRIMMED):
+        retained = measure(body, args.sessions, mode)
+        full = full or retained
+        print(f"{mode:>8}: {retained / args.sessions:10.0f} bytes/session "
+              f"{retained / 2**20:10.1f} MB total  x{full / retained:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+""" Cost of a single metrics observation on the hot path, it should stay
+under a microsecond.
+
+    python -m benchmarks.metrics_overhead
+"""
+import argparse
+import timeit
+from celai_chatwoot.connector.metrics import ConnectorMetrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    metrics = ConnectorMetrics()
+    baseline = timeit.timeit(lambda: None, number=args.number)
+    results = {
+        "counter inc": timeit.timeit(lambda: metrics.webhooks_received.inc("8", "211"), number=args.number),
+        "histogram observe": timeit.timeit(lambda: metrics.parse.observe(0.003, "8", "211"), number=args.number),
+    }
+    for name, total in results.items():
+        print(f"{name:>17}: {(total - baseline) / args.number * 1e9:8.1f} ns")
+
+
+if __name__ == "__main__":
+    main()
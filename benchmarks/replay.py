@@ -0,0 +1,196 @@
+""" Replays a webhook recording (see WebhookRecorder) against a connector and a
+local fake Chatwoot, at the recorded pace, N times faster or as fast as possible.
+A stub gateway answers every message. Reports how far the posts and the
+answers fell behind the recorded schedule.
+
+    python -m benchmarks.replay webhooks.ndjson.gz                 # recorded pace
+    python -m benchmarks.replay webhooks.ndjson.gz --speed 10      # 10x faster
+    python -m benchmarks.replay webhooks.ndjson.gz --speed 0       # max speed
+"""
+import argparse
+import asyncio
+import json
+import platform
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+import httpx
+from fastapi import FastAPI
+from loguru import logger as log
+from celai_chatwoot.connector.woo_connector import WootConnector
+from celai_chatwoot.connector.recorder import read_recording
+from celai_chatwoot.connector.retry import RetryPolicy
+from benchmarks.e2e import max_rss_kb, percentile, routes_for
+from benchmarks.fake_chatwoot import FakeChatwoot
+
+
+class ReplyGateway:
+    """ Stub gateway, answers every message once with the id of the message it answers """
+
+    def __init__(self, connector: WootConnector):
+        self.connector = connector
+
+    async def process_message(self, message, mode=None):
+        raw = message.lead.metadata.get("raw") or {}
+        text = f"re: {message.text}"
+        await self.connector.send_text_message(message.lead, text, metadata={"in_reply_to": raw.get("id")})
+        yield text
+
+
+def schedule(records: Iterable[Dict[str, Any]]) -> List[Tuple[float, Dict[str, Any]]]:
+    """ (offset in seconds, record) pairs. Recordings appended to the same file
+    restart their clock, they are replayed one after the other. """
+    result = []
+    base, last = 0.0, 0.0
+    for record in records:
+        t = float(record.get("t", 0))
+        if t + base < last:
+            base = last - t
+        last = t + base
+        result.append((last, record))
+    return result
+
+
+def summary(values: List[float]) -> Dict[str, Any]:
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95),
+            "p99": percentile(values, 99), "max": max(values) if values else None}
+
+
+async def run(args) -> Dict[str, Any]:
+    plan = schedule(read_recording(args.recording))
+    payloads = []
+    for _, record in plan:
+        payloads.extend(record["payload"] if record.get("route") == "batch" else [record["payload"]])
+
+    fake = FakeChatwoot(latency=args.latency, jitter=args.jitter,
+                        rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate, seed=args.seed)
+    await fake.start()
+    conn = WootConnector(bot_name="Replay Bot",
+                         account_id=None, access_key=None, inbox_id=None,
+                         chatwoot_url=fake.url,
+                         routes=routes_for(payloads),
+                         security_token="replay",
+                         bot_cache_path=None,
+                         webhook_queue_size=args.webhook_queue_size,
+                         webhook_workers=args.workers,
+                         outbound_concurrency=args.outbound_concurrency,
+                         retry_policy=RetryPolicy(max_attempts=8, deadline=60, base_delay=0.01, max_delay=0.5))
+    conn.gateway = ReplyGateway(conn)
+    conn.http.open()
+    app = FastAPI()
+    app.include_router(conn.get_router())
+    url = f"/chatwoot/webhook/{conn.security_token}"
+
+    speed = args.speed
+    post_lags: List[float] = []
+    # message id -> scheduled time and posted time of its first delivery
+    scheduled_at: Dict[Any, float] = {}
+    posted_at: Dict[Any, float] = {}
+    statuses: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def post(client: httpx.AsyncClient, due: float, record: Dict[str, Any]):
+        async with semaphore:
+            now = time.perf_counter()
+            post_lags.append(max(0.0, now - due))
+            if record.get("route") == "batch":
+                res = await client.post(url + "/batch", json=record["payload"])
+                events = record["payload"]
+            else:
+                res = await client.post(url, json=record["payload"])
+                events = [record["payload"]]
+            statuses[str(res.status_code)] = statuses.get(str(res.status_code), 0) + 1
+            for event in events:
+                if isinstance(event, dict) and event.get("id") is not None:
+                    scheduled_at.setdefault(event["id"], due)
+                    posted_at.setdefault(event["id"], now)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://replay") as client:
+        tasks = []
+        for offset, record in plan:
+            due = started + (offset / speed if speed else 0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(client, due, record)))
+        await asyncio.gather(*tasks)
+    posted = time.perf_counter()
+    await conn.webhook_queue.join()
+    await conn.outbound.flush()
+    finished = time.perf_counter()
+
+    answered_at: Dict[Any, float] = {}
+    for message in fake.messages:
+        answered_at.setdefault(message.content_attributes.get("in_reply_to"), message.received_at)
+    answer_lags = [answered_at[i] - at for i, at in scheduled_at.items() if i in answered_at]
+    answer_latencies = [answered_at[i] - at for i, at in posted_at.items() if i in answered_at]
+
+    await conn.webhook_queue.close()
+    await conn.outbound.close()
+    await conn.http.close()
+    await fake.close()
+
+    recorded = plan[-1][0] if plan else 0.0
+    return {
+        "benchmark": "replay",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "requests": len(plan),
+        "webhooks": len(payloads),
+        "statuses": statuses,
+        "answered": len(answer_lags),
+        "recorded_duration": round(recorded, 4),
+        "scheduled_duration": round(recorded / speed, 4) if speed else 0.0,
+        "post_duration": round(posted - started, 4),
+        "elapsed": round(finished - started, 4),
+        "webhooks_per_sec": round(len(payloads) / (posted - started), 2) if posted > started else None,
+        # how late the webhooks were posted, and answered, against the recorded schedule
+        "post_lag": summary(post_lags),
+        "answer_lag": summary(answer_lags),
+        "answer_latency": summary(answer_latencies),
+        "max_rss_kb": max_rss_kb(),
+        "chatwoot": fake.stats.to_dict(),
+        "webhook_queue": conn.webhook_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="Recording written by WebhookRecorder (.ndjson.gz or .ndjson)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, 1 = recorded pace, 0 = max speed")
+    parser.add_argument("--concurrency", type=int, default=100, help="Max requests in flight")
+    parser.add_argument("--workers", type=int, default=8, help="webhook_workers of the connector")
+    parser.add_argument("--webhook-queue-size", type=int, default=1000)
+    parser.add_argument("--outbound-concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every Chatwoot response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered 502")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Json file to save the results")
+    parser.add_argument("--verbose", action="store_true", help="Keep the connector logs")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        log.disable("celai_chatwoot")
+    results = asyncio.run(run(args))
+
+    def ms(values: Dict[str, Any]) -> str:
+        return ", ".join(f"{k} {v * 1000:.1f}ms" if v is not None else f"{k} -" for k, v in values.items())
+
+    print(f"replayed {results['webhooks']} webhooks ({results['requests']} requests) recorded in "
+          f"{results['recorded_duration']}s, posted in {results['post_duration']}s, done in {results['elapsed']}s")
+    print(f"statuses: {results['statuses']}, answered: {results['answered']}")
+    print(f"post lag: {ms(results['post_lag'])}")
+    print(f"answer lag: {ms(results['answer_lag'])}")
+    print(f"answer latency: {ms(results['answer_latency'])}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
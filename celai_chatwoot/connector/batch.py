@@ -0,0 +1,60 @@
+from typing import Any, AsyncIterator, Iterable, List, Optional, Tuple
+from celai_chatwoot.connector.webhook_filter import DecodeError, loads
+
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+class WebhookBatch(list):
+    """ Webhooks of the same conversation, processed in order by a single worker """
+
+
+class InvalidEvent:
+    """ Placeholder of an event that could not be decoded """
+    __slots__ = ("error",)
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """ Decode a NDJSON body while it is received, one event per line """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield decode_event(line)
+    if buffer.strip():
+        yield decode_event(buffer)
+
+
+def decode_event(line: bytes) -> Any:
+    try:
+        return loads(line)
+    except DecodeError as e:
+        return InvalidEvent(str(e))
+
+
+def conversation_key(payload: dict) -> Optional[Tuple[Any, Any]]:
+    account = payload.get("account") or {}
+    conversation = payload.get("conversation") or {}
+    if not isinstance(account, dict) or not isinstance(conversation, dict):
+        return None
+    return account.get("id"), conversation.get("id")
+
+
+def group_by_conversation(events: Iterable[Tuple[int, dict]]) -> List[Tuple[List[int], WebhookBatch]]:
+    """ Group (index, payload) pairs by conversation, keeping the order of the events
+    of each conversation. Returns the indexes and the batch of every conversation """
+    groups = {}
+    for index, payload in events:
+        key = conversation_key(payload)
+        # events without conversation are not ordered with any other event
+        key = key if key is not None and None not in key else ("index", index)
+        indexes, batch = groups.setdefault(key, ([], WebhookBatch()))
+        indexes.append(index)
+        batch.append(payload)
+    return list(groups.values())
@@ -1,7 +1,7 @@
 from typing import Optional, Dict
 from loguru import logger as log    
-import aiohttp
 from typing import Any, Dict, Optional
+from celai_chatwoot.connector.http_pool import ChatwootHttpPool
 
 class ChatwootAgentsBots:
     
@@ -10,7 +10,8 @@ class ChatwootAgentsBots:
                  account_id: str, 
                  access_key: str, 
                  headers: Optional[Dict[str, str]] = None,
-                 ssl: bool = False):
+                 ssl: bool = False,
+                 http: Optional[ChatwootHttpPool] = None):
         self.base_url = base_url
         self.account_id = account_id
         self.access_key = access_key
@@ -19,15 +20,14 @@ class ChatwootAgentsBots:
             'api_access_token': access_key
         })
         self.ssl = ssl
+        self.http = http or ChatwootHttpPool(ssl=ssl, persistent=False)
 
-    async def list_agent_bots(self) -> Dict[str, Any]:
+    async def list_agent_bots(self, page: Optional[int] = None) -> Dict[str, Any]:
         url = f"{self.base_url}/api/v1/accounts/{self.account_id}/agent_bots"
         log.debug(f"Listing agent bots from Chatwoot url: {url}")
 
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl)) as session:        
-            async with session.get(url, headers=self.headers) as response:
-                response_data = await response.json()
-                return response_data
+        params = {"page": page} if page is not None else None
+        return await self.http.request("GET", url, endpoint="agent_bots", account_id=self.account_id, params=params, headers=self.headers)
 
     async def create_agent_bot(self,
                                 name: Optional[str] = None,
@@ -46,28 +46,25 @@ class ChatwootAgentsBots:
 
         payload = {k: v for k, v in payload.items() if v is not None}
 
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl)) as session:
-            async with session.post(url, json=payload, headers=self.headers) as response:
-                response_data = await response.json()
-                return response_data
+        # if the bot was created by an attempt that timed out, don't create it twice
+        return await self.http.request("POST", url, 
+                                       endpoint="agent_bots", 
+                                       account_id=self.account_id, 
+                                       recover=(lambda: self.find_agent_bot_by_name(name)) if name else None,
+                                       json=payload, 
+                                       headers=self.headers)
 
     async def delete_agent_bot(self, agent_bot_id: str) -> Dict[str, Any]:
         url = f"{self.base_url}/api/v1/accounts/{self.account_id}/agent_bots/{agent_bot_id}"
         log.debug(f"Deleting agent bot from Chatwoot url: {url}")
 
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            async with session.delete(url, headers=self.headers) as response:
-                response_data = await response.json()
-                return response_data
+        return await self.http.request("DELETE", url, endpoint="agent_bots", account_id=self.account_id, headers=self.headers)
 
     async def get_agent_bot(self, agent_bot_id: str) -> Dict[str, Any]:
         url = f"{self.base_url}/api/v1/accounts/{self.account_id}/agent_bots/{agent_bot_id}"
         log.debug(f"Getting agent bot from Chatwoot url: {url}")
 
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl)) as session:
-            async with session.get(url, headers=self.headers) as response:
-                response_data = await response.json()
-                return response_data
+        return await self.http.request("GET", url, endpoint="agent_bots", account_id=self.account_id, headers=self.headers)
 
 
     async def update_agent_bot(self,
@@ -86,11 +83,7 @@ class ChatwootAgentsBots:
         }
 
         payload = {k: v for k, v in payload.items() if v is not None}
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl)) as session:
-        #async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            async with session.patch(url, json=payload, headers=self.headers) as response:
-                response_data = await response.json()
-                return response_data
+        return await self.http.request("PATCH", url, endpoint="agent_bots", account_id=self.account_id, json=payload, headers=self.headers)
 
 
 
@@ -101,6 +94,23 @@ class ChatwootAgentsBots:
         return bot
 
 
+    async def find_agent_bot_paginated(self, name: str, max_pages: int = 50) -> Optional[Dict[str, Any]]:
+        """ Look for the bot page by page, stopping at the page where it is found. 
+        Servers without pagination answer every page with the full list, 
+        a page without new bots ends the lookup """
+        seen = set()
+        for page in range(1, max_pages + 1):
+            bots = await self.list_agent_bots(page=page)
+            new_bots = [bot for bot in bots or [] if bot["id"] not in seen]
+            if not new_bots:
+                return None
+            bot = next((bot for bot in new_bots if bot["name"] == name), None)
+            if bot:
+                return bot
+            seen.update(bot["id"] for bot in new_bots)
+        return None
+
+
     async def upsert_bot(self,
                         name: Optional[str] = None,
                         description: Optional[str] = None,
@@ -125,10 +135,7 @@ class ChatwootAgentsBots:
             'agent_bot': agent_bot_id
         }
 
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl)) as session:
-            async with session.post(url, json=payload, headers=self.headers) as response:
-                response_data = await response.json()
-                return response_data
+        return await self.http.request("POST", url, endpoint="inboxes", account_id=self.account_id, json=payload, headers=self.headers)
 
 
 
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from loguru import logger as log
+from celai_chatwoot.connector.model.woot_message import WootMessage
+
+
+def merge_messages(messages: List[WootMessage]) -> WootMessage:
+    """ Merge a burst of messages of the same conversation into one message.
+    Texts are joined by new lines and attachments are concatenated.
+    The lead and date of the last message are kept."""
+    if len(messages) == 1:
+        return messages[0]
+
+    last = messages[-1]
+    texts = [m.text for m in messages if m.text]
+    attachments = [a for m in messages for a in (m.attachments or [])]
+    metadata = {**(last.metadata or {}), "merged_messages": len(messages)}
+    return WootMessage(lead=last.lead,
+                       text="\n".join(texts) if texts else last.text,
+                       date=last.date,
+                       metadata=metadata,
+                       attachments=attachments or None)
+
+
+@dataclass
+class DebouncedTurn:
+    """ Merged message queued for the gateway, `done` is resolved once it is answered """
+    message: WootMessage
+    done: asyncio.Future
+
+
+class _Burst:
+    __slots__ = ("messages", "first_at", "deadline", "task")
+
+    def __init__(self, message: WootMessage, deadline: float):
+        self.messages = [message]
+        self.first_at = time.monotonic()
+        self.deadline = deadline
+        self.task: Optional[asyncio.Task] = None
+
+
+class MessageDebouncer:
+    """ Coalesces bursts of incoming messages of the same conversation
+    (lead.get_session_id()) into a single message. A burst is closed when no
+    message arrives for `window` seconds, or `max_wait` seconds after its first message.
+    The turns of a conversation never overlap: a burst closed while the previous one is
+    still being handled waits for it, and keeps collecting messages meanwhile.
+
+    Args:
+        - handler[Callable]: Coroutine function called with the merged message,
+        it returns once the message is answered
+        - window[float]: Seconds of silence that close a burst
+        - max_wait[float]: Max seconds a message waits for the burst to be closed
+    """
+
+    def __init__(self,
+                 handler: Callable[[WootMessage], Awaitable[Any]],
+                 window: float = 2.0,
+                 max_wait: float = 5.0):
+        assert window > 0, "window must be greater than 0"
+        self.handler = handler
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self._bursts: Dict[str, _Burst] = {}
+        # the turn being handled of every conversation
+        self._turns: Dict[str, asyncio.Future] = {}
+        self._received = 0
+        self._dispatched = 0
+
+
+    def push(self, message: WootMessage):
+        """ Add a message to the burst of its conversation """
+        self._received += 1
+        key = message.lead.get_session_id()
+        now = time.monotonic()
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst(message, now + self.window)
+            burst.task = asyncio.get_running_loop().create_task(self.__wait(key, burst))
+            return
+
+        burst.messages.append(message)
+        burst.deadline = min(now + self.window, burst.first_at + self.max_wait)
+
+    async def __wait(self, key: str, burst: _Burst):
+        # the deadline moves forward while messages keep arriving
+        while (delay := burst.deadline - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        await self.__dispatch(key, burst)
+
+    async def __dispatch(self, key: str, burst: _Burst):
+        previous = self._turns.get(key)
+        if previous is not None:
+            # asyncio.wait does not cancel the previous turn if this task is cancelled
+            await asyncio.wait((previous,))
+        if self._bursts.get(key) is burst:
+            del self._bursts[key]
+        # no await since the previous turn check, the next burst waits for this one
+        done = self._turns[key] = asyncio.get_running_loop().create_future()
+        self._dispatched += 1
+        if len(burst.messages) > 1:
+            log.debug(f"Merged {len(burst.messages)} messages of {key}")
+        try:
+            await self.handler(merge_messages(burst.messages))
+        except Exception as e:
+            log.error(f"Error dispatching debounced messages of {key}: {e}")
+        finally:
+            done.set_result(None)
+            if self._turns.get(key) is done:
+                del self._turns[key]
+
+
+    async def flush(self, key: Optional[str] = None):
+        """ Dispatch the pending burst of a conversation (or all of them) now """
+        keys = [key] if key is not None else list(self._bursts)
+        for k in keys:
+            burst = self._bursts.get(k)
+            if burst is None:
+                continue
+            burst.task.cancel()
+            await self.__dispatch(k, burst)
+
+    def cancel(self, key: str) -> int:
+        """ Drop the pending burst of a conversation, returns the number of dropped messages """
+        burst = self._bursts.pop(key, None)
+        if burst is None:
+            return 0
+        burst.task.cancel()
+        return len(burst.messages)
+
+    async def close(self):
+        """ Dispatch every pending burst, their webhooks were already acknowledged """
+        await self.flush()
+
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_conversations": len(self._bursts),
+            "pending_messages": sum(len(b.messages) for b in self._bursts.values()),
+            "received": self._received,
+            "dispatched": self._dispatched,
+            "window": self.window,
+            "max_wait": self.max_wait
+        }
@@ -0,0 +1,113 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from loguru import logger as log
+
+
+class DedupBackend(ABC):
+    """ Storage of the webhook keys already seen. Implement this class
+    to share the seen-set between several replicas."""
+
+    @abstractmethod
+    async def check_and_set(self, key: str, ttl: float) -> bool:
+        """ Atomically mark the key as seen for ttl seconds.
+        Returns True if the key was not seen before."""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class MemoryDedupBackend(DedupBackend):
+    """ In process seen-set, bounded by number of keys and expiring by time.
+
+    Args:
+        - max_items[int]: Max number of keys kept, the oldest keys are dropped first
+    """
+
+    def __init__(self, max_items: int = 100_000):
+        self.max_items = max_items
+        self._seen: OrderedDict[str, float] = OrderedDict()
+
+    async def check_and_set(self, key: str, ttl: float) -> bool:
+        now = time.monotonic()
+        self.__expire(now)
+        expires_at = self._seen.get(key)
+        if expires_at is not None and expires_at > now:
+            return False
+        self._seen.pop(key, None)
+        self._seen[key] = now + ttl
+        while len(self._seen) > self.max_items:
+            self._seen.popitem(last=False)
+        return True
+
+    def __expire(self, now: float):
+        # keys are stored in insertion order with the same ttl, expired keys are at the front
+        while self._seen:
+            key, expires_at = next(iter(self._seen.items()))
+            if expires_at > now:
+                break
+            self._seen.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"keys": len(self._seen), "max_items": self.max_items}
+
+
+class RedisDedupBackend(DedupBackend):
+    """ Seen-set shared by several replicas, stored in Redis with SET NX PX.
+    Works with any client exposing the redis.asyncio set() signature.
+
+    Args:
+        - client: Async Redis client
+        - prefix[str]: Prefix of the keys
+    """
+
+    def __init__(self, client: Any, prefix: str = "celai:chatwoot:dedup:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def check_and_set(self, key: str, ttl: float) -> bool:
+        return bool(await self.client.set(f"{self.prefix}{key}", 1, nx=True, px=int(ttl * 1000)))
+
+
+class WebhookDeduplicator:
+    """ Drops webhooks redelivered by Chatwoot, keyed by (account_id, message id).
+
+    Args:
+        - backend[DedupBackend]: Seen-set storage, in memory by default
+        - ttl[float]: Seconds a message id is remembered
+    """
+
+    def __init__(self, backend: Optional[DedupBackend] = None, ttl: float = 600):
+        self.backend = backend or MemoryDedupBackend()
+        self.ttl = ttl
+        self._duplicates = 0
+        self._errors = 0
+
+    @staticmethod
+    def key_for(payload: dict) -> Optional[str]:
+        account_id = (payload.get("account") or {}).get("id")
+        messages = (payload.get("conversation") or {}).get("messages") or [{}]
+        message_id = (messages[0] or {}).get("id") or payload.get("id")
+        if account_id is None or message_id is None:
+            return None
+        return f"{account_id}:{message_id}"
+
+    async def is_duplicate(self, payload: dict) -> bool:
+        key = self.key_for(payload)
+        if key is None:
+            return False
+        try:
+            is_new = await self.backend.check_and_set(key, self.ttl)
+        except Exception as e:
+            # never drop a message because the seen-set is not available
+            self._errors += 1
+            log.warning(f"Error checking webhook {key} for duplicates: {e}")
+            return False
+        if not is_new:
+            self._duplicates += 1
+        return not is_new
+
+    def stats(self) -> Dict[str, Any]:
+        return {"duplicates": self._duplicates, "errors": self._errors, "ttl": self.ttl, **self.backend.stats()}
@@ -0,0 +1,69 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from loguru import logger as log
+
+
+class WootEvent:
+    """ Chatwoot agent bot events """
+    MESSAGE_CREATED = "message_created"
+    MESSAGE_UPDATED = "message_updated"
+    CONVERSATION_STATUS_CHANGED = "conversation_status_changed"
+    CONVERSATION_UPDATED = "conversation_updated"
+    CONVERSATION_OPENED = "conversation_opened"
+    CONVERSATION_RESOLVED = "conversation_resolved"
+    WEBWIDGET_TRIGGERED = "webwidget_triggered"
+
+
+# Events whose payload is a message, the other events carry a conversation
+MESSAGE_EVENTS = frozenset((WootEvent.MESSAGE_CREATED, WootEvent.MESSAGE_UPDATED))
+
+# Coroutine function called with the decoded webhook payload
+EventHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class EventDispatcher:
+    """ Table of handlers keyed by Chatwoot event. Events without handlers are
+    not accepted by the webhook route, so they only cost a dict lookup.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[EventHandler]] = {}
+        self._dispatched: Dict[str, int] = {}
+        self._failed = 0
+
+    def register(self, event: str, handler: EventHandler):
+        """ Add a handler for the event, handlers are called in registration order """
+        self._handlers.setdefault(event, []).append(handler)
+
+    def unregister(self, event: str, handler: Optional[EventHandler] = None):
+        """ Remove a handler of the event, or all of them """
+        if handler is None:
+            self._handlers.pop(event, None)
+            return
+        handlers = self._handlers.get(event, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self._handlers.pop(event, None)
+
+    def __contains__(self, event: str) -> bool:
+        return event in self._handlers
+
+    def events(self) -> List[str]:
+        return list(self._handlers)
+
+    async def dispatch(self, payload: Dict[str, Any]):
+        event = payload.get("event")
+        handlers = self._handlers.get(event)
+        if not handlers:
+            return
+        self._dispatched[event] = self._dispatched.get(event, 0) + 1
+        for handler in handlers:
+            try:
+                await handler(payload)
+            except Exception as e:
+                # a failing handler does not stop the others
+                self._failed += 1
+                log.error(f"Error handling Chatwoot {event} event: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"events": self.events(), "dispatched": dict(self._dispatched), "failed": self._failed}
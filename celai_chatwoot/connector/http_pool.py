@@ -0,0 +1,324 @@
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional
+from loguru import logger as log
+from celai_chatwoot.connector.metrics import ConnectorMetrics
+from celai_chatwoot.connector.rate_limit import ChatwootRateLimiter, parse_retry_after
+from celai_chatwoot.connector.retry import RetryPolicy
+from celai_chatwoot.connector.tracing import SpanKind, Tracer
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+class ChatwootApiError(Exception):
+    """ Raised when the Chatwoot API rejects a request """
+    def __init__(self, message: str, status: int = None, payload: Any = None):
+        super().__init__(message)
+        self.status = status
+        self.payload = payload
+
+
+class ChatwootRateLimitError(ChatwootApiError):
+    """ Raised when Chatwoot keeps answering 429 after all the retries """
+
+
+class ChatwootHttpPool:
+    """ Long-lived, pooled HTTP session shared by all the Chatwoot API clients
+    of a connector. The underlying aiohttp session is created lazily on first
+    use (or explicitly with open()) so it is always bound to the running loop.
+
+    Args:
+        - limit[int]: Max number of simultaneous connections (0 = no limit)
+        - limit_per_host[int]: Max number of simultaneous connections to the same host (0 = no limit)
+        - keepalive_timeout[float]: Seconds an idle connection is kept open for reuse
+        - dns_cache_ttl[int]: Seconds resolved DNS entries are cached (None = forever)
+        - ssl[bool]: SSL verification flag passed to the TCP connector
+        - persistent[bool]: If False, every request opens and closes its own session.
+        This is the behaviour of a standalone client without a connector.
+        - rate_limiter[ChatwootRateLimiter]: Optional client side rate limiter applied to every request
+        - retry_policy[RetryPolicy]: Retry policy for failed requests
+        - metrics[ConnectorMetrics]: Optional metrics, records the duration and 
+        status of every attempt and the bytes uploaded
+        - tracer[Tracer]: Optional tracer, every request is a client span of the current trace
+        - origin_limit[int]: Max number of simultaneous media downloads from their origin.
+        They have their own connections, an upload streamed from an url never waits 
+        for a connection of the Chatwoot pool held by its own download
+    """
+
+    def __init__(self,
+                 limit: int = 100,
+                 limit_per_host: int = 0,
+                 keepalive_timeout: float = 30.0,
+                 dns_cache_ttl: Optional[int] = 300,
+                 ssl: bool = False,
+                 persistent: bool = True,
+                 rate_limiter: Optional[ChatwootRateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 metrics: Optional[ConnectorMetrics] = None,
+                 tracer: Optional[Tracer] = None,
+                 origin_limit: int = 8):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.ssl = ssl
+        self.persistent = persistent
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics
+        self.tracer = tracer or Tracer()
+        self._retry_counters: Dict[str, Counter] = defaultdict(Counter)
+        # aiohttp is imported when the first session is opened
+        self._session: Optional['aiohttp.ClientSession'] = None
+        self._connector: Optional['aiohttp.TCPConnector'] = None
+        self.origin_limit = origin_limit
+        self._origin_session: Optional['aiohttp.ClientSession'] = None
+
+
+    def __build_connector(self) -> 'aiohttp.TCPConnector':
+        import aiohttp
+        return aiohttp.TCPConnector(ssl=self.ssl,
+                                    limit=self.limit,
+                                    limit_per_host=self.limit_per_host,
+                                    keepalive_timeout=self.keepalive_timeout,
+                                    ttl_dns_cache=self.dns_cache_ttl,
+                                    use_dns_cache=True)
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None or self._session.closed
+
+    def open(self) -> 'aiohttp.ClientSession':
+        """ Create the shared session if it does not exist yet.
+        Must be called from inside a running event loop."""
+        if self.closed:
+            import aiohttp
+            log.debug(f"Opening Chatwoot HTTP pool (limit: {self.limit}, per host: {self.limit_per_host})")
+            self._connector = self.__build_connector()
+            self._session = aiohttp.ClientSession(connector=self._connector, trace_configs=self.__trace_configs())
+        return self._session
+
+    async def close(self):
+        if not self.closed:
+            log.debug("Closing Chatwoot HTTP pool")
+            await self._session.close()
+        if self._origin_session is not None and not self._origin_session.closed:
+            await self._origin_session.close()
+        self._session = None
+        self._connector = None
+        self._origin_session = None
+
+    def __trace_configs(self) -> Optional[list]:
+        if self.metrics is None:
+            return None
+        import aiohttp
+        uploaded = self.metrics.uploaded
+        
+        async def on_chunk_sent(session, context, params):
+            # the labels are passed by request() as trace_request_ctx
+            if context.trace_request_ctx:
+                uploaded.inc(*context.trace_request_ctx, value=len(params.chunk))
+        
+        trace = aiohttp.TraceConfig()
+        trace.on_request_chunk_sent.append(on_chunk_sent)
+        return [trace]
+
+    @asynccontextmanager
+    async def session(self):
+        """ Yields an aiohttp session. The shared session is never closed here,
+        non persistent pools yield a short lived session instead."""
+        if not self.persistent:
+            import aiohttp
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl), 
+                                             trace_configs=self.__trace_configs()) as session:
+                yield session
+            return
+        yield self.open()
+
+    @asynccontextmanager
+    async def origin_session(self):
+        """ Yields the session used to download media from their origin (urls sent 
+        as attachments). It has its own small pool, separated from the Chatwoot 
+        connections, so a download and the upload it feeds never wait for each other """
+        if not self.persistent:
+            async with self.session() as session:
+                yield session
+            return
+        if self._origin_session is None or self._origin_session.closed:
+            import aiohttp
+            connector = aiohttp.TCPConnector(ssl=self.ssl,
+                                             limit=self.origin_limit,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=self.dns_cache_ttl,
+                                             use_dns_cache=True)
+            self._origin_session = aiohttp.ClientSession(connector=connector)
+        yield self._origin_session
+
+    async def request(self,
+                      method: str,
+                      url: str,
+                      endpoint: str = "api",
+                      account_id: Any = None,
+                      inbox_id: Any = None,
+                      data_factory: Optional[Callable[[], Any]] = None,
+                      recover: Optional[Callable[[], Awaitable[Any]]] = None,
+                      retry_policy: Optional[RetryPolicy] = None,
+                      **kwargs) -> Any:
+        """ Send a request through the pool and return the decoded JSON response.
+        Requests are paced by the rate limiter (if any). Network errors and
+        retryable statuses are retried with exponential backoff and jitter,
+        honouring Retry-After.
+        
+        Args:
+            - method[str]: HTTP method
+            - url[str]: Request url
+            - endpoint[str]: Endpoint name used for the retry counters
+            - account_id: Chatwoot account, used to select the rate limit bucket
+            - inbox_id: Chatwoot inbox, used to select the inbox rate limit bucket
+            - data_factory[Callable]: Builds the request body for every attempt, 
+            use it for bodies that can be sent only once like aiohttp.FormData
+            - recover[Callable]: Called before retrying a request that may have reached 
+            the server (timeouts, 5xx). If it returns something, the request is considered 
+            done and that value is returned. Used to avoid posting the same message twice.
+            - retry_policy[RetryPolicy]: Overrides the pool retry policy
+            - kwargs: Passed to aiohttp session.request
+            
+        Raises:
+            - ChatwootRateLimitError: Chatwoot kept answering 429
+            - ChatwootApiError: Chatwoot answered with an error status
+            - aiohttp.ClientError, asyncio.TimeoutError: Network errors after all the retries
+        """
+        with self.tracer.span(f"chatwoot.api {endpoint}", kind=SpanKind.CLIENT, **{
+                "http.request.method": method, 
+                "url.full": url,
+                "chatwoot.account_id": account_id,
+                "chatwoot.inbox_id": inbox_id}) as span:
+            return await self.__request(span, method, url, endpoint, account_id, inbox_id, 
+                                        data_factory, recover, retry_policy, kwargs)
+
+    async def __request(self, span, method, url, endpoint, account_id, inbox_id, data_factory, recover, retry_policy, kwargs) -> Any:
+        import aiohttp
+        policy = retry_policy or self.retry_policy
+        limiter = self.rate_limiter
+        started_at = time.monotonic()
+        attempt = 0
+        metrics = self.metrics
+        if metrics:
+            labels = ("" if account_id is None else str(account_id), "" if inbox_id is None else str(inbox_id), endpoint)
+            kwargs["trace_request_ctx"] = labels
+        
+        async with self.session() as session:
+            while True:
+                attempt += 1
+                span.set_attribute("chatwoot.attempts", attempt)
+                if limiter:
+                    await limiter.acquire(account_id, inbox_id)
+                if data_factory:
+                    kwargs["data"] = data_factory()
+                
+                retry_after = None
+                sent_at = time.perf_counter()
+                try:
+                    async with session.request(method, url, **kwargs) as response:
+                        status = response.status
+                        span.set_attribute("http.response.status_code", status)
+                        if metrics:
+                            metrics.requests.observe(time.perf_counter() - sent_at, *labels, str(status))
+                        if status < 400:
+                            if limiter:
+                                limiter.on_success(account_id, inbox_id)
+                            if attempt > 1:
+                                self.__count(endpoint, "recovered")
+                            return await self.__read_body(response)
+                        
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        if status == 429 and limiter:
+                            limiter.on_rate_limited(account_id, inbox_id, retry_after)
+                        
+                        if not policy.is_retryable(status) or \
+                                not self.__can_retry(policy, attempt, started_at, retry_after):
+                            self.__count(endpoint, "failed")
+                            error = ChatwootRateLimitError if status == 429 else ChatwootApiError
+                            raise error(f"Chatwoot API error {status}: {method} {url}",
+                                        status=status,
+                                        payload=await self.__read_body(response))
+                        reason = str(status)
+                        
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if metrics:
+                        metrics.requests.observe(time.perf_counter() - sent_at, *labels, type(e).__name__)
+                    if not self.__can_retry(policy, attempt, started_at):
+                        self.__count(endpoint, "failed")
+                        raise
+                    reason = type(e).__name__
+                
+                self.__count(endpoint, "retries")
+                # with a rate limiter the bucket is already blocked until Retry-After
+                delay = policy.backoff(attempt, None if limiter else retry_after)
+                log.warning(f"Chatwoot {endpoint} request failed ({reason}), retry {attempt} in {delay:.2f}s: {method} {url}")
+                span.add_event("retry", reason=reason, attempt=attempt, delay=round(delay, 3))
+                await asyncio.sleep(delay)
+                
+                # 429 is never processed by the server, everything else may have been
+                if recover and reason != "429":
+                    recovered = await recover()
+                    if recovered is not None:
+                        log.debug(f"Chatwoot {endpoint} request already processed, not sending it again")
+                        self.__count(endpoint, "recovered")
+                        span.set_attribute("chatwoot.recovered", True)
+                        return recovered
+
+
+    def __can_retry(self, policy: RetryPolicy, attempt: int, started_at: float, retry_after: float = None) -> bool:
+        if attempt >= policy.max_attempts:
+            return False
+        elapsed = time.monotonic() - started_at
+        return elapsed + (retry_after or 0) < policy.deadline
+
+    @staticmethod
+    async def __read_body(response: 'aiohttp.ClientResponse') -> Any:
+        text = await response.text()
+        if not text:
+            return None
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
+
+    def __count(self, endpoint: str, counter: str):
+        self._retry_counters[endpoint][counter] += 1
+
+    def retry_stats(self) -> Dict[str, Dict[str, int]]:
+        """ Retry counters per endpoint: retries made, requests recovered after 
+        a retry and requests failed after all the retries """
+        return {endpoint: dict(counters) for endpoint, counters in self._retry_counters.items()}
+
+
+    def stats(self) -> Dict[str, Any]:
+        """ Connection pool statistics: connections in use, idle connections
+        kept alive for reuse and requests waiting for a free connection."""
+        conn = self._connector
+        if self.closed or conn is None:
+            return {"open": False, "in_use": 0, "idle": 0, "waiting": 0,
+                    "limit": self.limit, "limit_per_host": self.limit_per_host}
+
+        # aiohttp does not expose these counters publicly
+        acquired = getattr(conn, "_acquired", ())
+        conns = getattr(conn, "_conns", {})
+        waiters = getattr(conn, "_waiters", {})
+        return {
+            "open": True,
+            "in_use": len(acquired),
+            "idle": sum(len(c) for c in conns.values()),
+            "waiting": sum(len(w) for w in waiters.values()),
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host
+        }
+
+    def throttle(self) -> Dict[str, float]:
+        """ Current throttle gauge per rate limit bucket """
+        return self.rate_limiter.throttle() if self.rate_limiter else {}
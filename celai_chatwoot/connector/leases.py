@@ -0,0 +1,305 @@
+import asyncio
+import itertools
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+from loguru import logger as log
+
+
+class LeaseTimeoutError(TimeoutError):
+    def __init__(self, key: str, holder: Optional[str]):
+        super().__init__(f"Conversation {key} is held by {holder}")
+        self.key = key
+        self.holder = holder
+
+
+@dataclass
+class LeaseRetry:
+    """ Queued to try again to take the lease of a conversation
+    whose messages wait on this replica """
+    key: str
+    attempt: int = 0
+    # when the oldest message started waiting
+    since: float = 0.0
+
+
+class LeaseBackend(ABC):
+    """ Storage of the conversation leases. A lease is a key owned by a
+    holder until it expires, shared by every replica that uses the backend."""
+
+    @abstractmethod
+    async def acquire(self, key: str, holder: str, ttl: float) -> bool:
+        """ Take the lease if it is free or expired, or extend it if the holder
+        already owns it. Returns True if the holder owns the lease """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def release(self, key: str, holder: str):
+        """ Free the lease if the holder owns it """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def holder(self, key: str) -> Optional[str]:
+        """ Current holder of the lease, None if it is free """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class MemoryLeaseBackend(LeaseBackend):
+    """ Leases of a single process, orders the work of a conversation between workers """
+
+    def __init__(self):
+        self._leases: Dict[str, Tuple[str, float]] = {}
+
+    async def acquire(self, key: str, holder: str, ttl: float) -> bool:
+        now = time.monotonic()
+        current = self._leases.get(key)
+        if current is not None and current[0] != holder and current[1] > now:
+            return False
+        self._leases[key] = (holder, now + ttl)
+        return True
+
+    async def release(self, key: str, holder: str):
+        current = self._leases.get(key)
+        if current is not None and current[0] == holder:
+            del self._leases[key]
+
+    async def holder(self, key: str) -> Optional[str]:
+        current = self._leases.get(key)
+        if current is None or current[1] <= time.monotonic():
+            return None
+        return current[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"leases": len(self._leases)}
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """ Leases shared by the replicas of one host through a SQLite file.
+
+    Args:
+        - path[str]: Path of the database file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS leases ("
+                         "key TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def __acquire(self, key: str, holder: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO leases (key, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at <= ?",
+                (key, holder, now + ttl, now))
+            return cursor.rowcount == 1
+
+    def __release(self, key: str, holder: str):
+        with self._lock:
+            self._db.execute("DELETE FROM leases WHERE key = ? AND holder = ?", (key, holder))
+
+    def __holder(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT holder FROM leases WHERE key = ? AND expires_at > ?",
+                                   (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    async def acquire(self, key: str, holder: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self.__acquire, key, holder, ttl)
+
+    async def release(self, key: str, holder: str):
+        await asyncio.to_thread(self.__release, key, holder)
+
+    async def holder(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.__holder, key)
+
+    def close(self):
+        self._db.close()
+
+
+class RedisLeaseBackend(LeaseBackend):
+    """ Leases shared by every replica through Redis. Uses get, set (nx, px) and eval:
+    a lease is only extended or deleted by a Lua script that checks its holder first,
+    so a replica never frees a lease expired and taken by another one in between.
+    The client must support eval with the redis.asyncio signature, 
+    eval(script, numkeys, *keys_and_args).
+
+    Args:
+        - client: Async Redis client
+        - prefix[str]: Prefix of the keys
+    """
+
+    # compare and extend, compare and delete
+    EXTEND_SCRIPT = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                     "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end")
+    RELEASE_SCRIPT = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                      "return redis.call('del', KEYS[1]) else return 0 end")
+
+    def __init__(self, client: Any, prefix: str = "celai:chatwoot:lease:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def __get(self, key: str) -> Optional[str]:
+        value = await self.client.get(f"{self.prefix}{key}")
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def acquire(self, key: str, holder: str, ttl: float) -> bool:
+        ms = max(1, int(ttl * 1000))
+        if await self.client.set(f"{self.prefix}{key}", holder, nx=True, px=ms):
+            return True
+        # extend our own lease, fails if it expired and was taken in between
+        return bool(await self.client.eval(self.EXTEND_SCRIPT, 1, f"{self.prefix}{key}", holder, ms))
+
+    async def release(self, key: str, holder: str):
+        await self.client.eval(self.RELEASE_SCRIPT, 1, f"{self.prefix}{key}", holder)
+
+    async def holder(self, key: str) -> Optional[str]:
+        return await self.__get(key)
+
+
+class ConversationLeases:
+    """ Ownership of conversations between connector replicas, keyed by
+    lead.get_session_id(). The work of a conversation runs while its lease is held,
+    so two replicas never generate answers for the same conversation at once.
+
+    Args:
+        - backend[LeaseBackend]: Lease storage, in memory by default
+        - ttl[float]: Seconds a lease lasts without renewal, held leases are renewed every ttl / 3
+        - wait[float]: Max seconds to wait for a lease held by another replica
+        - owner[str]: Id of this replica, defaults to host:pid
+    """
+
+    def __init__(self,
+                 backend: Optional[LeaseBackend] = None,
+                 ttl: float = 30.0,
+                 wait: float = 60.0,
+                 owner: Optional[str] = None):
+        self.backend = backend or MemoryLeaseBackend()
+        self.ttl = ttl
+        self.wait = wait
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        # every hold has its own holder id, so workers of the same replica exclude each other too
+        self._prefix = f"{self.owner}/{uuid.uuid4().hex[:8]}"
+        self._counter = itertools.count()
+        # local waiters of a conversation, in arrival order
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+        self._held = 0
+        self._acquired = 0
+        self._contended = 0
+        self._timeouts = 0
+        self._waited = 0.0
+
+    @staticmethod
+    def owner_of(holder: Optional[str]) -> Optional[str]:
+        """ Replica id of a holder """
+        return holder.split("/", 1)[0] if holder else None
+
+    async def try_acquire(self, key: str) -> Optional[str]:
+        """ Take the lease without waiting. Returns the holder id, None if it is taken """
+        holder = f"{self._prefix}/{next(self._counter)}"
+        if await self.backend.acquire(key, holder, self.ttl):
+            self._acquired += 1
+            return holder
+        return None
+
+    async def holder(self, key: str) -> Optional[str]:
+        return await self.backend.holder(key)
+
+    async def acquire(self, key: str, timeout: Optional[float] = None) -> str:
+        """ Wait until the lease is free and take it. Waiters of this process
+        take the lease in arrival order, only the oldest one polls the backend.
+        Raises LeaseTimeoutError """
+        if key not in self._waiters:
+            holder = await self.try_acquire(key)
+            if holder is not None:
+                return holder
+
+        self._contended += 1
+        started = time.monotonic()
+        deadline = started + (self.wait if timeout is None else timeout)
+        delay = 0.01
+        waiters = self._waiters.setdefault(key, deque())
+        turn = asyncio.get_running_loop().create_future()
+        if not waiters:
+            turn.set_result(None)
+        waiters.append(turn)
+        try:
+            try:
+                await asyncio.wait_for(asyncio.shield(turn), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                raise LeaseTimeoutError(key, await self.backend.holder(key))
+            while True:
+                if time.monotonic() >= deadline:
+                    self._timeouts += 1
+                    raise LeaseTimeoutError(key, await self.backend.holder(key))
+                await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+                delay = min(delay * 2, 0.5)
+                holder = await self.try_acquire(key)
+                if holder is not None:
+                    return holder
+        finally:
+            self._waited += time.monotonic() - started
+            waiters.remove(turn)
+            if waiters:
+                if not waiters[0].done():
+                    waiters[0].set_result(None)
+            elif self._waiters.get(key) is waiters:
+                del self._waiters[key]
+
+    async def release(self, key: str, holder: str):
+        try:
+            await self.backend.release(key, holder)
+        except Exception as e:
+            # the lease expires anyway
+            log.warning(f"Error releasing conversation lease {key}: {e}")
+
+    @asynccontextmanager
+    async def hold(self, key: str, holder: Optional[str] = None) -> AsyncIterator[str]:
+        """ Hold the lease of the conversation while the block runs, renewing it.
+        Pass the holder returned by try_acquire() to use a lease already taken """
+        holder = holder or await self.acquire(key)
+        renew = asyncio.get_running_loop().create_task(self.__renew(key, holder))
+        self._held += 1
+        try:
+            yield holder
+        finally:
+            self._held -= 1
+            renew.cancel()
+            await self.release(key, holder)
+
+    async def __renew(self, key: str, holder: str):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await self.backend.acquire(key, holder, self.ttl):
+                    log.warning(f"Conversation lease {key} was lost")
+                    return
+            except Exception as e:
+                log.warning(f"Error renewing conversation lease {key}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "owner": self.owner,
+            "held": self._held,
+            "acquired": self._acquired,
+            "contended": self._contended,
+            "timeouts": self._timeouts,
+            "waited_seconds": round(self._waited, 3),
+            **self.backend.stats()
+        }
@@ -0,0 +1,332 @@
+import asyncio
+import base64
+import math
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Optional
+from loguru import logger as log
+from celai_chatwoot.connector.http_pool import ChatwootHttpPool
+from celai_chatwoot.connector.media_cache import CachedMedia, MediaCache
+
+if TYPE_CHECKING:
+    from aiohttp import payload as aiohttp_payload
+
+
+# filetype needs at most the first 261 bytes to guess the file type
+SNIFF_BYTES = 261
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MIME = "application/octet-stream"
+# non seekable file objects are spooled to a temporary file past this size
+SPOOL_MEMORY_BYTES = 1024 * 1024
+
+
+def sniff_mime(header: bytes, filename: Optional[str] = None, default: str = DEFAULT_MIME) -> str:
+    """ Guess the mime type from the first bytes of the content,
+    then from the file name extension """
+    import filetype
+    kind = filetype.guess(bytes(header[:SNIFF_BYTES])) if header else None
+    if kind:
+        return kind.mime
+    if filename:
+        return mimetypes.guess_type(filename)[0] or default
+    return default
+
+
+def default_filename(type: Optional[str], mime: str) -> str:
+    if type and type.startswith("audio") and mime in ("audio/ogg", DEFAULT_MIME):
+        return "audio.ogg"
+    ext = mimetypes.guess_extension(mime) or ""
+    return f"{(type or 'file').split('/')[0]}{ext}"
+
+
+class OutboundMedia:
+    """ Content of an outgoing attachment. The content is not loaded in memory,
+    payload() returns a new streaming aiohttp payload every time it is called
+    (one per request attempt).
+
+    Args:
+        - mime[str]: Mime type of the content
+        - filename[str]: File name sent to Chatwoot
+        - payload_factory[Callable]: Builds the aiohttp payload
+        - size[int]: Content size in bytes, if known
+    """
+
+    def __init__(self,
+                 mime: str,
+                 filename: str,
+                 payload_factory: Callable[[], 'aiohttp_payload.Payload'],
+                 size: Optional[int] = None):
+        self.mime = mime
+        self.filename = filename
+        self.size = size
+        self.__payload_factory = payload_factory
+
+    def payload(self) -> 'aiohttp_payload.Payload':
+        return self.__payload_factory()
+
+    def __repr__(self):
+        return f"OutboundMedia: {self.filename} ({self.mime}, {self.size} bytes)"
+
+
+# Payload builders
+# -------------------------------------------------------------
+def _payloads():
+    # aiohttp is imported when the first attachment is sent
+    from aiohttp import payload
+    return payload
+
+
+def _buffer_media(buffer: bytes | bytearray | memoryview, mime: Optional[str], filename: Optional[str], type: str) -> OutboundMedia:
+    view = memoryview(buffer)
+    mime = mime or sniff_mime(view[:SNIFF_BYTES], filename)
+    filename = filename or default_filename(type, mime)
+    # BytesPayload keeps a reference to the buffer, no copy is made
+    return OutboundMedia(mime, filename,
+                         lambda: _payloads().BytesPayload(buffer, content_type=mime),
+                         size=view.nbytes)
+
+
+def _path_media(path: str, mime: Optional[str], filename: Optional[str], type: str) -> OutboundMedia:
+    if not mime:
+        with open(path, "rb") as f:
+            mime = sniff_mime(f.read(SNIFF_BYTES), filename or path)
+    filename = filename or os.path.basename(path) or default_filename(type, mime)
+    # the file is opened on every attempt, aiohttp reads it by chunks
+    # in a thread and closes it when the request is sent
+    return OutboundMedia(mime, filename,
+                         lambda: _payloads().BufferedReaderPayload(open(path, "rb"), content_type=mime),
+                         size=os.path.getsize(path))
+
+
+async def _iter_file(file: Any, start: int) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    file.seek(start)
+    while True:
+        chunk = await loop.run_in_executor(None, file.read, CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def _spool(file: Any) -> Any:
+    # the upload may be retried, a stream that can only be read once is copied before the first attempt
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    await asyncio.get_running_loop().run_in_executor(None, shutil.copyfileobj, file, spool, CHUNK_SIZE)
+    spool.seek(0)
+    return spool
+
+
+async def _fileobj_media(file: Any, mime: Optional[str], filename: Optional[str], type: str) -> OutboundMedia:
+    name = getattr(file, "name", None)
+    if not file.seekable():
+        # the spool is owned by the payload factory and deleted with it
+        file = await _spool(file)
+    start = file.tell()
+    if not mime:
+        header = file.read(SNIFF_BYTES)
+        file.seek(start)
+        mime = sniff_mime(header, filename or name)
+    filename = filename or os.path.basename(str(name or "")) or default_filename(type, mime)
+    # the caller owns the file object, it is not closed after the upload
+    return OutboundMedia(mime, filename,
+                         lambda: _payloads().AsyncIterablePayload(_iter_file(file, start), content_type=mime))
+
+
+async def _iter_url(http: ChatwootHttpPool, url: str) -> AsyncIterator[bytes]:
+    # the origin session has its own connections, the upload holds one of the Chatwoot pool
+    async with http.origin_session() as session:
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                yield chunk
+
+
+async def _read_head(resp) -> bytes:
+    """ First bytes of the body, enough to sniff the mime type """
+    head = b""
+    while len(head) < SNIFF_BYTES:
+        chunk = await resp.content.read(SNIFF_BYTES - len(head))
+        if not chunk:
+            break
+        head += chunk
+    return head
+
+
+def _content_type(headers) -> str:
+    return headers.get("Content-Type", "").split(";")[0].strip()
+
+
+def _streamed_url_media(http: ChatwootHttpPool, url: str, mime: str, filename: Optional[str], type: str, size: Optional[int]) -> OutboundMedia:
+    filename = filename or url.split("?")[0].rstrip("/").split("/")[-1] or default_filename(type, mime)
+    return OutboundMedia(mime, filename,
+                         lambda: _payloads().AsyncIterablePayload(_iter_url(http, url), content_type=mime),
+                         size=size)
+
+
+async def _url_media(http: ChatwootHttpPool, url: str, mime: Optional[str], filename: Optional[str], type: str) -> OutboundMedia:
+    size = None
+    if not mime:
+        # only the header bytes are downloaded to detect the mime type
+        async with http.origin_session() as session:
+            async with session.get(url, headers={"Range": f"bytes=0-{SNIFF_BYTES - 1}"}) as resp:
+                resp.raise_for_status()
+                header = await _read_head(resp)
+                content_range = resp.headers.get("Content-Range", "")
+                if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                    size = int(content_range.rsplit("/", 1)[1])
+                content_type = _content_type(resp.headers)
+        mime = sniff_mime(header, url.split("?")[0], default=content_type or DEFAULT_MIME)
+    return _streamed_url_media(http, url, mime, filename, type, size)
+
+
+# Cached sources
+# -------------------------------------------------------------
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _cached_path_media(cache: MediaCache, path: str, mime: Optional[str], filename: Optional[str], type: str) -> OutboundMedia:
+    filename = filename or os.path.basename(path)
+    key = cache.file_key(path)
+    entry = await cache.get(key) if key else None
+    if entry is not None:
+        cache.hit()
+        return _buffer_media(entry.data, mime or entry.mime, filename, type)
+
+    cache.miss()
+    data = await asyncio.to_thread(_read_file, path)
+    key = cache.content_key(data)
+    # the same content may be cached from another path
+    entry = await cache.get(key)
+    if entry is None:
+        entry = CachedMedia(data=data, mime=sniff_mime(data, path), fresh_until=math.inf)
+        await cache.put(key, entry)
+    cache.remember_file(path, key)
+    return _buffer_media(entry.data, mime or entry.mime, filename, type)
+
+
+def _max_age(headers) -> Optional[float]:
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name.lower() == "max-age" and value.isdigit():
+            return float(value)
+    return None
+
+
+async def _read_bounded(resp, limit: int) -> tuple[Optional[bytes], bytes]:
+    """ Read the whole body, or None if it is bigger than limit, 
+    and the first bytes of the body """
+    chunks, size = [], 0
+    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+        size += len(chunk)
+        chunks.append(chunk)
+        if size > limit:
+            # chunks are never empty, the first SNIFF_BYTES chunks hold the first bytes
+            return None, b"".join(chunks[:SNIFF_BYTES])[:SNIFF_BYTES]
+    data = b"".join(chunks)
+    return data, data[:SNIFF_BYTES]
+
+
+async def _cached_url_media(cache: MediaCache, http: ChatwootHttpPool, url: str, mime: Optional[str], filename: Optional[str], type: str) -> OutboundMedia:
+    filename = filename or url.split("?")[0].rstrip("/").split("/")[-1] or None
+    key = cache.url_key(url)
+    entry = await cache.get(key)
+    if entry is not None and entry.is_fresh():
+        cache.hit()
+        return _buffer_media(entry.data, mime or entry.mime, filename, type)
+
+    headers = {}
+    if entry is not None and entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry is not None and entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+
+    async with http.origin_session() as session:
+        async with session.get(url, headers=headers) as resp:
+            max_age = _max_age(resp.headers)
+            if resp.status == 304 and entry is not None:
+                cache.revalidated(entry, max_age)
+                cache.hit()
+                return _buffer_media(entry.data, mime or entry.mime, filename, type)
+            resp.raise_for_status()
+
+            cacheable = "no-store" not in resp.headers.get("Cache-Control", "")
+            length = resp.content_length
+            content_type = _content_type(resp.headers)
+            data = head = None
+            if cacheable and (length is None or length <= cache.max_entry_bytes):
+                data, head = await _read_bounded(resp, cache.max_entry_bytes)
+            if data is not None:
+                cache.miss()
+                entry = CachedMedia(data=data,
+                                    mime=sniff_mime(data, url.split("?")[0], default=content_type or DEFAULT_MIME),
+                                    etag=resp.headers.get("ETag"),
+                                    last_modified=resp.headers.get("Last-Modified"),
+                                    fresh_until=time.time() + (cache.ttl if max_age is None else max_age))
+                await cache.put(key, entry)
+                return _buffer_media(entry.data, mime or entry.mime, filename, type)
+
+            if not mime:
+                # the first bytes of this response are enough to detect the mime type
+                mime = sniff_mime(head if head is not None else await _read_head(resp),
+                                  url.split("?")[0], default=content_type or DEFAULT_MIME)
+
+    # too big to be cached, the upload streams it from the origin
+    cache.miss()
+    return _streamed_url_media(http, url, mime, filename, type, length)
+
+
+def _decode_base64(content: str) -> tuple[bytes, Optional[str]]:
+    mime = None
+    if content.startswith("data:"):
+        header, content = content.split(",", 1)
+        mime = header[5:].split(";")[0] or None
+    return base64.b64decode(content), mime
+
+
+async def resolve_media(content: Any,
+                        http: ChatwootHttpPool,
+                        type: str = None,
+                        filename: Optional[str] = None,
+                        mime: Optional[str] = None,
+                        cache: Optional[MediaCache] = None) -> OutboundMedia:
+    """ Resolve the content of an outgoing attachment without loading it in memory.
+    Local files and urls small enough to be cached are served from the media cache (if any).
+
+    Args:
+        - content: A file path, an http(s) url, a file object, bytes/bytearray/memoryview,
+        a data url or a base64 string
+        - http[ChatwootHttpPool]: Pool used to download remote content
+        - type[str]: Attachment type (image, audio, ...)
+        - filename[str]: File name, guessed from the content if not set
+        - mime[str]: Mime type, sniffed from the first bytes of the content if not set
+        - cache[MediaCache]: Cache for repeated media
+    """
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return _buffer_media(content, mime, filename, type)
+
+    if hasattr(content, "read"):
+        return await _fileobj_media(content, mime, filename, type)
+
+    if isinstance(content, os.PathLike) or (isinstance(content, str) and os.path.exists(content)):
+        path = os.fspath(content)
+        if cache and os.path.getsize(path) <= cache.max_entry_bytes:
+            return await _cached_path_media(cache, path, mime, filename, type)
+        return _path_media(path, mime, filename, type)
+
+    if isinstance(content, str) and content.startswith(("http://", "https://")):
+        if cache:
+            return await _cached_url_media(cache, http, content, mime, filename, type)
+        return await _url_media(http, content, mime, filename, type)
+
+    if isinstance(content, str) and (content.startswith("data:") or len(content) > 100):
+        # base64 content is the only case that needs to be decoded in memory
+        log.debug("Decoding base64 attachment content")
+        buffer, data_mime = _decode_base64(content)
+        return _buffer_media(buffer, mime or data_mime, filename, type)
+
+    raise ValueError(f"{type or 'attachment'} must be a url/path to a file, a file object, a bytes object or a base64 string")
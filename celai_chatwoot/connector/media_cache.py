@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+from loguru import logger as log
+
+
+@dataclass
+class CachedMedia:
+    data: bytes
+    mime: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # epoch seconds until the entry can be used without revalidation
+    fresh_until: float = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.fresh_until
+
+
+class MediaCache:
+    """ Bounded LRU cache for outgoing media: a memory tier plus an optional disk tier.
+    Entries are keyed by url (revalidated with ETag/Last-Modified once stale) or by
+    the sha256 of the content for local files. Each entry holds the content and its
+    sniffed mime type, so repeated sends don't fetch, read or sniff the media again.
+
+    Args:
+        - max_bytes[int]: Max size of the memory tier
+        - max_entry_bytes[int]: Bigger media is never cached, it is streamed from its source
+        - ttl[float]: Seconds an url entry is used without revalidation,
+        unless the origin sends Cache-Control max-age
+        - disk_path[str]: Directory of the disk tier, None to disable it
+        - disk_max_bytes[int]: Max size of the disk tier
+    """
+
+    def __init__(self,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 max_entry_bytes: int = 8 * 1024 * 1024,
+                 ttl: float = 300,
+                 disk_path: Optional[str] = None,
+                 disk_max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory: OrderedDict[str, CachedMedia] = OrderedDict()
+        self._memory_bytes = 0
+        # local file (path, size, mtime) -> content key, avoids hashing unchanged files
+        self._files: OrderedDict[Tuple[str, int, int], str] = OrderedDict()
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
+
+        if disk_path:
+            os.makedirs(disk_path, exist_ok=True)
+            self.__load_disk_index()
+
+
+    # Keys
+    # -------------------------------------------------------------
+    @staticmethod
+    def url_key(url: str) -> str:
+        return f"url:{url}"
+
+    @staticmethod
+    def content_key(data: bytes | memoryview) -> str:
+        return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+    def file_key(self, path: str) -> Optional[str]:
+        """ Content key of a local file already seen with the same size and mtime """
+        st = os.stat(path)
+        key = self._files.get((path, st.st_size, st.st_mtime_ns))
+        return key
+
+    def remember_file(self, path: str, key: str):
+        st = os.stat(path)
+        self._files[(path, st.st_size, st.st_mtime_ns)] = key
+        # the file index is tiny, keep it bounded anyway
+        while len(self._files) > 10_000:
+            self._files.popitem(last=False)
+
+
+    # Lookup
+    # -------------------------------------------------------------
+    async def get(self, key: str) -> Optional[CachedMedia]:
+        """ Returns the entry (fresh or stale) or None. Stale url entries
+        must be revalidated by the caller."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+
+        if key in self._disk:
+            entry = await asyncio.to_thread(self.__read_disk, key)
+            if entry is None:
+                self._disk_bytes -= self._disk.pop(key, 0)
+                return None
+            self._disk.move_to_end(key)
+            self._counters["disk_hits"] += 1
+            self.__put_memory(key, entry)
+            return entry
+        return None
+
+    def hit(self):
+        self._counters["hits"] += 1
+
+    def miss(self):
+        self._counters["misses"] += 1
+
+    def revalidated(self, entry: CachedMedia, fresh_for: Optional[float] = None):
+        """ The origin answered 304, the entry can be used again """
+        self._counters["revalidated"] += 1
+        entry.fresh_until = time.time() + (self.ttl if fresh_for is None else fresh_for)
+
+    async def put(self, key: str, entry: CachedMedia):
+        if entry.size > self.max_entry_bytes:
+            return
+        self.__put_memory(key, entry)
+        if self.disk_path and await asyncio.to_thread(self.__write_disk, key, entry):
+            self.__index_disk(key, entry.size)
+
+
+    # Memory tier
+    # -------------------------------------------------------------
+    def __put_memory(self, key: str, entry: CachedMedia):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old.size
+        self._memory[key] = entry
+        self._memory_bytes += entry.size
+        while self._memory_bytes > self.max_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.size
+            self._counters["evictions"] += 1
+
+
+    # Disk tier
+    # -------------------------------------------------------------
+    def __disk_file(self, key: str) -> str:
+        return os.path.join(self.disk_path, hashlib.sha256(key.encode()).hexdigest())
+
+    def __load_disk_index(self):
+        files = []
+        for name in os.listdir(self.disk_path):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.disk_path, name)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                files.append((os.path.getmtime(meta_path), meta["key"], meta["size"]))
+            except (OSError, ValueError, KeyError):
+                continue
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_bytes += size
+        log.debug(f"Media cache disk tier loaded: {len(self._disk)} entries, {self._disk_bytes} bytes")
+
+    def __read_disk(self, key: str) -> Optional[CachedMedia]:
+        path = self.__disk_file(key)
+        try:
+            with open(f"{path}.json") as f:
+                meta = json.load(f)
+            with open(path, "rb") as f:
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        return CachedMedia(data=data,
+                           mime=meta["mime"],
+                           etag=meta.get("etag"),
+                           last_modified=meta.get("last_modified"),
+                           fresh_until=meta.get("fresh_until", 0))
+
+    def __write_disk(self, key: str, entry: CachedMedia) -> bool:
+        path = self.__disk_file(key)
+        meta = {"key": key,
+                "size": entry.size,
+                "mime": entry.mime,
+                "etag": entry.etag,
+                "last_modified": entry.last_modified,
+                "fresh_until": entry.fresh_until}
+        try:
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(entry.data)
+            os.replace(f"{path}.tmp", path)
+            with open(f"{path}.json", "w") as f:
+                json.dump(meta, f)
+        except OSError as e:
+            log.warning(f"Error writing media cache entry to disk: {e}")
+            return False
+        return True
+
+    def __index_disk(self, key: str, size: int):
+        self._disk_bytes += size - self._disk.pop(key, 0)
+        self._disk[key] = size
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            evicted, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._counters["evictions"] += 1
+            evicted_path = self.__disk_file(evicted)
+            for p in (evicted_path, f"{evicted_path}.json"):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._counters["hits"] + self._counters["misses"]
+        return {
+            **self._counters,
+            "hit_ratio": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._memory),
+            "bytes": self._memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes
+        }
@@ -0,0 +1,176 @@
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+Labels = Tuple[str, ...]
+
+# seconds, from a cached parse to a slow LLM answer
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[Any]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """ Monotonic counter with labels. Label values are passed positionally,
+    in the order of labelnames, so an observation is a single dict update. """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: Any, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels: Any) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for labels, value in self._values.items():
+            yield self.name + "_total", _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """ Histogram with fixed buckets and labels. Counts are kept per bucket
+    and made cumulative when rendered.
+
+    Args:
+        - name[str]: Metric name
+        - help[str]: Metric description
+        - labelnames[Tuple[str]]: Label names
+        - buckets[Tuple[float]]: Sorted upper bounds, +Inf is added
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # per series: [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: Any):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels: Any) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def sum(self, *labels: Any) -> float:
+        series = self._series.get(labels)
+        return series[-1] if series else 0.0
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        names = self.labelnames + ("le",)
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                yield self.name + "_bucket", _format_labels(names, labels + (_format_value(bound),)), cumulative
+            yield self.name + "_count", _format_labels(self.labelnames, labels), cumulative
+            yield self.name + "_sum", _format_labels(self.labelnames, labels), series[-1]
+
+
+class Gauge:
+    """ Gauge read when the metrics are rendered, the callback returns
+    a value or a dict of label values tuples to values. """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Callable[[], Any], labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.callback = callback
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        value = self.callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, v in value.items():
+            yield self.name, _format_labels(self.labelnames, labels), v
+
+
+class MetricsRegistry:
+    """ Set of metrics rendered together in the Prometheus text format.
+
+    Args:
+        - prefix[str]: Prefix of every metric name
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: Dict[str, Any] = {}
+
+    def __register(self, metric):
+        assert metric.name not in self._metrics, f"Metric {metric.name} already registered"
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.__register(Counter(self.prefix + name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.__register(Histogram(self.prefix + name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable[[], Any], labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.__register(Gauge(self.prefix + name, help, callback, labelnames))
+
+    def get(self, name: str) -> Optional[Any]:
+        return self._metrics.get(self.prefix + name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class ConnectorMetrics:
+    """ Metrics of every stage of a Chatwoot connector: webhook route,
+    queueing, parsing, gateway and Chatwoot API requests. """
+
+    def __init__(self, prefix: str = "celai_chatwoot_"):
+        self.registry = MetricsRegistry(prefix=prefix)
+        r = self.registry
+        self.webhooks_received = r.counter("webhooks_received", "Webhooks received by the webhook routes", ("account", "inbox"))
+        self.webhooks_rejected = r.counter("webhooks_rejected", "Webhooks discarded by the webhook routes, by reason", ("account", "inbox", "reason"))
+        self.queue_wait = r.histogram("webhook_queue_wait_seconds", "Seconds a webhook waited in the queue", ("account", "inbox"))
+        self.parse = r.histogram("message_parse_seconds", "Seconds to build a WootMessage from a webhook", ("account", "inbox"))
+        self.first_chunk = r.histogram("gateway_first_chunk_seconds", "Seconds from the gateway call to its first outbound chunk", ("account", "inbox"))
+        self.gateway = r.histogram("gateway_seconds", "Seconds the gateway took to answer a message", ("account", "inbox"))
+        self.requests = r.histogram("api_request_seconds", "Seconds of every Chatwoot API request attempt, by endpoint and status", ("account", "inbox", "endpoint", "status"))
+        self.uploaded = r.counter("api_uploaded_bytes", "Request body bytes sent to Chatwoot", ("account", "inbox", "endpoint"))
+
+    def gauge(self, name: str, help: str, callback: Callable[[], Any], labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.registry.gauge(name, help, callback, labelnames)
+
+    def render(self) -> str:
+        return self.registry.render()
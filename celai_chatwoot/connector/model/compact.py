@@ -0,0 +1,163 @@
+import zlib
+from typing import Any, Dict, Optional
+from celai_chatwoot.connector.webhook_filter import loads
+
+
+def _default(value: Any) -> Any:
+    # orjson reads dict subclasses directly, LazyMetadata may still hold packed values
+    if isinstance(value, PackedPayload):
+        return value.unpack()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+try:
+    import orjson
+
+    def dumps(payload: Any) -> bytes:
+        return orjson.dumps(payload, default=_default)
+except ImportError:  # pragma: no cover - orjson is optional
+    import json
+
+    def dumps(payload: Any) -> bytes:
+        return json.dumps(payload, separators=(",", ":"), default=_default).encode()
+
+
+class RawPayloadMode:
+    """ How the webhook payload is kept in lead.metadata['raw'] """
+    # the decoded dict, as received
+    FULL = "full"
+    # compressed json bytes, decoded on first access
+    COMPACT = "compact"
+    # only the fields of TRIMMED_FIELDS
+    TRIMMED = "trimmed"
+
+
+# True keeps the whole value, a dict keeps only its fields
+TRIMMED_FIELDS: Dict[str, Any] = {
+    "id": True,
+    "event": True,
+    "message_type": True,
+    "content": True,
+    "content_type": True,
+    "content_attributes": True,
+    "created_at": True,
+    "private": True,
+    "source_id": True,
+    "account": {"id": True, "name": True},
+    "inbox": {"id": True, "name": True},
+    "sender": {"id": True, "name": True, "type": True, "identifier": True,
+               "phone_number": True, "email": True},
+    "conversation": {"id": True, "inbox_id": True, "status": True, "channel": True,
+                     "contact_inbox": {"source_id": True}},
+}
+
+
+def trim(payload: Any, fields: Dict[str, Any] = TRIMMED_FIELDS) -> Any:
+    """ Projection of payload keeping only the given fields """
+    if not isinstance(payload, dict):
+        return payload
+    trimmed = {}
+    for key, spec in fields.items():
+        if key not in payload:
+            continue
+        value = payload[key]
+        trimmed[key] = trim(value, spec) if isinstance(spec, dict) else value
+    return trimmed
+
+
+class PackedPayload:
+    """ JSON payload kept as compressed bytes """
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    @classmethod
+    def pack(cls, payload: Any) -> 'PackedPayload':
+        return cls(zlib.compress(dumps(payload), 1))
+
+    def unpack(self) -> Any:
+        return loads(zlib.decompress(self.data))
+
+    def __repr__(self):
+        return f"<PackedPayload {len(self.data)} bytes>"
+
+
+class LazyMetadata(dict):
+    """ Lead metadata whose packed values are decoded on first access and then
+    kept decoded. Behaves as a plain dict: iteration, copies, str(), json.dumps,
+    compact.dumps and pickle see the decoded values."""
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, PackedPayload):
+            value = value.unpack()
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __iter__(self):
+        # a Python level __iter__ makes {**m} and dict(m) go through __getitem__
+        return super().__iter__()
+
+    def _materialize(self):
+        for key, value in super().items():
+            if isinstance(value, PackedPayload):
+                self[key]
+
+    def items(self):
+        self._materialize()
+        return super().items()
+
+    def values(self):
+        self._materialize()
+        return super().values()
+
+    def copy(self):
+        return {k: self[k] for k in self}
+
+    def pop(self, key, *default):
+        if key in self:
+            self[key]
+        return super().pop(key, *default)
+
+    def popitem(self):
+        self._materialize()
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        return super().setdefault(key, default)
+
+    def __eq__(self, other):
+        self._materialize()
+        if isinstance(other, LazyMetadata):
+            other._materialize()
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self._materialize()
+        return super().__repr__()
+
+    __str__ = __repr__
+
+    def __reduce__(self):
+        return (dict, (self.copy(),))
+
+    def is_packed(self, key) -> bool:
+        return isinstance(super().get(key), PackedPayload)
+
+
+def raw_payload(payload: dict, mode: Optional[str] = RawPayloadMode.COMPACT) -> Any:
+    """ Value stored as metadata['raw'] for the given mode """
+    if mode == RawPayloadMode.FULL:
+        return payload
+    if mode == RawPayloadMode.TRIMMED:
+        return trim(payload)
+    return PackedPayload.pack(payload)
@@ -1,7 +1,28 @@
+import asyncio
 import mimetypes
+import tempfile
+from typing import IO, AsyncIterator, Dict, Optional
+from loguru import logger as log
 from cel.gateway.model.attachment import FileAttachment,\
                                         LocationAttachment,\
                                         MessageAttachmentType
+from celai_chatwoot.connector.http_pool import ChatwootHttpPool
+
+# Max size of a downloaded attachment
+DEFAULT_MAX_BYTES = 25 * 1024 * 1024
+# Downloads bigger than this are spooled to a temporary file
+DEFAULT_SPOOL_BYTES = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Attachments of a message loaded at the same time
+DEFAULT_LOAD_CONCURRENCY = 4
+
+
+class AttachmentTooLargeError(ValueError):
+    def __init__(self, url: str, max_bytes: int):
+        super().__init__(f"Attachment {url} is bigger than {max_bytes} bytes")
+        self.url = url
+        self.max_bytes = max_bytes
+
 
 class WootLocationAttachment(LocationAttachment):
     def __init__(self, **kwargs):
@@ -17,7 +38,10 @@ class WootAttachment(FileAttachment):
                  thumb_url: str = None,
                  file_url: str = None, 
                  metadata: any = None, 
-                 type: MessageAttachmentType = None):
+                 type: MessageAttachmentType = None,
+                 http: ChatwootHttpPool = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 spool_bytes: int = DEFAULT_SPOOL_BYTES):
         
         super().__init__(
             title=title, 
@@ -29,8 +53,115 @@ class WootAttachment(FileAttachment):
             type=type)
         
         self.thumb_url = thumb_url
+        # download state, shared by every consumer of the attachment
+        self._http = http
+        self._max_bytes = max_bytes
+        self._spool_bytes = spool_bytes
+        self._file: Optional[tempfile.SpooledTemporaryFile] = None
+        self._size: Optional[int] = None
+        self._lock: Optional[asyncio.Lock] = None
+        # filled by prefetch()
+        self.content_length: Optional[int] = None
+        self.final_url: Optional[str] = None
         
     
+    @property
+    def size(self) -> Optional[int]:
+        """ Downloaded bytes, None until the attachment is opened """
+        return self._size
+    
+    async def open(self) -> IO[bytes]:
+        """ Download the attachment once and return the spooled file, rewound. 
+        The file is shared: use read_chunks() to read it from several tasks 
+        at the same time, and close() to release it."""
+        if self._file is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._file is None:
+                    self._file = await self.__download()
+        self._file.seek(0)
+        return self._file
+    
+    async def read_chunks(self, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """ Iterate the downloaded content. Each iterator keeps its own position, 
+        so several consumers can read the same download concurrently """
+        file = await self.open()
+        position = 0
+        while True:
+            # seek and read run without yielding to the loop
+            file.seek(position)
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            position += len(chunk)
+            yield chunk
+    
+    async def save_to(self, path: str) -> str:
+        """ Write the content to path, returns the path. The file is opened and 
+        written in the default executor, so big attachments don't block the loop """
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, open, path, "wb")
+        try:
+            async for chunk in self.read_chunks():
+                await loop.run_in_executor(None, f.write, chunk)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        return path
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._size = None
+    
+    async def prefetch(self):
+        """ Fetch the size, mime type and final url (after the ActiveStorage redirect) 
+        of the attachment without downloading it. A one byte ranged GET is used 
+        instead of HEAD because presigned storage urls are only valid for GET """
+        if not self.file_url:
+            return
+        http = self._http or ChatwootHttpPool(persistent=False)
+        async with http.session() as session:
+            async with session.get(self.file_url, headers={"Range": "bytes=0-0"}, max_redirects=2) as resp:
+                resp.raise_for_status()
+                self.final_url = str(resp.url)
+                content_range = resp.headers.get("Content-Range", "")
+                if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                    self.content_length = int(content_range.rsplit("/", 1)[1])
+                elif resp.status == 200:
+                    # the server ignored the range
+                    self.content_length = resp.content_length
+                content_type = resp.headers.get("Content-Type", "").split(";")[0].strip()
+                if content_type and content_type != "application/octet-stream":
+                    self.mimeType = content_type
+    
+    async def __download(self) -> tempfile.SpooledTemporaryFile:
+        if not self.file_url:
+            raise ValueError(f"{self} has no file url")
+        http = self._http or ChatwootHttpPool(persistent=False)
+        file = tempfile.SpooledTemporaryFile(max_size=self._spool_bytes)
+        size = 0
+        try:
+            async with http.session() as session:
+                # ActiveStorage answers with a single redirect to the storage service,
+                # aiohttp fails when the redirect count reaches max_redirects
+                async with session.get(self.file_url, max_redirects=2) as resp:
+                    resp.raise_for_status()
+                    if (resp.content_length or self.content_length or 0) > self._max_bytes:
+                        raise AttachmentTooLargeError(self.file_url, self._max_bytes)
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self._max_bytes:
+                            raise AttachmentTooLargeError(self.file_url, self._max_bytes)
+                        file.write(chunk)
+        except BaseException:
+            file.close()
+            raise
+        self._size = size
+        return file
+    
+    
     def __str__(self):
         return f"WootAttachment: {self.title}"
     
@@ -38,28 +169,45 @@ class WootAttachment(FileAttachment):
         return f"WootAttachment: {self.title}"
     
     
+    # Chatwoot file_type -> loader method, unknown types are loaded as files
+    LOADERS: Dict[str, str] = {
+        "image": "load_image_from_message",
+        "audio": "load_audio_from_message",
+        "video": "load_video_from_message",
+        "file": "load_file_from_message",
+        "location": "load_location_from_message",
+    }
+    
     @classmethod
-    async def load_from_message(cls, message: dict) -> list:
+    async def load_from_message(cls, message: dict, connector = None) -> list:
         attachs = message.get("attachments")
         if not attachs:
             return None
         
-        response = []
+        # downloads share the connector's HTTP pool and limits
+        download = {
+            "http": getattr(connector, "http", None),
+            "max_bytes": getattr(connector, "attachment_max_bytes", DEFAULT_MAX_BYTES),
+            "spool_bytes": getattr(connector, "attachment_spool_bytes", DEFAULT_SPOOL_BYTES)
+        }
+        prefetch = getattr(connector, "attachment_prefetch", False)
+        semaphore = asyncio.Semaphore(getattr(connector, "attachment_concurrency", DEFAULT_LOAD_CONCURRENCY))
         
-        for attach in attachs:
-            # check if the message has a photo
-            if attach["file_type"] == 'image':
-                response.append(await cls.load_image_from_message(attach))
-            if attach["file_type"] == 'audio':
-                response.append(await cls.load_audio_from_message(attach))
-            if attach["file_type"] == 'location':
-                response.append(await cls.load_location_from_message(attach))
-            if attach["file_type"] == 'file':
-                response.append(await cls.load_file_from_message(attach))
-            if attach["file_type"] == 'video':
-                response.append(await cls.load_video_from_message(attach))
+        async def load(attach: dict):
+            loader = getattr(cls, cls.LOADERS.get(attach.get("file_type"), "load_file_from_message"))
+            async with semaphore:
+                try:
+                    attachment = await loader(attach, **download)
+                    if prefetch and isinstance(attachment, WootAttachment):
+                        await attachment.prefetch()
+                    return attachment
+                except Exception as e:
+                    # a broken attachment never drops the message
+                    log.warning(f"Error loading Chatwoot {attach.get('file_type')} attachment {attach.get('id')}: {e}")
+                    return None
         
-        return response
+        response = await asyncio.gather(*(load(attach) for attach in attachs))
+        return [a for a in response if a is not None]
         
 
     # Sample message with image attachment from Chatwoot
@@ -72,7 +220,7 @@ class WootAttachment(FileAttachment):
     # "thumb_url": "https://chatwoot.celai.com/rails/active_storage/representations/redirect/eyJfcmFpbHMiOnsibWVzc2FnZSI6IkJBaHBBbG91IiwiZXhwIjpudWxsLCJwdXIiOiJibG9iX2lkIn19--1a8d1d96c0630370245a7f741b16990c82c4e3bb/eyJfcmFpbHMiOnsibWVzc2FnZSI6IkJBaDdCem9MWm05eWJXRjBTU0lJYW5CbkJqb0dSVlE2RTNKbGMybDZaVjkwYjE5bWFXeHNXd2RwQWZvdyIsImV4cCI6bnVsbCwicHVyIjoidmFyaWF0aW9uIn19--27ede0471899a6e40b40ba7e4525adebc0ea198f/ale1.jpg",
     # "file_size": 160813
     @classmethod
-    async def load_image_from_message(cls, attach: dict):
+    async def load_image_from_message(cls, attach: dict, **kwargs):
         
         return WootAttachment(
             title="Image",
@@ -81,7 +229,8 @@ class WootAttachment(FileAttachment):
             metadata=attach,
             thumb_url=attach["thumb_url"],
             file_url=attach["data_url"],
-            type=MessageAttachmentType.IMAGE
+            type=MessageAttachmentType.IMAGE,
+            **kwargs
         )
         
        
@@ -95,7 +244,7 @@ class WootAttachment(FileAttachment):
     # "thumb_url": "",
     # "file_size": 7989
     @classmethod
-    async def load_audio_from_message(cls, attach: dict):
+    async def load_audio_from_message(cls, attach: dict, **kwargs):
         filename = attach["data_url"].split("/")[-1]
         return WootAttachment(
             title=filename,
@@ -103,7 +252,8 @@ class WootAttachment(FileAttachment):
             mimeType=mimetypes.guess_type(attach["data_url"])[0],
             metadata=attach,
             file_url=attach["data_url"],
-            type=MessageAttachmentType.AUDIO
+            type=MessageAttachmentType.AUDIO,
+            **kwargs
         )
     
     
@@ -117,7 +267,7 @@ class WootAttachment(FileAttachment):
     # "fallback_title": null,
     # "data_url": null
     @classmethod
-    async def load_location_from_message(cls, attach: dict):
+    async def load_location_from_message(cls, attach: dict, **kwargs):
         return WootLocationAttachment(
             latitude=attach["coordinates_lat"],
             longitude=attach["coordinates_long"],
@@ -133,18 +283,34 @@ class WootAttachment(FileAttachment):
     # "thumb_url": "",
     # "file_size": 18810    
     @classmethod
-    async def load_file_from_message(cls, attach: dict):
-        filename = attach["data_url"].split("/")[-1]
+    async def load_file_from_message(cls, attach: dict, **kwargs):
+        # also used for types without a loader, which may only have an external url
+        url = attach.get("data_url") or attach.get("external_url")
+        if not url:
+            log.warning(f"Ignoring Chatwoot {attach.get('file_type')} attachment {attach.get('id')} without url")
+            return None
+        filename = url.split("?")[0].split("/")[-1]
         return WootAttachment(
             title=filename,
             description="File attachment",
-            mimeType=mimetypes.guess_type(attach["data_url"])[0],
+            mimeType=mimetypes.guess_type(url.split("?")[0])[0],
             metadata=attach,
-            file_url=attach["data_url"],
-            type=MessageAttachmentType.DOCUMENT
+            file_url=url,
+            type=MessageAttachmentType.DOCUMENT,
+            **kwargs
         )
     
     
     @classmethod
-    async def load_video_from_message(cls, attach: dict):
-        raise NotImplementedError("Video attachment not implemented")
\ No newline at end of file
+    async def load_video_from_message(cls, attach: dict, **kwargs):
+        filename = attach["data_url"].split("/")[-1]
+        return WootAttachment(
+            title=filename,
+            description="Video attachment",
+            mimeType=mimetypes.guess_type(attach["data_url"])[0],
+            metadata=attach,
+            thumb_url=attach.get("thumb_url"),
+            file_url=attach["data_url"],
+            type=MessageAttachmentType.VIDEO,
+            **kwargs
+        )
\ No newline at end of file
@@ -1,5 +1,15 @@
+import struct
 from cel.gateway.model.conversation_lead import ConversationLead
 from cel.gateway.model.conversation_peer import ConversationPeer
+from celai_chatwoot.connector.model.compact import LazyMetadata, PackedPayload, RawPayloadMode, dumps, raw_payload
+from celai_chatwoot.connector.webhook_filter import loads
+
+
+# to_bytes() layout: magic, version, flags, body length, then the json body and the packed raw payload
+LEAD_MAGIC = b"WL"
+LEAD_VERSION = 1
+LEAD_HEADER = struct.Struct("<2sBBI")
+FLAG_RAW = 0x01
 
 
 class WootLead(ConversationLead):
@@ -24,24 +34,90 @@ class WootLead(ConversationLead):
         data = super().to_dict()
         data['account_id'] = self.account_id
         data['inbox_id'] = self.inbox_id
-        data['conversaiton_id'] = self.conversation_id
+        data['conversation_id'] = self.conversation_id
+        data['message_type'] = self.message_type
+        data['tmp_id'] = self.tmp_id
         return data
 
     @classmethod
     def from_dict(cls, lead_dict):
-        return WootLead(
+        conversation_from = lead_dict.get("conversation_from")
+        lead = WootLead(
             metadata=lead_dict.get("metadata"),
             account_id=lead_dict.get("account_id"),
             inbox_id=lead_dict.get("inbox_id"),
-            conversation_id=lead_dict.get("conversaiton_id"),
+            # dicts written by older versions have the misspelled key
+            conversation_id=lead_dict.get("conversation_id", lead_dict.get("conversaiton_id")),
+            message_type=lead_dict.get("message_type"),
+            connector_name=lead_dict.get("connector_name"),
+            conversation_from=ConversationPeer.from_dict(conversation_from) if conversation_from else None
+        )
+        if lead_dict.get("tmp_id"):
+            lead.tmp_id = lead_dict["tmp_id"]
+        return lead
+
+    def to_bytes(self) -> bytes:
+        """ Compact binary encoding, see from_bytes(). The raw payload is written 
+        as packed, it is not decoded nor serialized again """
+        metadata = self.metadata
+        raw = None
+        if metadata is not None and "raw" in metadata:
+            # dict.get does not decode a packed payload
+            raw = dict.get(metadata, "raw")
+            if not isinstance(raw, PackedPayload):
+                raw = PackedPayload.pack(raw)
+            metadata = {k: v for k, v in dict.items(metadata) if k != "raw"}
+        body = dumps([
+            self.account_id,
+            self.inbox_id,
+            self.conversation_id,
+            self.message_type,
+            self.connector_name,
+            self.tmp_id,
+            self.conversation_from.to_dict() if self.conversation_from else None,
+            metadata
+        ])
+        header = LEAD_HEADER.pack(LEAD_MAGIC, LEAD_VERSION, FLAG_RAW if raw is not None else 0, len(body))
+        return b"".join((header, body, raw.data if raw is not None else b""))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'WootLead':
+        magic, version, flags, body_len = LEAD_HEADER.unpack_from(data)
+        if magic != LEAD_MAGIC:
+            raise ValueError("Not an encoded WootLead")
+        if version != LEAD_VERSION:
+            raise ValueError(f"Unsupported WootLead encoding version: {version}")
+        start = LEAD_HEADER.size
+        account_id, inbox_id, conversation_id, message_type, connector_name, tmp_id, peer, metadata = \
+            loads(data[start:start + body_len])
+        if flags & FLAG_RAW:
+            metadata = LazyMetadata(metadata or {})
+            # decoded on first access, like a lead built from a webhook
+            metadata["raw"] = PackedPayload(bytes(data[start + body_len:]))
+        lead = WootLead(
+            metadata=metadata,
+            account_id=account_id,
+            inbox_id=inbox_id,
+            conversation_id=conversation_id,
+            message_type=message_type,
+            connector_name=connector_name,
+            conversation_from=ConversationPeer.from_dict(peer) if peer else None
         )
+        lead.tmp_id = tmp_id
+        return lead
 
     def __str__(self):
         return f"WootLead: {self.account_id}:{self.inbox_id}:{self.conversation_id}"
     
     
     @classmethod
-    def from_chatwoot_message(cls, message: dict, **kwargs) -> 'WootLead':
+    def from_chatwoot_message(cls, 
+                              message: dict, 
+                              raw_mode: str = RawPayloadMode.COMPACT, 
+                              **kwargs) -> 'WootLead':
+        """ Build the lead of a Chatwoot webhook. The webhook is kept in metadata['raw'] 
+        as compressed bytes decoded on first access (RawPayloadMode.COMPACT), 
+        as a projection of its main fields (TRIMMED) or as received (FULL) """
         
         conversation_id = message.get('conversation', {}).get('id')
         account_id = message.get('account', {}).get('id')
@@ -52,15 +128,15 @@ class WootLead(ConversationLead):
         assert account_id, "Account ID is required"
         assert inbox_id, "Inbox ID is required"
         
-        metadata = {
+        metadata = LazyMetadata({
             'inbox_id': inbox_id,
             'event': message.get('event'),
             'message_type': message_type,
             'private': message.get('private'),
             # 'message_id': str(message.get('message_id')),
             'date': message.get('created_at'),
-            'raw': message
-        }
+            'raw': raw_payload(message, raw_mode)
+        })
         conversation_peer = ConversationPeer(
             name=message['sender'].get('name') if message.get('sender') else None,
             id=str(message['sender'].get('id')) if message.get('sender') else None,
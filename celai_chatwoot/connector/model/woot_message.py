@@ -2,6 +2,7 @@ from typing import Any
 from cel.gateway.model.base_connector import BaseConnector
 from cel.gateway.model.conversation_lead import ConversationLead
 from cel.gateway.model.message import Message
+from celai_chatwoot.connector.model.compact import RawPayloadMode
 from celai_chatwoot.connector.model.woot_attachment import WootAttachment
 from celai_chatwoot.connector.model.woot_lead import WootLead
 
@@ -33,8 +34,9 @@ class WootMessage(Message):
         text = msg.get("content")
         date = msg.get("created_at")
         metadata = {}
-        lead = WootLead.from_chatwoot_message(message_dict, connector=connector)
-        attachs = await WootAttachment.load_from_message(message_dict)
+        raw_mode = getattr(connector, "raw_payload", RawPayloadMode.COMPACT)
+        lead = WootLead.from_chatwoot_message(message_dict, raw_mode=raw_mode, connector=connector)
+        attachs = await WootAttachment.load_from_message(message_dict, connector=connector)
         return WootMessage(lead=lead, text=text, date=date, metadata=metadata, attachments=attachs)#[attach] if attach else None)
         
 
@@ -1,15 +1,22 @@
 import asyncio
-import base64
 from dataclasses import dataclass
 import json
-import aiohttp
 from typing import Any, Optional, Dict
 from loguru import logger as log
-import filetype
-import os
+import uuid
+from celai_chatwoot.connector.http_pool import ChatwootHttpPool
+from celai_chatwoot.connector.media import resolve_media
+from celai_chatwoot.connector.media_cache import MediaCache
 
 ChatwootMessageTypes = ["incoming", "outgoing"]
 
+# content_attributes key used to detect a message already posted by a previous attempt
+IDEMPOTENCY_KEY = "idempotency_key"
+
+
+def new_idempotency_key() -> str:
+    return uuid.uuid4().hex
+
 @dataclass
 class ChatwootAttachment:
     content: Any
@@ -25,71 +32,21 @@ class ChatwootMessages:
                  account_id: str, 
                  access_key: str, 
                  headers: Optional[Dict[str, str]] = None,
-                 ssl: bool = False):
+                 ssl: bool = False,
+                 http: Optional[ChatwootHttpPool] = None,
+                 inbox_id: Optional[str] = None,
+                 media_cache: Optional[MediaCache] = None):
         self.base_url = base_url
         self.account_id = account_id
+        self.inbox_id = inbox_id
         self.access_key = access_key
         self.headers = headers or {}
         self.headers.update({
             'api_access_token': access_key
         })
         self.ssl = ssl
-        
-        
-    async def __build_content(self, attach: ChatwootAttachment):        
-        if attach.type == "image":
-            return await self.__build_content_image(attach.content)
-        elif attach.type.startswith("audio"):
-            return await self.__build_content_audio(attach.content)
-
-        raise NotImplementedError(f"ChatwootClient: Unknown attachment type: {attach.type}")
-                
-    async def __build_content_image(self, content: Any):
-        
-        b64_img = None
-        # if image is a file path, read the file
-        # -------------------------------------------------------------
-        if isinstance(content, str) and os.path.exists(content):
-            with open(content, "rb") as f:
-                b64_img = base64.b64encode(f.read()).decode()
-        elif isinstance(content, bytes):
-            b64_img = base64.b64encode(content).decode()
-        elif isinstance(content, str):
-            if content.startswith("data:image"):
-                b64_img = content.split("base64,")[1]
-            if content.startswith("http"):
-                # download the image
-                async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl)) as session:
-                    async with session.get(content) as resp:
-                        b64_img = base64.b64encode(await resp.read()).decode()
-            if len(content) > 100:
-                b64_img = content
-        else:
-            raise ValueError("image must be a url/path to a file, a bytes object or a base64 string")             
-        
-        return b64_img
-      
-    async def __build_content_audio(self, content: str):
-        if isinstance(content, str) and os.path.exists(content):
-            with open(content, "rb") as f:
-                b64_audio = base64.b64encode(f.read()).decode()
-        elif isinstance(content, bytes):
-            b64_audio = base64.b64encode(content).decode()
-        elif isinstance(content, str):
-            if content.startswith("data:audio"):
-                b64_audio = content.split("base64,")[1]
-            if content.startswith("http"):
-                # download the audio
-                async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl)) as session:
-                    async with session.get(content) as resp:
-                        b64_audio = base64.b64encode(await resp.read()).decode()
-                        
-            if len(content) > 100:
-                b64_audio = content
-        else:
-            raise ValueError("audio must be a url/path to a file, a bytes object or a base64 string")             
-        
-        return b64_audio
+        self.http = http or ChatwootHttpPool(ssl=ssl, persistent=False)
+        self.media_cache = media_cache
         
         
     # -------------------------------------------------------------
@@ -108,9 +65,10 @@ class ChatwootMessages:
         url = f"{self.base_url}/api/v1/accounts/{self.account_id}/conversations/{conversation_id}/messages"
         log.debug(f"Sending message to Chatwoot url: {url}")
 
+        idempotency_key = new_idempotency_key()
         payload = {
             'content': content,
-            'content_attributes': content_attributes,
+            'content_attributes': {**(content_attributes or {}), IDEMPOTENCY_KEY: idempotency_key},
             'content_type': content_type,
             'message_type': message_type,
             'private': private
@@ -126,10 +84,34 @@ class ChatwootMessages:
         # Remove keys with None values
         payload = {k: v for k, v in payload.items() if v is not None}
 
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl)) as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                response_data = await response.json()
-                return response_data
+        return await self.http.request("POST", url, 
+                                       endpoint="messages",
+                                       account_id=self.account_id, 
+                                       inbox_id=self.inbox_id, 
+                                       recover=lambda: self.find_message_by_idempotency_key(conversation_id, idempotency_key),
+                                       json=payload, 
+                                       headers=headers)
+    
+
+    async def find_message_by_idempotency_key(self, conversation_id: str, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        """ Look for a message already posted with the given idempotency key 
+        in the latest messages of the conversation """
+        url = f"{self.base_url}/api/v1/accounts/{self.account_id}/conversations/{conversation_id}/messages"
+        try:
+            res = await self.http.request("GET", url, 
+                                          endpoint="messages_lookup",
+                                          account_id=self.account_id, 
+                                          inbox_id=self.inbox_id, 
+                                          headers=self.headers)
+        except Exception as e:
+            log.warning(f"Error looking for message {idempotency_key} in conversation {conversation_id}: {e}")
+            return None
+        
+        messages = res.get("payload", []) if isinstance(res, dict) else []
+        for message in reversed(messages):
+            if (message.get("content_attributes") or {}).get(IDEMPOTENCY_KEY) == idempotency_key:
+                return message
+        return None
             
 
     async def send_attachment(self, conversation_id, attach: ChatwootAttachment=None, text=None, is_private=False, content_attributes=None):
@@ -138,39 +120,49 @@ class ChatwootMessages:
         # Construct the URL
         url = f"{self.base_url}/api/v1/accounts/{self.account_id}/conversations/{conversation_id}/messages"
         
-        # Initialize the form data
-        form = aiohttp.FormData()
-        
-        # Append the private flag
-        form.add_field("private", "true" if is_private else "false")
-        
-        form.add_field("message_type", "outgoing")
-        
-        # Append the text content if provided
-        if text:
-            form.add_field("content", text)
-                
-        # Append the content attributes if provided
-        # if content_attributes and 'items' in content_attributes:
-        #     form.add_field("content_attributes", json.dumps(content_attributes or {}))
-        #     form.add_field("content_type", "input_select")
+        media = await resolve_media(attach.content if attach.content is not None else attach.fileUrl,
+                                    http=self.http,
+                                    type=attach.type,
+                                    filename=attach.fileName,
+                                    cache=self.media_cache)
+        log.debug(f"Sending attachment to Chatwoot url: {url}, {media}")
+        idempotency_key = new_idempotency_key()
         
-        
-        content = await self.__build_content(attach)
-        buffer = base64.b64decode(content)
-        file_type = filetype.guess(buffer)
-        form.add_field("attachments[]", buffer, filename=attach.fileName or "audio.ogg", content_type=file_type.mime)
-               
+        def build_form():
+            import aiohttp
+            # a FormData can be sent only once, build a new one for every attempt
+            form = aiohttp.FormData()
+            
+            # Append the private flag
+            form.add_field("private", "true" if is_private else "false")
+            
+            form.add_field("message_type", "outgoing")
+            
+            # Append the text content if provided
+            if text:
+                form.add_field("content", text)
+                    
+            # Append the content attributes if provided
+            # if content_attributes and 'items' in content_attributes:
+            #     form.add_field("content_attributes", json.dumps(content_attributes or {}))
+            #     form.add_field("content_type", "input_select")
+            form.add_field("content_attributes", json.dumps({**(content_attributes or {}), 
+                                                             IDEMPOTENCY_KEY: idempotency_key}))
+            
+            # the content is streamed from its source, never loaded in memory
+            form.add_field("attachments[]", media.payload(), filename=media.filename, content_type=media.mime)
+            return form
         
         # Make the HTTP request
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=self.ssl)) as session:
-            try:
-                async with session.post(url, data=form, headers=self.headers) as response:
-                    res = await response.json()
-                    print(res)
-                    return res
-            except aiohttp.ClientError as e:
-                print(e)    
+        res = await self.http.request("POST", url, 
+                                      endpoint="attachments",
+                                      account_id=self.account_id, 
+                                      inbox_id=self.inbox_id, 
+                                      data_factory=build_form, 
+                                      recover=lambda: self.find_message_by_idempotency_key(conversation_id, idempotency_key),
+                                      headers=self.headers)
+        log.debug(f"Chatwoot attachment sent to conversation {conversation_id}: {res.get('id') if isinstance(res, dict) else res}")
+        return res
 
 
 
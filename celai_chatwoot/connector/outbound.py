@@ -0,0 +1,130 @@
+import asyncio
+import contextvars
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+from loguru import logger as log
+
+
+OutboundJob = Callable[[], Awaitable[Any]]
+
+
+class OutboundDispatcher:
+    """ Outbound send pipeline. Jobs are queued per key (a conversation) and
+    run strictly in order inside each key, while different keys are sent
+    concurrently up to a global limit. submit() never waits for network I/O.
+
+    Args:
+        - concurrency[int]: Max number of jobs running at the same time across all keys
+        - propagate_context[bool]: Run every job in a copy of the context variables of
+        its submitter (such as the current trace span) instead of the context of the key worker
+    """
+
+    def __init__(self, concurrency: int = 16, propagate_context: bool = False):
+        assert concurrency > 0, "concurrency must be greater than 0"
+        self.concurrency = concurrency
+        self.propagate_context = propagate_context
+        self._lanes: Dict[str, Deque[Tuple[OutboundJob, asyncio.Future, Optional[contextvars.Context]]]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._sent = 0
+        self._failed = 0
+
+
+    def submit(self, key: str, job: OutboundJob) -> asyncio.Future:
+        """ Queue a job for the given key and return immediately.
+        The returned future resolves with the job result, awaiting it is optional.
+        Job errors are logged and never propagated to the caller."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        future = loop.create_future()
+        # errors are already logged by the worker, mark them as retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        context = contextvars.copy_context() if self.propagate_context else None
+        self._lanes.setdefault(key, deque()).append((job, future, context))
+
+        if key not in self._workers:
+            self._workers[key] = loop.create_task(self.__drain(key))
+        return future
+
+    async def __drain(self, key: str):
+        lane = self._lanes[key]
+        loop = asyncio.get_running_loop()
+        try:
+            while lane:
+                job, future, context = lane[0]
+                async with self._semaphore:
+                    self._in_flight += 1
+                    try:
+                        if context is None:
+                            result = await job()
+                        else:
+                            result = await loop.create_task(job(), context=context)
+                        self._sent += 1
+                        if not future.done():
+                            future.set_result(result)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        self._failed += 1
+                        log.error(f"Error sending outbound message for {key}: {e}")
+                        if not future.done():
+                            future.set_exception(e)
+                    finally:
+                        self._in_flight -= 1
+                lane.popleft()
+        finally:
+            for _, future, _ in lane:
+                future.cancel()
+            self._lanes.pop(key, None)
+            self._workers.pop(key, None)
+
+
+    async def flush(self, key: Optional[str] = None):
+        """ Wait until all the queued jobs of the key (or all the keys) are sent """
+        if key is not None:
+            worker = self._workers.get(key)
+            if worker:
+                await asyncio.shield(worker)
+            return
+
+        while self._workers:
+            await asyncio.gather(*[asyncio.shield(w) for w in list(self._workers.values())],
+                                 return_exceptions=True)
+
+    def cancel(self, key: str) -> int:
+        """ Drop the pending jobs of a key, returns the number of dropped jobs.
+        A job already being sent is not interrupted."""
+        lane = self._lanes.get(key)
+        if not lane:
+            return 0
+        dropped = 0
+        while len(lane) > 1:
+            _, future, _ = lane.pop()
+            future.cancel()
+            dropped += 1
+        return dropped
+
+    async def close(self):
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+
+    def depth(self, key: str) -> int:
+        """ Number of jobs queued (including the one being sent) for a key """
+        return len(self._lanes.get(key, ()))
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [len(lane) for lane in self._lanes.values()]
+        return {
+            "conversations": len(depths),
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "in_flight": self._in_flight,
+            "sent": self._sent,
+            "failed": self._failed,
+            "concurrency": self.concurrency
+        }
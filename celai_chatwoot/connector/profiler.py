@@ -0,0 +1,164 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+from loguru import logger as log
+
+
+PROFILE_ENV = "CELAI_CHATWOOT_PROFILE"
+
+# leaf functions of an event loop waiting for I/O
+IDLE_FUNCTIONS = frozenset(("select", "poll"))
+
+
+def parse_profile_env(value: Optional[str]) -> Optional[Dict[str, float]]:
+    """ Parses "webhooks=200", "seconds=30" or "webhooks=200,seconds=60".
+    Returns None if the value is empty or not valid """
+    if not value:
+        return None
+    request = {}
+    for part in value.split(","):
+        key, _, number = part.partition("=")
+        key = key.strip()
+        if key not in ("webhooks", "seconds"):
+            log.warning(f"Ignoring invalid {PROFILE_ENV} option: {part}")
+            continue
+        try:
+            request[key] = int(number) if key == "webhooks" else float(number)
+        except ValueError:
+            log.warning(f"Ignoring invalid {PROFILE_ENV} option: {part}")
+    return request or None
+
+
+def _is_idle(leaf: str) -> bool:
+    return leaf.split(" ", 1)[0] in IDLE_FUNCTIONS
+
+
+class SamplingProfiler:
+    """ Statistical profiler of the event loop thread. While a session is active
+    a background thread samples the stack of the loop every `interval` seconds,
+    the webhook processing, attachment loading and sends all run there. Samples
+    are written as collapsed stacks (one "frame;frame;frame count" line per stack),
+    the input of flamegraph.pl, speedscope and similar tools.
+    Nothing runs while no session is active.
+
+    Args:
+        - output_dir[str]: Directory of the profiles (default: the temp directory)
+        - interval[float]: Seconds between samples
+        - max_seconds[float]: Max duration of a session
+        - include_idle[bool]: Keep the samples of the loop waiting for I/O
+    """
+
+    def __init__(self,
+                 output_dir: Optional[str] = None,
+                 interval: float = 0.005,
+                 max_seconds: float = 300,
+                 include_idle: bool = False):
+        self.output_dir = output_dir or tempfile.gettempdir()
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.include_idle = include_idle
+        self.active = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._idle = 0
+        self._remaining_webhooks: Optional[int] = None
+        self._started_at: Optional[float] = None
+        self._deadline: Optional[float] = None
+        self._target: Optional[int] = None
+        self.last_profile: Optional[str] = None
+
+    def start(self, webhooks: Optional[int] = None, seconds: Optional[float] = None) -> Dict[str, Any]:
+        """ Profile the thread calling this method (the event loop) for the next
+        `webhooks` webhooks or `seconds` seconds, whichever comes first.
+        Does nothing if a session is already active """
+        with self._lock:
+            if self.active:
+                return self.stats()
+            seconds = min(seconds or self.max_seconds, self.max_seconds)
+            self._stacks = Counter()
+            self._samples = self._idle = 0
+            self._remaining_webhooks = webhooks
+            self._target = threading.get_ident()
+            self._started_at = time.monotonic()
+            self._deadline = self._started_at + seconds
+            self._stop.clear()
+            self.active = True
+            self._thread = threading.Thread(target=self.__run, name="celai-chatwoot-profiler", daemon=True)
+            self._thread.start()
+        log.info(f"Profiling the next {webhooks or 'all'} webhooks for max {seconds}s, every {self.interval * 1000:.1f}ms")
+        return self.stats()
+
+    def on_webhook(self, count: int = 1):
+        """ Counts processed webhooks, the session ends after the requested number """
+        remaining = self._remaining_webhooks
+        if remaining is None:
+            return
+        self._remaining_webhooks = remaining - count
+        if self._remaining_webhooks <= 0:
+            self._stop.set()
+
+    def stop(self) -> Optional[str]:
+        """ End the session now, returns the path of the profile """
+        thread = self._thread
+        if thread is None:
+            return self.last_profile
+        self._stop.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        return self.last_profile
+
+    def __run(self):
+        target, interval, deadline = self._target, self.interval, self._deadline
+        try:
+            while not self._stop.wait(interval) and time.monotonic() < deadline:
+                frame = sys._current_frames().get(target)
+                if frame is not None:
+                    self.__sample(frame)
+        finally:
+            self.__write()
+            self.active = False
+            self._thread = None
+
+    def __sample(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if not self.include_idle and _is_idle(stack[0]):
+            self._idle += 1
+            return
+        self._samples += 1
+        self._stacks[";".join(reversed(stack))] += 1
+
+    def __write(self):
+        now = time.time()
+        name = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"{now % 1:.3f}"[1:]
+        path = os.path.join(self.output_dir, f"celai-chatwoot-{os.getpid()}-{name}.collapsed")
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(path, "w") as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            self.last_profile = path
+            log.info(f"Profile with {self._samples} samples written to {path}")
+        except OSError as e:
+            log.error(f"Error writing profile {path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "samples": self._samples,
+            "idle_samples": self._idle,
+            "remaining_webhooks": self._remaining_webhooks if self.active else None,
+            "elapsed": round(time.monotonic() - self._started_at, 3) if self.active else None,
+            "interval": self.interval,
+            "last_profile": self.last_profile
+        }
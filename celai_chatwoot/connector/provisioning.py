@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, Optional
+from loguru import logger as log
+from celai_chatwoot.connector.bot_utils import ChatwootAgentsBots
+from celai_chatwoot.connector.http_pool import ChatwootApiError
+
+
+DEFAULT_BOT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "celai-chatwoot", "agent_bots.json")
+
+
+class ProvisioningState:
+    """ Agent bot provisioning states of a connector """
+    PENDING = "pending"
+    PROVISIONING = "provisioning"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class ProvisioningStatus:
+    """ Tracks the agent bot provisioning started by the connector startup.
+    It is updated by the loop (or the thread) running the provisioning and
+    can be awaited from any loop with wait().
+    """
+
+    def __init__(self):
+        self.state = ProvisioningState.PENDING
+        self.error: Optional[BaseException] = None
+        self.bots: Dict[str, Any] = {}
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    @property
+    def started(self) -> bool:
+        return self.state != ProvisioningState.PENDING
+
+    @property
+    def done(self) -> bool:
+        return self.state in (ProvisioningState.READY, ProvisioningState.FAILED)
+
+    @property
+    def ready(self) -> bool:
+        return self.state == ProvisioningState.READY
+
+    def begin(self):
+        self.state = ProvisioningState.PROVISIONING
+        self.error = None
+        self._started_at = time.monotonic()
+        self._finished_at = None
+
+    def succeed(self, bots: Dict[str, Any]):
+        self.bots = bots
+        self._finished_at = time.monotonic()
+        self.state = ProvisioningState.READY
+
+    def fail(self, error: BaseException):
+        self.error = error
+        self._finished_at = time.monotonic()
+        self.state = ProvisioningState.FAILED
+
+    async def wait(self, timeout: Optional[float] = None, interval: float = 0.05) -> bool:
+        """ Waits until the provisioning ends, returns True if the bots are ready.
+        Returns False right away if the provisioning was not started.
+        Polls the state, so it works whatever loop or thread provisions the bots """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.started and not self.done:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(interval)
+        return self.ready
+
+    def stats(self) -> Dict[str, Any]:
+        end = self._finished_at if self._finished_at is not None else time.monotonic()
+        return {
+            "state": self.state,
+            "error": f"{type(self.error).__name__}: {self.error}" if self.error else None,
+            "duration": round(end - self._started_at, 3) if self._started_at is not None else None,
+            "bots": {account_id: bot.get("id") for account_id, bot in self.bots.items()}
+        }
+
+
+class BotIdCache:
+    """ Agent bot ids resolved by previous runs, stored in a small json file
+    shared by every connector of the host.
+
+    Args:
+        - path[str]: Path of the json file
+    """
+
+    def __init__(self, path: str = DEFAULT_BOT_CACHE_PATH):
+        self.path = path
+
+    @staticmethod
+    def key(base_url: str, account_id: str, name: str) -> str:
+        return f"{base_url.rstrip('/')}|{account_id}|{name}"
+
+    def __read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.__read().get(key)
+
+    def set(self, key: str, bot_id: Any):
+        data = self.__read()
+        if data.get(key) == bot_id:
+            return
+        data[key] = bot_id
+        self.__write(data)
+
+    def delete(self, key: str):
+        data = self.__read()
+        if data.pop(key, None) is not None:
+            self.__write(data)
+
+    def __write(self, data: Dict[str, Any]):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            # atomic, concurrent writers never leave a partial file
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning(f"Error writing agent bot cache {self.path}: {e}")
+
+
+class BotProvisioner:
+    """ Creates or updates the agent bot of a connector and assigns it to its inboxes
+    with as few API calls as possible: the bot id is cached on disk and validated
+    with a single get, the bot is only patched when its webhook url changed and
+    the inboxes are assigned concurrently.
+
+    Args:
+        - client[ChatwootAgentsBots]: Agent bots API client
+        - cache[BotIdCache]: Bot id cache, None to always look the bot up
+        - concurrency[int]: Inboxes assigned at the same time
+    """
+
+    def __init__(self,
+                 client: ChatwootAgentsBots,
+                 cache: Optional[BotIdCache] = None,
+                 concurrency: int = 8):
+        self.client = client
+        self.cache = cache
+        self.concurrency = concurrency
+
+    async def provision(self,
+                        name: str,
+                        outgoing_url: str,
+                        description: Optional[str] = None,
+                        inbox_ids: Iterable[str | int] = ()) -> Dict[str, Any]:
+        """ Returns the agent bot, assigned to every inbox """
+        key = BotIdCache.key(self.client.base_url, self.client.account_id, name)
+        bot = await self.__cached_bot(key, name)
+        if bot is None:
+            bot = await self.client.find_agent_bot_paginated(name)
+
+        if bot is None:
+            log.warning(f"Bot '{name}' not found. Creating bot with webhook url {outgoing_url}")
+            bot = await self.client.create_agent_bot(name, description, outgoing_url)
+        elif bot.get("outgoing_url") != outgoing_url or (description and bot.get("description") != description):
+            log.debug(f"Bot '{name}' id:{bot['id']} found. Updating bot with webhook url {outgoing_url}")
+            bot = await self.client.update_agent_bot(bot["id"], name, description, outgoing_url)
+        else:
+            log.debug(f"Bot '{name}' id:{bot['id']} is up to date")
+
+        if self.cache:
+            self.cache.set(key, bot["id"])
+
+        await self.assign(bot["id"], inbox_ids)
+        return bot
+
+    async def assign(self, bot_id: str | int, inbox_ids: Iterable[str | int]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def assign_inbox(inbox_id):
+            async with semaphore:
+                await self.client.assign_bot_to_inbox(inbox_id=inbox_id, agent_bot_id=bot_id)
+                log.debug(f"Chatwoot Bot id:{bot_id} assigned to inbox {inbox_id}")
+
+        await asyncio.gather(*(assign_inbox(inbox_id) for inbox_id in dict.fromkeys(inbox_ids)))
+
+    async def __cached_bot(self, key: str, name: str) -> Optional[Dict[str, Any]]:
+        bot_id = self.cache.get(key) if self.cache else None
+        if bot_id is None:
+            return None
+        try:
+            bot = await self.client.get_agent_bot(bot_id)
+        except ChatwootApiError as e:
+            # deleted bot, or not readable with this access key
+            log.debug(f"Cached bot id:{bot_id} of '{name}' is not valid: {e}")
+            self.cache.delete(key)
+            return None
+        if not isinstance(bot, dict) or bot.get("name") != name:
+            self.cache.delete(key)
+            return None
+        return bot
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+from loguru import logger as log
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """ Parse a Retry-After header, either delay seconds or an HTTP date.
+    Returns the number of seconds to wait or None if the header is missing or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """ Token bucket with an adaptive rate (AIMD). The rate is multiplied by
+    decrease_factor on every 429 and recovers additively on every success,
+    up to the configured base rate."""
+
+    def __init__(self,
+                 rate: float,
+                 burst: int,
+                 min_rate: float = 0.5,
+                 decrease_factor: float = 0.5,
+                 recovery: float = 0.05):
+        assert rate > 0, "rate must be greater than 0"
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min(min_rate, rate)
+        self.decrease_factor = decrease_factor
+        self.recovery = recovery * rate
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def __refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        """ Take a token and return the seconds to wait before using it.
+        Tokens can go negative, that way concurrent callers are queued in order."""
+        now = time.monotonic()
+        self.__refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        now = time.monotonic()
+        self.__refill(now)
+        # drop the burst, the server told us we are above its limit
+        self.tokens = min(self.tokens, 0.0)
+        self.blocked_until = max(self.blocked_until, now + (retry_after if retry_after is not None else 1 / self.rate))
+
+    def on_success(self):
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.recovery)
+
+    @property
+    def throttle(self) -> float:
+        """ 0 when sending at the configured rate, close to 1 when fully throttled """
+        blocked = self.blocked_until > time.monotonic()
+        return 1.0 if blocked else round(1 - self.rate / self.base_rate, 4)
+
+
+class ChatwootRateLimiter:
+    """ Client side rate limiter for the Chatwoot API. Keeps a token bucket per
+    account and, optionally, a token bucket per inbox. Both buckets adapt their
+    rate when Chatwoot answers 429 and honour Retry-After.
+
+    Args:
+        - rate[float]: Requests per second allowed per account
+        - burst[int]: Max burst per account, defaults to rate
+        - inbox_rate[float]: Requests per second allowed per inbox, None to disable inbox buckets
+        - inbox_burst[int]: Max burst per inbox, defaults to inbox_rate
+        - min_rate[float]: The adaptive rate never goes below this value
+    """
+
+    def __init__(self,
+                 rate: float,
+                 burst: Optional[int] = None,
+                 inbox_rate: Optional[float] = None,
+                 inbox_burst: Optional[int] = None,
+                 min_rate: float = 0.5):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.inbox_rate = inbox_rate
+        self.inbox_burst = inbox_burst or (max(1, int(inbox_rate)) if inbox_rate else None)
+        self.min_rate = min_rate
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._waiting = 0
+        self._throttled_seconds = 0.0
+        self._rate_limited = 0
+
+
+    def __buckets(self, account_id: Any, inbox_id: Any = None) -> list[TokenBucket]:
+        keys = [(f"account:{account_id}", self.rate, self.burst)]
+        if self.inbox_rate and inbox_id is not None:
+            keys.append((f"inbox:{account_id}:{inbox_id}", self.inbox_rate, self.inbox_burst))
+
+        buckets = []
+        for key, rate, burst in keys:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, burst, min_rate=self.min_rate)
+            buckets.append(bucket)
+        return buckets
+
+    async def acquire(self, account_id: Any, inbox_id: Any = None):
+        """ Wait until a request to the account (and inbox) is allowed """
+        wait = max(bucket.reserve() for bucket in self.__buckets(account_id, inbox_id))
+        if wait <= 0:
+            return
+        self._waiting += 1
+        self._throttled_seconds += wait
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            self._waiting -= 1
+
+    def on_rate_limited(self, account_id: Any, inbox_id: Any = None, retry_after: Optional[float] = None):
+        self._rate_limited += 1
+        for bucket in self.__buckets(account_id, inbox_id):
+            bucket.on_rate_limited(retry_after)
+        log.warning(f"Chatwoot rate limit reached for account {account_id} inbox {inbox_id}, "
+                    f"retry after: {retry_after}s. Rate set to {self.current_rate(account_id):.2f} req/s")
+
+    def on_success(self, account_id: Any, inbox_id: Any = None):
+        for bucket in self.__buckets(account_id, inbox_id):
+            bucket.on_success()
+
+    def current_rate(self, account_id: Any, inbox_id: Any = None) -> float:
+        return min(bucket.rate for bucket in self.__buckets(account_id, inbox_id))
+
+
+    def throttle(self) -> Dict[str, float]:
+        """ Current throttle gauge per bucket: 0 = full configured rate, 1 = blocked """
+        return {key: bucket.throttle for key, bucket in self._buckets.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "waiting": self._waiting,
+            "rate_limited": self._rate_limited,
+            "throttled_seconds": round(self._throttled_seconds, 3),
+            "rates": {key: round(bucket.rate, 3) for key, bucket in self._buckets.items()},
+            "throttle": self.throttle()
+        }
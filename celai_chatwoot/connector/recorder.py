@@ -0,0 +1,113 @@
+import gzip
+import json
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional
+from loguru import logger as log
+from celai_chatwoot.connector.model.compact import dumps
+from celai_chatwoot.connector.webhook_filter import loads
+
+
+# contact details of the webhooks
+DEFAULT_REDACTED_KEYS = ("name", "email", "phone_number", "identifier", "thumbnail", "avatar_url", "ip_address")
+
+
+def redact(payload: Any, keys: frozenset) -> Any:
+    """ Copy of the payload with the values of the keys replaced, at any depth.
+    Strings are replaced by a string of the same length, so the recorded
+    traffic keeps its size. """
+    if isinstance(payload, dict):
+        return {k: _mask(v) if k in keys else redact(v, keys) for k, v in payload.items()}
+    if isinstance(payload, list):
+        return [redact(v, keys) for v in payload]
+    return payload
+
+
+def _mask(value: Any) -> Any:
+    if isinstance(value, str):
+        return "x" * len(value)
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return "[redacted]"
+
+
+class WebhookRecorder:
+    """ Records the webhooks received by the connector routes to a gzip
+    compressed NDJSON file, one line per request:
+
+        {"t": 1.25, "ts": 1717171717.5, "route": "webhook", "payload": {...}}
+
+    `t` is the arrival time in seconds since the recorder started and `ts` the
+    wall clock time. Batches are recorded as a single line with the list of events.
+
+    Args:
+        - path[str]: File path, a new recording is appended as a new gzip member
+        - redact_keys[Iterable[str]]: Keys whose values are masked at any depth of the payload
+        - compresslevel[int]: gzip compression level
+    """
+
+    def __init__(self,
+                 path: str,
+                 redact_keys: Iterable[str] = DEFAULT_REDACTED_KEYS,
+                 compresslevel: int = 6):
+        self.path = path
+        self.redact_keys = frozenset(redact_keys or ())
+        self.compresslevel = compresslevel
+        self._file: Optional[gzip.GzipFile] = None
+        self._started: Optional[float] = None
+        self._lock = threading.Lock()
+        self._recorded = 0
+        self._errors = 0
+
+    def record(self, payload: Any, route: str = "webhook"):
+        """ Append a webhook (or the list of events of a batch) to the recording """
+        now = time.monotonic()
+        if self._started is None:
+            self._started = now
+        if self.redact_keys:
+            payload = redact(payload, self.redact_keys)
+        record = {"t": round(now - self._started, 6), "ts": round(time.time(), 6), "route": route, "payload": payload}
+        try:
+            line = dumps(record)
+        except TypeError:
+            line = json.dumps(record, default=str).encode()
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._file = gzip.open(self.path, "ab", compresslevel=self.compresslevel)
+                self._file.write(line + b"\n")
+            self._recorded += 1
+        except OSError as e:
+            # never fail a webhook because of the recorder
+            self._errors += 1
+            log.warning(f"Error recording webhook to {self.path}: {e}")
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "recorded": self._recorded, "errors": self._errors}
+
+
+def read_recording(path: str) -> Iterator[Dict[str, Any]]:
+    """ Records of a recording in order. Plain NDJSON files are read too,
+    every recording appended to the file starts its own time axis. """
+    opener = gzip.open if _is_gzip(path) else open
+    with opener(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield loads(line)
+
+
+def _is_gzip(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
@@ -0,0 +1,41 @@
+import random
+from dataclasses import dataclass, field
+from typing import FrozenSet, Optional
+
+
+DEFAULT_RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+@dataclass
+class RetryPolicy:
+    """ Retry policy for the Chatwoot API requests.
+
+    Args:
+        - max_attempts[int]: Max number of attempts, including the first one
+        - deadline[float]: Max seconds spent on a request including all the retries
+        - base_delay[float]: Delay before the first retry, doubled on every retry
+        - max_delay[float]: Upper bound of a single delay
+        - jitter[float]: Fraction of the delay randomized, 1 = full jitter, 0 = no jitter
+        - retryable_statuses[FrozenSet[int]]: Response statuses that are retried
+    """
+    max_attempts: int = 4
+    deadline: float = 30.0
+    base_delay: float = 0.25
+    max_delay: float = 5.0
+    jitter: float = 1.0
+    retryable_statuses: FrozenSet[int] = field(default=DEFAULT_RETRYABLE_STATUSES)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """ Seconds to wait after the given (1 based) failed attempt.
+        A Retry-After sent by the server is used as a lower bound."""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        delay = delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def is_retryable(self, status: int) -> bool:
+        return status in self.retryable_statuses
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+@dataclass(frozen=True)
+class InboxRoute:
+    """ An inbox served by the connector and the credentials of its account """
+    account_id: str
+    inbox_id: str
+    access_key: str
+
+    def __post_init__(self):
+        # ids arrive as ints in the webhooks and as strings in the settings
+        object.__setattr__(self, "account_id", str(self.account_id))
+        object.__setattr__(self, "inbox_id", str(self.inbox_id))
+
+
+class RoutingTable:
+    """ Inboxes served by a single connector, indexed by inbox id.
+    Chatwoot inbox ids are unique across accounts, the account id is
+    used to validate the webhooks that carry it.
+
+    Args:
+        - routes[Iterable[InboxRoute]]: Served inboxes, the first one is the primary route
+    """
+
+    def __init__(self, routes: Iterable[InboxRoute] = ()):
+        self._routes: Dict[str, InboxRoute] = {}
+        # inbox id -> account id, checked by the webhook filter on every webhook
+        self.inboxes: Dict[str, str] = {}
+        self._access_keys: Dict[str, str] = {}
+        for route in routes:
+            self.add(route)
+
+    def add(self, route: InboxRoute):
+        current = self._access_keys.get(route.account_id)
+        assert current is None or current == route.access_key, \
+            f"Account {route.account_id} has different access keys"
+        self._routes[route.inbox_id] = route
+        self.inboxes[route.inbox_id] = route.account_id
+        self._access_keys[route.account_id] = route.access_key
+
+    @property
+    def primary(self) -> InboxRoute:
+        return next(iter(self._routes.values()))
+
+    def get(self, inbox_id: str | int) -> Optional[InboxRoute]:
+        return self._routes.get(str(inbox_id))
+
+    def access_key(self, account_id: str | int) -> Optional[str]:
+        return self._access_keys.get(str(account_id))
+
+    def accounts(self) -> Dict[str, List[str]]:
+        """ Inbox ids by account id """
+        accounts: Dict[str, List[str]] = {}
+        for route in self._routes.values():
+            accounts.setdefault(route.account_id, []).append(route.inbox_id)
+        return accounts
+
+    def __iter__(self) -> Iterator[InboxRoute]:
+        return iter(self._routes.values())
+
+    def __len__(self) -> int:
+        return len(self._routes)
@@ -0,0 +1,283 @@
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+from loguru import logger as log
+from celai_chatwoot.connector.model.compact import dumps
+
+
+class SpanKind:
+    """ OpenTelemetry span kinds """
+    INTERNAL = "SPAN_KIND_INTERNAL"
+    SERVER = "SPAN_KIND_SERVER"
+    CLIENT = "SPAN_KIND_CLIENT"
+    PRODUCER = "SPAN_KIND_PRODUCER"
+    CONSUMER = "SPAN_KIND_CONSUMER"
+
+
+class StatusCode:
+    UNSET = "STATUS_CODE_UNSET"
+    OK = "STATUS_CODE_OK"
+    ERROR = "STATUS_CODE_ERROR"
+
+
+_current_span: ContextVar[Optional[Any]] = ContextVar("celai_chatwoot_span", default=None)
+
+
+class Span:
+    """ A timed operation of a trace. Use it as a context manager, it is the
+    current span (the parent of new spans) until it exits. """
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_span_id", "name", "kind",
+                 "start_time_unix_nano", "end_time_unix_nano", "attributes", "events",
+                 "status_code", "status_message", "_token")
+
+    def __init__(self, tracer: 'Tracer', name: str, kind: str, trace_id: str, parent_span_id: Optional[str], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_time_unix_nano = time.time_ns()
+        self.end_time_unix_nano: Optional[int] = None
+        self.attributes = attributes
+        self.events: List[Dict[str, Any]] = []
+        self.status_code = StatusCode.UNSET
+        self.status_message: Optional[str] = None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append({"name": name, "time_unix_nano": time.time_ns(), "attributes": attributes})
+
+    def set_status(self, code: str, message: Optional[str] = None):
+        self.status_code = code
+        self.status_message = message
+
+    def end(self):
+        if self.end_time_unix_nano is None:
+            self.end_time_unix_nano = time.time_ns()
+            self.tracer.export(self)
+
+    def __enter__(self) -> 'Span':
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.set_status(StatusCode.ERROR, f"{exc_type.__name__}: {exc}")
+            self.add_event("exception", **{"exception.type": exc_type.__name__, "exception.message": str(exc)})
+        _current_span.reset(self._token)
+        self.end()
+
+    @property
+    def duration(self) -> Optional[float]:
+        """ Seconds between start and end """
+        if self.end_time_unix_nano is None:
+            return None
+        return (self.end_time_unix_nano - self.start_time_unix_nano) / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ Span with the field names of the OTLP JSON encoding,
+        attributes are kept as a plain mapping """
+        status = {"code": self.status_code}
+        if self.status_message:
+            status["message"] = self.status_message
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_time_unix_nano,
+            "end_time_unix_nano": self.end_time_unix_nano,
+            "attributes": self.attributes,
+            "events": self.events,
+            "status": status,
+            "resource": self.tracer.resource
+        }
+
+    def __repr__(self):
+        return f"Span({self.name}, trace={self.trace_id}, span={self.span_id}, parent={self.parent_span_id})"
+
+
+class _NoopSpan:
+    """ Returned while tracing is disabled or the trace is not sampled.
+    The root of a trace not sampled is kept as current span, so its children are not sampled either. """
+    __slots__ = ("current", "_token")
+    trace_id = span_id = parent_span_id = None
+
+    def __init__(self, current: bool = False):
+        self.current = current
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, **attributes):
+        pass
+
+    def set_status(self, code: str, message: Optional[str] = None):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        if self.current:
+            self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class SpanExporter(ABC):
+    """ Receives every ended span """
+
+    @abstractmethod
+    def export(self, span: Span):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class InMemorySpanExporter(SpanExporter):
+    """ Keeps the last ended spans in memory, for tests and debugging.
+
+    Args:
+        - max_spans[int]: Max number of spans kept, the oldest are dropped first
+    """
+
+    def __init__(self, max_spans: int = 10_000):
+        self._spans: Deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self._spans.append(span)
+
+    def spans(self, trace_id: Optional[str] = None, name: Optional[str] = None) -> List[Span]:
+        return [s for s in self._spans
+                if (trace_id is None or s.trace_id == trace_id) and (name is None or s.name == name)]
+
+    def traces(self) -> Dict[str, List[Span]]:
+        """ Spans grouped by trace id, in end order """
+        traces: Dict[str, List[Span]] = {}
+        for span in self._spans:
+            traces.setdefault(span.trace_id, []).append(span)
+        return traces
+
+    def clear(self):
+        self._spans.clear()
+
+
+class JsonlSpanExporter(SpanExporter):
+    """ Appends every ended span as a json line to a local file.
+    Lines are buffered and written every `flush_every` spans and on close.
+
+    Args:
+        - path[str]: File path, opened in append mode
+        - flush_every[int]: Number of spans buffered before writing them
+    """
+
+    def __init__(self, path: str, flush_every: int = 64):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer: List[bytes] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        try:
+            line = dumps(span.to_dict())
+        except TypeError:
+            # attributes that are not json types
+            line = json.dumps(span.to_dict(), default=str).encode()
+        self._buffer.append(line)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            if not lines:
+                return
+            try:
+                with open(self.path, "ab") as f:
+                    f.write(b"\n".join(lines) + b"\n")
+            except OSError as e:
+                log.warning(f"Error writing {len(lines)} spans to {self.path}: {e}")
+
+    def close(self):
+        self.flush()
+
+
+class Tracer:
+    """ Minimal tracer, spans follow the OpenTelemetry data model and the current
+    span is carried by a context variable across awaits and tasks. Without an
+    exporter every span is a no-op.
+
+    Args:
+        - exporter[SpanExporter]: Receives the ended spans, None disables tracing
+        - service_name[str]: service.name resource attribute
+        - sample_rate[float]: Fraction of the traces recorded, decided on the root span
+    """
+
+    def __init__(self,
+                 exporter: Optional[SpanExporter] = None,
+                 service_name: str = "celai-chatwoot",
+                 sample_rate: float = 1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.resource = {"service.name": service_name}
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        span = _current_span.get()
+        return span if isinstance(span, Span) else None
+
+    def span(self, name: str, kind: str = SpanKind.INTERNAL, root: bool = False, **attributes) -> Span | _NoopSpan:
+        """ Start a span, child of the current span. A root span starts a new trace.
+        Returns a no-op span when tracing is disabled or the trace is not sampled. """
+        if self.exporter is None:
+            return NOOP_SPAN
+        parent = None if root else _current_span.get()
+        if parent is None:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                return _NoopSpan(current=True)
+            return Span(self, name, kind, f"{random.getrandbits(128):032x}", None, attributes)
+        if isinstance(parent, _NoopSpan):
+            return NOOP_SPAN
+        return Span(self, name, kind, parent.trace_id, parent.span_id, attributes)
+
+    def export(self, span: Span):
+        try:
+            self.exporter.export(span)
+        except Exception as e:
+            log.warning(f"Error exporting span {span.name}: {e}")
+
+    def flush(self):
+        if self.exporter:
+            self.exporter.flush()
+
+    def close(self):
+        if self.exporter:
+            self.exporter.close()
@@ -0,0 +1,109 @@
+import json
+from typing import Any, Container, Dict, Mapping, Optional
+from celai_chatwoot.connector.events import MESSAGE_EVENTS
+
+try:
+    import orjson
+
+    def loads(body: bytes) -> Any:
+        return orjson.loads(body)
+except ImportError:  # pragma: no cover - orjson is optional
+    def loads(body: bytes) -> Any:
+        return json.loads(body)
+
+# orjson.JSONDecodeError, json.JSONDecodeError and the UnicodeDecodeError
+# of json.loads on invalid UTF-8 are all ValueErrors
+DecodeError = ValueError
+
+
+DEFAULT_EVENTS = frozenset(("message_created",))
+
+
+class WebhookFilter:
+    """ Cheap checks on the top level fields of a decoded webhook, run before the
+    webhook is queued, so irrelevant events (mostly the echo of the bot's own
+    outgoing messages) never build a lead, a message or a log line.
+
+    Args:
+        - inbox_id[str]: Only webhooks of this inbox are accepted, None to accept any inbox
+        - events[Container[str]]: Accepted Chatwoot events, a live container
+        (such as the connector's EventDispatcher) is checked on every webhook
+        - inboxes[Mapping[str, str]]: Accepted inbox ids and their account id, 
+        replaces inbox_id when a connector serves several inboxes
+    """
+
+    def __init__(self, 
+                 inbox_id: Optional[str] = None, 
+                 events: Container[str] = DEFAULT_EVENTS,
+                 inboxes: Optional[Mapping[str, Optional[str]]] = None):
+        if inboxes is None and inbox_id is not None:
+            inboxes = {str(inbox_id): None}
+        self.inboxes = inboxes
+        self.events = events
+        self._received = 0
+        self._rejected: Dict[str, int] = {}
+
+    def reject_reason(self, payload: Any) -> Optional[str]:
+        """ Returns why the webhook must be discarded, or None if it must be processed """
+        if not isinstance(payload, dict):
+            return "invalid"
+        event = payload.get("event")
+        if event not in self.events:
+            return "event"
+        if event in MESSAGE_EVENTS:
+            if payload.get("message_type", "outgoing") != "incoming":
+                return "outgoing"
+            if payload.get("private"):
+                return "private"
+        if self.inboxes is not None:
+            inbox_id = str(self.__inbox_id(payload))
+            if inbox_id not in self.inboxes:
+                return "inbox"
+            account_id = self.inboxes[inbox_id]
+            payload_account_id = self.__account_id(payload)
+            if account_id is not None and payload_account_id is not None and str(payload_account_id) != account_id:
+                return "account"
+        return None
+
+    @staticmethod
+    def __account_id(payload: dict) -> Any:
+        account = payload.get("account")
+        if isinstance(account, dict):
+            return account.get("id")
+        return payload.get("account_id")
+
+    @staticmethod
+    def __inbox_id(payload: dict) -> Any:
+        # messages have an inbox object, conversations an inbox_id
+        inbox = payload.get("inbox")
+        if isinstance(inbox, dict):
+            return inbox.get("id")
+        return payload.get("inbox_id")
+
+    def check(self, payload: Any) -> Optional[str]:
+        """ Counts the webhook and returns why it was discarded, or None if it must be processed """
+        self._received += 1
+        reason = self.reject_reason(payload)
+        if reason is not None:
+            self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        return reason
+
+    def accept(self, payload: Any) -> bool:
+        return self.check(payload) is None
+
+    @classmethod
+    def route_of(cls, payload: Any) -> tuple:
+        """ (account_id, inbox_id) of a webhook as strings, empty if unknown """
+        if not isinstance(payload, dict):
+            return "", ""
+        account_id, inbox_id = cls.__account_id(payload), cls.__inbox_id(payload)
+        return "" if account_id is None else str(account_id), "" if inbox_id is None else str(inbox_id)
+
+    def stats(self) -> Dict[str, Any]:
+        rejected = sum(self._rejected.values())
+        return {
+            "received": self._received,
+            "rejected": rejected,
+            "rejection_rate": round(rejected / self._received, 4) if self._received else 0.0,
+            "rejected_by_reason": dict(self._rejected)
+        }
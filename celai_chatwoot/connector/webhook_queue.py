@@ -0,0 +1,144 @@
+import asyncio
+import contextvars
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from loguru import logger as log
+
+
+class WebhookQueue:
+    """ Bounded queue of incoming webhooks drained by a fixed pool of async workers.
+    offer() never blocks: when the queue is full the webhook is rejected, so the
+    caller can answer 503 and let Chatwoot deliver it again later.
+
+    Args:
+        - handler[Callable]: Coroutine function called with every queued item
+        - maxsize[int]: Max number of webhooks waiting to be processed
+        - workers[int]: Number of webhooks processed at the same time
+        - on_wait[Callable]: Optional callback called with the seconds every item waited in the queue and the item
+        - propagate_context[bool]: Process every item in a copy of the context variables of
+        its producer (such as the current trace span) instead of the context of the worker
+    """
+
+    def __init__(self,
+                 handler: Callable[[Any], Awaitable[Any]],
+                 maxsize: int = 1000,
+                 workers: int = 8,
+                 on_wait: Optional[Callable[[float, Any], Any]] = None,
+                 propagate_context: bool = False):
+        assert maxsize > 0, "maxsize must be greater than 0"
+        assert workers > 0, "workers must be greater than 0"
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.on_wait = on_wait
+        self.propagate_context = propagate_context
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._busy = 0
+        self._accepted = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+        # enqueue to start latency
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """ Start the workers, must be called from a running loop """
+        if self.running:
+            return
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [loop.create_task(self.__worker(i)) for i in range(self.workers)]
+        log.debug(f"Webhook queue started with {self.workers} workers, max size: {self.maxsize}")
+
+    def offer(self, item: Any) -> bool:
+        """ Queue an item without blocking. Returns False if the queue is full """
+        if not self.running:
+            self.start()
+        try:
+            self._queue.put_nowait((item, time.perf_counter(), self.__context()))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            return False
+        self._accepted += 1
+        return True
+
+    async def put(self, item: Any):
+        """ Queue an item waiting for a free slot, used by internal producers 
+        that must not lose items """
+        if not self.running:
+            self.start()
+        await self._queue.put((item, time.perf_counter(), self.__context()))
+        self._accepted += 1
+
+    def __context(self) -> Optional[contextvars.Context]:
+        return contextvars.copy_context() if self.propagate_context else None
+
+    async def __worker(self, index: int):
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            item, enqueued_at, context = await queue.get()
+            wait = time.perf_counter() - enqueued_at
+            self._wait_count += 1
+            self._wait_total += wait
+            self._wait_last = wait
+            self._wait_max = max(self._wait_max, wait)
+            if self.on_wait:
+                self.on_wait(wait, item)
+
+            self._busy += 1
+            try:
+                if context is None:
+                    await self.handler(item)
+                else:
+                    # cancelling the worker cancels the awaited task too
+                    await loop.create_task(self.handler(item), context=context)
+                self._processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                log.error(f"Error processing queued webhook: {e}")
+            finally:
+                self._busy -= 1
+                queue.task_done()
+
+    async def join(self):
+        """ Wait until every queued webhook is processed """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.depth(),
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "busy": self._busy,
+            "accepted": self._accepted,
+            "rejected": self._rejected,
+            "processed": self._processed,
+            "failed": self._failed,
+            "wait_last": round(self._wait_last, 6),
+            "wait_avg": round(self._wait_total / self._wait_count, 6) if self._wait_count else 0.0,
+            "wait_max": round(self._wait_max, 6)
+        }
@@ -1,14 +1,15 @@
 import asyncio
 import json
-from typing import Any, Dict
+import os
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
 from urllib.parse import urljoin
 from loguru import logger as log
-from fastapi import APIRouter, BackgroundTasks
-from loguru import logger as log
-import shortuuid
-from cel.comms.utils import async_run
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
 from cel.gateway.model.base_connector import BaseConnector
-from cel.gateway.message_gateway import StreamMode
 from cel.gateway.model.message_gateway_context import MessageGatewayContext
 from cel.gateway.model.outgoing import OutgoingMessage,\
                                             OutgoingMessageType,\
@@ -18,8 +19,32 @@ from cel.gateway.model.outgoing import OutgoingMessage,\
 
 from celai_chatwoot.connector.model.woot_lead import WootLead
 from celai_chatwoot.connector.model.woot_message import WootMessage
+from celai_chatwoot.connector.model.compact import RawPayloadMode
+from celai_chatwoot.connector.model.woot_attachment import DEFAULT_LOAD_CONCURRENCY, DEFAULT_MAX_BYTES, DEFAULT_SPOOL_BYTES
 from celai_chatwoot.connector.msg_utils import ChatwootMessages, ChatwootAttachment
+from celai_chatwoot.connector.http_pool import ChatwootHttpPool
+from celai_chatwoot.connector.outbound import OutboundDispatcher
+from celai_chatwoot.connector.rate_limit import ChatwootRateLimiter
+from celai_chatwoot.connector.retry import RetryPolicy
+from celai_chatwoot.connector.media_cache import MediaCache
+from celai_chatwoot.connector.webhook_queue import WebhookQueue
+from celai_chatwoot.connector.dedup import DedupBackend, WebhookDeduplicator
+from celai_chatwoot.connector.debounce import DebouncedTurn, MessageDebouncer
+from celai_chatwoot.connector.webhook_filter import DecodeError, WebhookFilter, loads
+from celai_chatwoot.connector.metrics import CONTENT_TYPE, ConnectorMetrics
+from celai_chatwoot.connector.tracing import SpanKind, StatusCode, Tracer
+from celai_chatwoot.connector.recorder import WebhookRecorder
+from celai_chatwoot.connector.profiler import PROFILE_ENV, SamplingProfiler, parse_profile_env
+from celai_chatwoot.connector.leases import ConversationLeases, LeaseBackend, LeaseRetry
+from celai_chatwoot.connector.events import EventDispatcher, EventHandler, WootEvent
+from celai_chatwoot.connector.batch import NDJSON_TYPES, InvalidEvent, WebhookBatch, group_by_conversation, iter_ndjson
 from .bot_utils import ChatwootAgentsBots
+from .routing import InboxRoute, RoutingTable
+from .provisioning import DEFAULT_BOT_CACHE_PATH, BotIdCache, BotProvisioner, ProvisioningStatus
+
+if TYPE_CHECKING:
+    # the gateway module loads the assistants stack, it is imported by the app anyway
+    from cel.gateway.message_gateway import StreamMode
 
 
 def hash_token(token: str) -> str:
@@ -34,31 +59,180 @@ class WootConnector(BaseConnector):
        
     def __init__(self,
                  bot_name: str,
-                 account_id: str,
-                 access_key: str,
+                 account_id: Optional[str],
+                 access_key: Optional[str],
                  chatwoot_url: str,
-                 inbox_id: str,
+                 inbox_id: Optional[str],
                  bot_description: str = "Celai Bot",
-                 stream_mode: StreamMode = StreamMode.SENTENCE,
-                 ssl: bool = False):
+                 stream_mode: Optional['StreamMode'] = None,
+                 ssl: bool = False,
+                 pool_limit: int = 100,
+                 pool_limit_per_host: int = 0,
+                 keepalive_timeout: float = 30.0,
+                 dns_cache_ttl: int = 300,
+                 outbound_concurrency: int = 16,
+                 rate_limit: float = None,
+                 rate_limit_burst: int = None,
+                 inbox_rate_limit: float = None,
+                 inbox_rate_limit_burst: int = None,
+                 retry_policy: RetryPolicy = None,
+                 media_cache_size: int = 64 * 1024 * 1024,
+                 media_cache_dir: str = None,
+                 media_cache_ttl: float = 300,
+                 webhook_queue_size: int = 1000,
+                 webhook_workers: int = 8,
+                 dedup_ttl: float = 600,
+                 dedup_backend: DedupBackend = None,
+                 debounce_window: float = 0,
+                 debounce_max_wait: float = 5.0,
+                 raw_webhook: bool = True,
+                 raw_payload: str = RawPayloadMode.COMPACT,
+                 attachment_max_bytes: int = DEFAULT_MAX_BYTES,
+                 attachment_spool_bytes: int = DEFAULT_SPOOL_BYTES,
+                 attachment_concurrency: int = DEFAULT_LOAD_CONCURRENCY,
+                 attachment_prefetch: bool = False,
+                 security_token: str = None,
+                 bot_cache_path: Optional[str] = DEFAULT_BOT_CACHE_PATH,
+                 routes: List[InboxRoute] = None,
+                 lease_backend: LeaseBackend = None,
+                 lease_ttl: float = 30.0,
+                 lease_wait: float = 60.0,
+                 lease_owner: str = None,
+                 lease_forward: Callable[[str, WootMessage], Awaitable[bool]] = None,
+                 metrics: bool = True,
+                 tracer: Tracer = None,
+                 recorder: WebhookRecorder = None,
+                 profile_dir: str = None,
+                 reject_until_ready: bool = False,
+                 shutdown_timeout: float = 30.0):
         log.debug("Creating Chatwoot connector")
 
         self.router = APIRouter(prefix="/chatwoot")
         self.paused = False
+        self.gateway = None
+        # Agent bot provisioning, started by startup() without blocking it
+        self.provisioning = ProvisioningStatus()
+        self._provisioning_task: Optional[asyncio.Task] = None
+        self._closing: Optional[asyncio.Task] = None
+        # Max seconds the shutdown waits for the queued webhooks
+        self.shutdown_timeout = shutdown_timeout
+        # While provisioning, webhooks are queued and held, or answered 503
+        self.reject_until_ready = reject_until_ready
         
-        # generate shortuuid for security token
-        self.security_token = shortuuid.uuid()
+        # generate shortuuid for security token, a fixed token keeps the bot 
+        # webhook url stable between deploys
+        if security_token is None:
+            import shortuuid
+            security_token = shortuuid.uuid()
+        self.security_token = security_token
+        self.raw_webhook = raw_webhook
+        # Counters and latency histograms of every stage, served on /metrics/{security_token}
+        self.metrics = ConnectorMetrics() if metrics else None
+        # Spans from the webhook route to the last Chatwoot request, disabled without an exporter
+        self.tracer = tracer or Tracer()
+        # Optional recording of the incoming traffic, for replays
+        self.recorder = recorder
+        # On demand sampling profiler, started by the environment or the admin route
+        self.profiler = SamplingProfiler(output_dir=profile_dir)
+        self._profile_on_startup = parse_profile_env(os.environ.get(PROFILE_ENV))
         self.__create_routes(self.router)
+        if stream_mode is None:
+            from cel.gateway.message_gateway import StreamMode
+            stream_mode = StreamMode.SENTENCE
         self.stream_mode = stream_mode
         
         # Chatwoot configuration
         self.bot_name = bot_name
-        self.account_id = account_id
-        self.access_key = access_key
-        self.inbox_id = inbox_id
+        # Served inboxes, account_id/inbox_id/access_key is the primary route
+        self.routes = RoutingTable()
+        if account_id is not None and inbox_id is not None:
+            self.routes.add(InboxRoute(account_id=account_id, inbox_id=inbox_id, access_key=access_key))
+        for route in routes or []:
+            self.routes.add(route)
+        assert len(self.routes) > 0, "account_id and inbox_id or routes must be set"
+        self.account_id = self.routes.primary.account_id
+        self.access_key = self.routes.primary.access_key
+        self.inbox_id = self.routes.primary.inbox_id
         self.chatwoot_url = chatwoot_url
         self.bot_description = bot_description or "Celai generated Bot"
         self.ssl = ssl
+        self.bot_cache_path = bot_cache_path
+        
+        # Client side rate limit (requests per second) per account and per inbox
+        self.rate_limiter = ChatwootRateLimiter(rate=rate_limit,
+                                                burst=rate_limit_burst,
+                                                inbox_rate=inbox_rate_limit,
+                                                inbox_burst=inbox_rate_limit_burst) if rate_limit else None
+        
+        # Shared HTTP connection pool, opened on startup and closed on shutdown
+        self.http = ChatwootHttpPool(limit=pool_limit,
+                                     limit_per_host=pool_limit_per_host,
+                                     keepalive_timeout=keepalive_timeout,
+                                     dns_cache_ttl=dns_cache_ttl,
+                                     ssl=ssl,
+                                     rate_limiter=self.rate_limiter,
+                                     retry_policy=retry_policy,
+                                     metrics=self.metrics,
+                                     tracer=self.tracer)
+        self.messages_clients: dict[tuple, ChatwootMessages] = {}
+        
+        # Cache for repeated outgoing media (urls and local files)
+        self.media_cache = MediaCache(max_bytes=media_cache_size,
+                                      ttl=media_cache_ttl,
+                                      disk_path=media_cache_dir) if media_cache_size else None
+        
+        # Incoming webhooks are queued and processed by a bounded pool of workers
+        self.webhook_queue = WebhookQueue(self.__process_queued,
+                                          maxsize=webhook_queue_size,
+                                          workers=webhook_workers,
+                                          on_wait=self.__observe_queue_wait if self.metrics else None,
+                                          propagate_context=self.tracer.enabled)
+        
+        # Webhooks redelivered by Chatwoot are dropped by message id
+        self.dedup = WebhookDeduplicator(backend=dedup_backend, ttl=dedup_ttl)
+        
+        # How leads keep the webhook payload in metadata['raw']
+        self.raw_payload = raw_payload
+        
+        # Incoming attachments are downloaded on demand with the shared pool
+        self.attachment_max_bytes = attachment_max_bytes
+        self.attachment_spool_bytes = attachment_spool_bytes
+        # attachments of a message are loaded concurrently, optionally fetching their size and type
+        self.attachment_concurrency = attachment_concurrency
+        self.attachment_prefetch = attachment_prefetch
+        
+        # Handlers by Chatwoot event, events without handlers are discarded by the webhook route
+        self.events = EventDispatcher()
+        self.events.register(WootEvent.MESSAGE_CREATED, self.__process_message)
+        self.events.register(WootEvent.CONVERSATION_STATUS_CHANGED, self.__on_status_changed)
+        self.events.register(WootEvent.CONVERSATION_RESOLVED, self.__on_status_changed)
+        
+        # Irrelevant webhooks are discarded before being queued
+        self.webhook_filter = WebhookFilter(events=self.events, inboxes=self.routes.inboxes)
+        
+        # Optional per conversation debounce, bursts of messages are merged into one gateway call
+        self.debouncer = MessageDebouncer(self.__queue_debounced,
+                                          window=debounce_window,
+                                          max_wait=debounce_max_wait) if debounce_window else None
+        
+        # Conversation leases between replicas, disabled without a backend
+        self.leases = ConversationLeases(backend=lease_backend,
+                                         ttl=lease_ttl,
+                                         wait=lease_wait,
+                                         owner=lease_owner) if lease_backend else None
+        self.lease_forward = lease_forward
+        self._forwarded = 0
+        # messages of the conversations waiting for their lease on this replica, in order
+        self._lease_queues: Dict[str, deque] = {}
+        self._lease_timers: Dict[str, asyncio.TimerHandle] = {}
+        # conversations waiting for longer than lease_wait
+        self._lease_stuck: set = set()
+        
+        # Outbound pipeline: ordered per conversation, concurrent across conversations
+        self.outbound = OutboundDispatcher(concurrency=outbound_concurrency,
+                                           propagate_context=self.tracer.enabled)
+        if self.metrics:
+            self.__register_gauges(self.metrics)
         
 
     def name(self) -> str:
@@ -67,44 +241,379 @@ class WootConnector(BaseConnector):
 
 
     def __create_routes(self, router: APIRouter):
-                
-        @router.post(f"/webhook/{self.security_token}")
-        async def woot_webhook(payload: Dict[Any, Any], background_tasks: BackgroundTasks):
- 
-            background_tasks.add_task(self.__process_message, payload)
-            return {"status": "ok"}
+        
+        if self.raw_webhook:
+            @router.post(f"/webhook/{self.security_token}")
+            async def woot_webhook(request: Request):
+                with self.tracer.span("chatwoot.webhook", kind=SpanKind.SERVER, root=True) as span:
+                    # decode the raw body, skipping FastAPI body validation
+                    try:
+                        payload = loads(await request.body())
+                    except DecodeError:
+                        span.set_attribute("chatwoot.webhook.status", "invalid")
+                        return JSONResponse({"status": "invalid"}, status_code=400)
+                    if self.recorder:
+                        self.recorder.record(payload)
+                    return self.__enqueue_webhook(payload, span)
+        else:
+            @router.post(f"/webhook/{self.security_token}")
+            async def woot_webhook(payload: Dict[Any, Any]):
+                with self.tracer.span("chatwoot.webhook", kind=SpanKind.SERVER, root=True) as span:
+                    if self.recorder:
+                        self.recorder.record(payload)
+                    return self.__enqueue_webhook(payload, span)
+        
+        @router.post(f"/webhook/{self.security_token}/batch")
+        async def woot_webhook_batch(request: Request):
+            """ Many events in a single request, as a JSON array or NDJSON """
+            with self.tracer.span("chatwoot.webhook.batch", kind=SpanKind.SERVER, root=True) as span:
+                content_type = request.headers.get("content-type", "").split(";")[0].strip()
+                if content_type in NDJSON_TYPES:
+                    events = [e async for e in iter_ndjson(request.stream())]
+                else:
+                    try:
+                        events = loads(await request.body())
+                    except DecodeError:
+                        return JSONResponse({"status": "invalid"}, status_code=400)
+                    if not isinstance(events, list):
+                        return JSONResponse({"status": "invalid"}, status_code=400)
+                if self.recorder:
+                    self.recorder.record([e for e in events if not isinstance(e, InvalidEvent)], route="batch")
+                result = self.__enqueue_batch(events)
+                span.set_attribute("chatwoot.batch.events", len(events))
+                span.set_attribute("chatwoot.batch.accepted", result["accepted"])
+                return result
+        
+        @router.get(f"/admin/{self.security_token}/profile")
+        async def woot_profile_status():
+            return self.profiler.stats()
+        
+        @router.post(f"/admin/{self.security_token}/profile")
+        async def woot_profile_start(webhooks: Optional[int] = None, seconds: Optional[float] = None):
+            """ Profile the next webhooks or seconds, whichever comes first """
+            return self.profiler.start(webhooks=webhooks, seconds=seconds)
+        
+        @router.delete(f"/admin/{self.security_token}/profile")
+        async def woot_profile_stop():
+            # waits for the profile to be written
+            await asyncio.to_thread(self.profiler.stop)
+            return self.profiler.stats()
+        
+        @router.get(f"/health/{self.security_token}")
+        async def woot_health():
+            """ Readiness probe, 200 once the agent bots are provisioned """
+            health = self.health()
+            return JSONResponse(health, status_code=200 if health["ready"] else 503)
+        
+        if self.metrics:
+            @router.get(f"/metrics/{self.security_token}")
+            async def woot_metrics():
+                """ Connector metrics in the Prometheus text format """
+                return Response(self.metrics.render(), media_type=CONTENT_TYPE)
 
-    async def __process_message(self, payload: dict):
-        log.debug(f"Processing Chatwoot request {payload}")
+    def __register_gauges(self, metrics: ConnectorMetrics):
+        # read when the metrics are rendered, never on the hot path
+        metrics.gauge("webhook_queue_depth", "Webhooks waiting in the queue", self.webhook_queue.depth)
+        metrics.gauge("webhook_workers_busy", "Webhook workers processing a webhook", lambda: self.webhook_queue.stats()["busy"])
+        metrics.gauge("outbound_queued", "Outgoing messages queued, including the ones being sent", lambda: self.outbound.stats()["queued"])
+        metrics.gauge("outbound_in_flight", "Outgoing messages being sent", lambda: self.outbound.stats()["in_flight"])
+        metrics.gauge("debounce_pending_messages", "Messages waiting for their burst to be closed", 
+                      lambda: self.debouncer.stats()["pending_messages"] if self.debouncer else 0)
+        metrics.gauge("http_pool_connections", "Chatwoot HTTP pool connections by state",
+                      lambda: {(state,): self.http.stats()[state] for state in ("in_use", "idle", "waiting")}, ("state",))
+
+    @staticmethod
+    def __describe_webhook(span, payload: Any, reason: Optional[str]):
+        account_id, inbox_id = WebhookFilter.route_of(payload)
+        span.set_attribute("chatwoot.account_id", account_id)
+        span.set_attribute("chatwoot.inbox_id", inbox_id)
+        if isinstance(payload, dict):
+            span.set_attribute("chatwoot.event", payload.get("event"))
+            span.set_attribute("chatwoot.message_id", payload.get("id"))
+            conversation = payload.get("conversation")
+            if isinstance(conversation, dict):
+                span.set_attribute("chatwoot.conversation_id", conversation.get("id"))
+        span.set_attribute("chatwoot.webhook.status", reason or "ok")
+
+    def __observe_queue_wait(self, wait: float, item: Any):
+        if isinstance(item, DebouncedTurn):
+            labels = self.__lead_labels(item.message.lead)
+        elif isinstance(item, WebhookBatch):
+            # the events of a batch item share their conversation
+            labels = WebhookFilter.route_of(item[0] if item else None)
+        elif isinstance(item, LeaseRetry):
+            # not a webhook, the messages already waited in the queue
+            return
+        else:
+            labels = WebhookFilter.route_of(item)
+        self.metrics.queue_wait.observe(wait, *labels)
+
+    def __count_webhook(self, payload: Any, reason: Optional[str]):
+        account_id, inbox_id = WebhookFilter.route_of(payload)
+        self.metrics.webhooks_received.inc(account_id, inbox_id)
+        if reason is not None:
+            self.metrics.webhooks_rejected.inc(account_id, inbox_id, reason)
+
+    def __starting(self) -> bool:
+        return self.reject_until_ready and self.provisioning.started and not self.provisioning.done
+
+    def __enqueue_webhook(self, payload: Any, span=None):
+        reason = self.webhook_filter.check(payload)
+        if reason is None and self.__starting():
+            reason = "starting"
+        elif reason is None and not self.webhook_queue.offer(payload):
+            reason = "busy"
+        if self.metrics:
+            self.__count_webhook(payload, reason)
+        if span is not None and self.tracer.enabled:
+            self.__describe_webhook(span, payload, reason)
+        
+        if reason == "busy":
+            log.warning(f"Chatwoot webhook queue is full ({self.webhook_queue.maxsize}), rejecting webhook")
+            # Chatwoot will deliver the webhook again later
+            return JSONResponse({"status": "busy"}, status_code=503, headers={"Retry-After": "1"})
+        if reason == "starting":
+            # the bot is not assigned yet, Chatwoot will deliver the webhook again later
+            return JSONResponse({"status": "starting"}, status_code=503, headers={"Retry-After": "5"})
+        if reason is not None:
+            return {"status": "ignored"}
+        return {"status": "ok"}
+
+    def __enqueue_batch(self, events: list) -> dict:
+        results = ["ok"] * len(events)
+        reasons: List[Optional[str]] = [None] * len(events)
+        accepted = []
+        starting = self.__starting()
+        for index, payload in enumerate(events):
+            if isinstance(payload, InvalidEvent):
+                results[index] = reasons[index] = "invalid"
+            elif (reason := self.webhook_filter.check(payload)) is not None:
+                results[index], reasons[index] = "ignored", reason
+            elif starting:
+                results[index] = reasons[index] = "starting"
+            else:
+                accepted.append((index, payload))
         
+        # a single queue item per conversation keeps its events in order
+        for indexes, batch in group_by_conversation(accepted):
+            if not self.webhook_queue.offer(batch):
+                for index in indexes:
+                    results[index] = reasons[index] = "busy"
+        
+        if self.metrics:
+            for payload, reason in zip(events, reasons):
+                self.__count_webhook(payload, reason)
+        busy = results.count("busy")
+        if busy:
+            log.warning(f"Chatwoot webhook queue is full ({self.webhook_queue.maxsize}), rejected {busy} batched webhooks")
+        return {
+            "accepted": results.count("ok"),
+            "rejected": len(results) - results.count("ok"),
+            "results": results
+        }
+
+    async def __process_queued(self, item: dict | DebouncedTurn | WebhookBatch | LeaseRetry):
+        # the queue holds webhook payloads, batches of a conversation 
+        # and debounced messages ready for the gateway
+        if self.provisioning.started and not self.provisioning.done:
+            # webhooks received during startup wait for the bot to be assigned
+            await self.provisioning.wait()
+        if isinstance(item, DebouncedTurn):
+            try:
+                await self.__process_gateway(item.message)
+            finally:
+                if not item.done.done():
+                    item.done.set_result(None)
+            return
+        if isinstance(item, LeaseRetry):
+            await self.__drain_conversation(item.key, item.since, item.attempt)
+            return
+        if isinstance(item, WebhookBatch):
+            for payload in item:
+                await self.events.dispatch(payload)
+        else:
+            await self.events.dispatch(item)
+        if self.profiler.active:
+            self.profiler.on_webhook(len(item) if isinstance(item, WebhookBatch) else 1)
+
+    async def __queue_debounced(self, msg: WootMessage):
+        # the merged message is answered by a queue worker, the debouncer holds the next 
+        # burst of the conversation until then. With leases the message may only join the 
+        # conversation FIFO, which keeps the order as well
+        done = asyncio.get_running_loop().create_future()
+        await self.webhook_queue.put(DebouncedTurn(msg, done))
+        await done
+
+    def on_event(self, event: str, handler: EventHandler = None):
+        """ Register a coroutine function called with the payload of every webhook 
+        of the event. Can be used as a decorator: @conn.on_event(WootEvent.CONVERSATION_UPDATED) """
+        if handler is None:
+            def decorator(fn: EventHandler) -> EventHandler:
+                self.events.register(event, fn)
+                return fn
+            return decorator
+        self.events.register(event, handler)
+        return handler
+
+    async def __on_status_changed(self, payload: dict):
+        # conversation events carry the conversation, its messages have the account id
+        if payload.get("status") != "resolved":
+            return
+        conversation_id = payload.get("id")
+        route = self.routes.get(payload.get("inbox_id"))
+        if conversation_id is None or route is None:
+            return
+        account_id, inbox_id = route.account_id, route.inbox_id
+        
+        # drop the answers still queued and the messages waiting for the debounce
+        lead = WootLead(account_id=account_id, inbox_id=inbox_id, conversation_id=conversation_id, connector=self)
+        dropped = self.outbound.cancel(self.outbound_key(lead))
+        if self.debouncer:
+            dropped += self.debouncer.cancel(lead.get_session_id())
+        if dropped:
+            log.debug(f"Conversation {lead} resolved, dropped {dropped} queued messages")
+
+    async def __process_message(self, payload: dict):
+        # outgoing, private and foreign inbox webhooks are discarded by self.webhook_filter
         if self.paused:
             log.warning("Chatwoot connector is paused, ignoring message")
             return         
         
-        try:
-            log.debug("Received Chatwoot request")
-            # log.debug(payload)
+        with self.tracer.span("chatwoot.process_message", kind=SpanKind.CONSUMER) as span:
+            try:
+                if await self.dedup.is_duplicate(payload):
+                    log.debug(f"Ignoring duplicated webhook for message {self.dedup.key_for(payload)}")
+                    span.set_attribute("chatwoot.duplicate", True)
+                    return
+                
+                parse_started = time.perf_counter()
+                with self.tracer.span("chatwoot.parse"):
+                    msg = await WootMessage.load_from_message(payload, connector=self)
+                if self.metrics:
+                    self.metrics.parse.observe(time.perf_counter() - parse_started, *self.__lead_labels(msg.lead))
+                span.set_attribute("chatwoot.session_id", msg.lead.get_session_id())
+                
+                has_attachments = msg.attachments is not None and len(msg.attachments) > 0
+                if has_attachments:
+                    log.debug(f"Received message with attachments: {msg.attachments}")
+                    span.set_attribute("chatwoot.attachments", len(msg.attachments))
+                
+                assert isinstance(msg, WootMessage), "msg must be an instance of WootMessage"
+                
+                if self.debouncer:
+                    # the burst is sent back to the queue once it is closed
+                    self.debouncer.push(msg)
+                    span.set_attribute("chatwoot.debounced", True)
+                    return
+                
+                await self.__process_gateway(msg)
+                    
+            except Exception as e:
+                log.error(f"Error processing chatwoot incoming request to webhook: {e}")
+                span.set_status(StatusCode.ERROR, str(e))
+
+    async def __process_gateway(self, msg: WootMessage):
+        if self.leases is None:
+            await self.__run_gateway(msg)
+            return
+        
+        # only the replica holding the conversation lease answers it, the messages
+        # of a conversation wait in a FIFO so they are answered in order
+        key = msg.lead.get_session_id()
+        pending = self._lease_queues.get(key)
+        if pending is not None:
+            # an older message of the conversation is waiting for the lease or running
+            pending.append(msg)
+            return
+        self._lease_queues[key] = deque([msg])
+        await self.__drain_conversation(key, time.monotonic())
 
-            if payload.get("message_type", "outgoing") == "outgoing":
-                log.debug("Ignoring outgoing message")
+    async def __drain_conversation(self, key: str, since: float, attempt: int = 0):
+        pending = self._lease_queues[key]
+        holder = await self.leases.try_acquire(key)
+        if holder is None:
+            if self.lease_forward and await self.__forward_conversation(key, pending):
                 return
-            
-            msg = await WootMessage.load_from_message(payload, connector=self)
-            
-            has_attachments = msg.attachments is not None and len(msg.attachments) > 0
-            if has_attachments:
-                log.debug(f"Received message with attachments: {msg.attachments}")
-            
-            assert isinstance(msg, WootMessage), "msg must be an instance of WootMessage"
-            
-            
+            # the worker is not blocked while another replica holds the conversation, 
+            # the lease is tried again later from the queue
+            waited = time.monotonic() - since
+            if waited >= self.leases.wait and key not in self._lease_stuck:
+                # the messages keep waiting, the lease expires if its replica died
+                self._lease_stuck.add(key)
+                log.warning(f"Conversation {key} is held by {await self.leases.holder(key)} "
+                            f"for {waited:.0f}s, {len(pending)} messages are waiting")
+            span = self.tracer.current_span()
+            if span is not None:
+                span.add_event("lease_busy", attempt=attempt)
+            self.__schedule_lease_retry(key, since, attempt + 1)
+            return
+        
+        self._lease_stuck.discard(key)
+        try:
+            async with self.leases.hold(key, holder):
+                while pending:
+                    await self.__run_gateway(pending.popleft())
+                # no await between the last check and the removal, 
+                # newer messages start their own FIFO
+                del self._lease_queues[key]
+        finally:
+            if self._lease_queues.get(key) is pending:
+                # the gateway failed, the next messages keep their turn
+                if pending:
+                    self.__schedule_lease_retry(key, time.monotonic(), 0)
+                else:
+                    del self._lease_queues[key]
+
+    async def __forward_conversation(self, key: str, pending: deque) -> bool:
+        """ Hands the waiting messages of the conversation to its owner replica, in order """
+        owner = self.leases.owner_of(await self.leases.holder(key))
+        if not owner or owner == self.leases.owner:
+            return False
+        while pending and await self.lease_forward(owner, pending[0]):
+            pending.popleft()
+            self._forwarded += 1
+            log.debug(f"Chatwoot message {key} forwarded to replica {owner}")
+        if pending:
+            return False
+        del self._lease_queues[key]
+        self._lease_stuck.discard(key)
+        return True
+
+    def __schedule_lease_retry(self, key: str, since: float, attempt: int):
+        delay = min(0.01 * 2 ** attempt, 0.5)
+        self._lease_timers[key] = asyncio.get_running_loop().call_later(delay, self.__retry_lease, key, since, attempt)
+
+    def __retry_lease(self, key: str, since: float, attempt: int):
+        self._lease_timers.pop(key, None)
+        if not self.webhook_queue.offer(LeaseRetry(key, attempt, since)):
+            # the queue is full, the messages stay in their FIFO
+            self.__schedule_lease_retry(key, since, attempt)
+
+    @staticmethod
+    def __lead_labels(lead: WootLead) -> tuple:
+        return str(lead.account_id), str(lead.inbox_id)
+
+    async def __run_gateway(self, msg: WootMessage):
+        metrics = self.metrics
+        try:
             # Process message through the gateway
             if self.gateway:
-                async for m in self.gateway.process_message(msg, mode=self.stream_mode):
-                    pass            
-                
+                with self.tracer.span("chatwoot.gateway", **{"chatwoot.stream_mode": str(self.stream_mode)}) as span:
+                    started = time.perf_counter()
+                    chunks = 0
+                    async for m in self.gateway.process_message(msg, mode=self.stream_mode):
+                        if chunks == 0:
+                            span.add_event("first_chunk")
+                            if metrics:
+                                metrics.first_chunk.observe(time.perf_counter() - started, *self.__lead_labels(msg.lead))
+                        chunks += 1
+                    span.set_attribute("chatwoot.chunks", chunks)
+                    # the answers are sent inside the span, the Chatwoot requests are its children
+                    await self.flush(msg.lead)
+                    if metrics:
+                        metrics.gateway.observe(time.perf_counter() - started, *self.__lead_labels(msg.lead))
         except Exception as e:
-            log.error(f"Error processing chatwoot incoming request to webhook: {e}")
+            log.error(f"Error processing chatwoot message {msg.lead.get_session_id()} through the gateway: {e}")
 
 
     async def send_select_message(self, 
@@ -179,16 +688,14 @@ class WootConnector(BaseConnector):
         is_private = (metadata or {}).get("private", False)
         
         log.debug(f"Sending message to Chatwoot acc: {lead.account_id}, inbox: {lead.inbox_id}, conv: {lead.conversation_id}, private:{is_private}, text: {text}")   
-        client = ChatwootMessages(base_url=self.chatwoot_url,
-                                  account_id=lead.account_id,
-                                  access_key=self.access_key,
-                                  ssl=self.ssl)
+        client = self.get_messages_client(lead)
             
-        await client.send_text_message(conversation_id=lead.conversation_id,
-                                       content=text,
-                                       content_attributes=metadata,
-                                       message_type="outgoing",
-                                       private=is_private)
+        return self.outbound.submit(self.outbound_key(lead), 
+                                    lambda: client.send_text_message(conversation_id=lead.conversation_id,
+                                                                     content=text,
+                                                                     content_attributes=metadata,
+                                                                     message_type="outgoing",
+                                                                     private=is_private))
         
         
     async def send_typing_action(self, lead: WootLead):    
@@ -204,10 +711,7 @@ class WootConnector(BaseConnector):
                                  metadata: dict = {}, 
                                  is_partial: bool = True):
         
-        client = ChatwootMessages(base_url=self.chatwoot_url,
-                                  account_id=lead.account_id,
-                                  access_key=self.access_key,
-                                  ssl=self.ssl)
+        client = self.get_messages_client(lead)
         
         is_private = (metadata or {}).get("private", False)
               
@@ -215,10 +719,11 @@ class WootConnector(BaseConnector):
                                     content=image, 
                                     fileName=filename)
         
-        await client.send_attachment(conversation_id=lead.conversation_id,
-                                     attach=attach,
-                                     text=caption,
-                                     is_private=is_private)
+        return self.outbound.submit(self.outbound_key(lead),
+                                    lambda: client.send_attachment(conversation_id=lead.conversation_id,
+                                                                   attach=attach,
+                                                                   text=caption,
+                                                                   is_private=is_private))
         
     async def send_audio_message(self, 
                                  lead: WootLead, 
@@ -227,23 +732,122 @@ class WootConnector(BaseConnector):
                                  caption:str = None, 
                                  metadata: dict = {}):
         
-        client = ChatwootMessages(base_url=self.chatwoot_url,
-                                  account_id=lead.account_id,
-                                  access_key=self.access_key,
-                                  ssl=self.ssl)
+        client = self.get_messages_client(lead)
         
         is_private = (metadata or {}).get("private", False)
         attach = ChatwootAttachment(type="audio",
                                     content=content, 
                                     fileName=filename)
         
-        await client.send_attachment(conversation_id=lead.conversation_id,
-                                     attach=attach,
-                                     text=caption,
-                                     is_private=is_private)
+        return self.outbound.submit(self.outbound_key(lead),
+                                    lambda: client.send_attachment(conversation_id=lead.conversation_id,
+                                                                   attach=attach,
+                                                                   text=caption,
+                                                                   is_private=is_private))
                                  
 
 
+    def outbound_key(self, lead: WootLead) -> str:
+        return f"{lead.account_id}:{lead.conversation_id}"
+    
+    async def flush(self, lead: WootLead = None):
+        """ Wait until all the queued outgoing messages of the lead 
+        (or of every lead if None) are sent to Chatwoot """
+        await self.outbound.flush(self.outbound_key(lead) if lead else None)
+        
+    def event_stats(self) -> dict:
+        """ Registered events and dispatched webhooks by event """
+        return self.events.stats()
+        
+    def lease_stats(self) -> dict:
+        """ Conversation leases held and forwarded, messages waiting for a lease 
+        and conversations waiting for longer than lease_wait, empty if leases are disabled """
+        if self.leases is None:
+            return {}
+        return {**self.leases.stats(),
+                "forwarded": self._forwarded,
+                "waiting": sum(len(pending) for pending in self._lease_queues.values()),
+                "stuck": len(self._lease_stuck)}
+        
+    def webhook_stats(self) -> dict:
+        """ Incoming webhook queue metrics: depth, rejected webhooks and enqueue to start latency """
+        return self.webhook_queue.stats()
+        
+    def dedup_stats(self) -> dict:
+        """ Number of duplicated webhooks dropped and seen-set size """
+        return self.dedup.stats()
+        
+    def webhook_filter_stats(self) -> dict:
+        """ Webhooks received by the route and discarded before being queued, by reason """
+        return self.webhook_filter.stats()
+        
+    def debounce_stats(self) -> dict:
+        """ Pending bursts and merged messages, empty if debounce is disabled """
+        return self.debouncer.stats() if self.debouncer else {}
+        
+    def outbound_stats(self) -> dict:
+        """ Outbound queue metrics: conversations with pending sends, queued and in flight messages """
+        return self.outbound.stats()
+
+    def get_messages_client(self, lead: WootLead) -> ChatwootMessages:
+        """ Returns the messages client for the lead account and inbox, 
+        all the clients share the connector HTTP pool. Raises ValueError 
+        if the connector has no route for the lead account."""
+        key = (str(lead.account_id), str(lead.inbox_id))
+        client = self.messages_clients.get(key)
+        if client is None:
+            access_key = self.routes.access_key(lead.account_id)
+            if access_key is None:
+                # the key of another account would post as its bot, or be refused by Chatwoot
+                raise ValueError(f"Chatwoot account {lead.account_id} is not served by this connector")
+            client = ChatwootMessages(base_url=self.chatwoot_url,
+                                      account_id=lead.account_id,
+                                      access_key=access_key,
+                                      ssl=self.ssl,
+                                      http=self.http,
+                                      inbox_id=lead.inbox_id,
+                                      media_cache=self.media_cache)
+            self.messages_clients[key] = client
+        return client
+        
+    def pool_stats(self) -> dict:
+        """ HTTP pool statistics: connections in use, idle and waiting requests """
+        return self.http.stats()
+    
+    def throttle_stats(self) -> dict:
+        """ Current client side throttle per rate limit bucket: 
+        0 = sending at the configured rate, 1 = blocked by Chatwoot """
+        return self.http.throttle()
+    
+    def media_cache_stats(self) -> dict:
+        """ Outgoing media cache hits, misses, revalidations and size """
+        return self.media_cache.stats() if self.media_cache else {}
+    
+    def render_metrics(self) -> str:
+        """ Connector metrics in the Prometheus text format, empty if metrics are disabled """
+        return self.metrics.render() if self.metrics else ""
+    
+    def retry_stats(self) -> dict:
+        """ Retry counters per Chatwoot API endpoint """
+        return self.http.retry_stats()
+    
+    def health(self) -> dict:
+        """ Readiness of the connector: provisioning state, pause state, 
+        webhook queue depth, outbound queue and HTTP pool health """
+        queue = self.webhook_queue.stats()
+        return {
+            "ready": self.provisioning.ready,
+            "paused": self.paused,
+            "provisioning": self.provisioning.stats(),
+            "webhook_queue": {key: queue[key] for key in ("queued", "maxsize", "workers", "busy")},
+            "outbound": self.outbound_stats(),
+            "pool": self.pool_stats()
+        }
+    
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """ Waits for the agent bot provisioning started by startup(), 
+        returns True if the bots are assigned """
+        return await self.provisioning.wait(timeout)
         
     def get_router(self) -> APIRouter:
         return self.router
@@ -254,6 +858,31 @@ class WootConnector(BaseConnector):
             "gateway must be an instance of MessageGateway"
         self.gateway = gateway
     
+    async def provision_bots(self, webhook_url: str, http: ChatwootHttpPool = None) -> Dict[str, Any]:
+        """ Create or update the agent bot of every account and assign it to the 
+        account inboxes, accounts are provisioned concurrently. Returns the bots by account id.
+        The requests use the connector pool unless another pool is given """
+        http = http or self.http
+        cache = BotIdCache(self.bot_cache_path) if self.bot_cache_path else None
+        
+        async def provision(account_id: str, inbox_ids: List[str]):
+            client = ChatwootAgentsBots(
+                base_url=self.chatwoot_url,
+                account_id=account_id,
+                access_key=self.routes.access_key(account_id),
+                ssl=self.ssl,
+                http=http
+            )
+            bot = await BotProvisioner(client, cache=cache).provision(name=self.bot_name,
+                                                                      outgoing_url=webhook_url,
+                                                                      description=self.bot_description,
+                                                                      inbox_ids=inbox_ids)
+            log.debug(f"Chatwoot Bot '{self.bot_name}' id:{bot['id']} assigned to inboxes {inbox_ids} of account {account_id}")
+            return account_id, bot
+        
+        accounts = self.routes.accounts()
+        return dict(await asyncio.gather(*(provision(acc, inboxes) for acc, inboxes in accounts.items())))
+    
     def startup(self, context: MessageGatewayContext):
         # verify if the webhook_url is set and is HTTPS
         assert context.webhook_url, "webhook_url must be set in the context"
@@ -261,44 +890,108 @@ class WootConnector(BaseConnector):
             (f"webhook_url must be HTTPS, got: {context.webhook_url}"
             "Be sure that your url is public and has a valid SSL certificate.")
         
-        async def update_bot():
-            try:
-                base_url = f"{context.webhook_url}"
-                webhook_url = urljoin(base_url, f"{self.router.prefix}/webhook/{self.security_token}")
-                
-                log.debug(f"Updating Chatwoot Bot webhook url to: {webhook_url}")
-
-                client = ChatwootAgentsBots(
-                    base_url=self.chatwoot_url,
-                    account_id=self.account_id,
-                    access_key=self.access_key,
-                    ssl=self.ssl
-                )
-                
-                bot = await client.upsert_bot(name=self.bot_name,
-                                            outgoing_url=webhook_url,
-                                            description=self.bot_description)
-                               
-                bot_id = bot["id"]
-                log.debug(f"Chatwoot Bot '{self.bot_name}' id:{bot_id} updated. Adding bot to inbox {self.inbox_id}")
-                await client.assign_bot_to_inbox(inbox_id=self.inbox_id, agent_bot_id=bot_id)
-                log.debug(f"Chatwoot Bot '{self.bot_name}' assigned to inbox {self.inbox_id}")
-                
-            except Exception as e:
-                log.error(f"Error updating Chatwoot bot: {e}")
-                log.exception(e)
-                raise e
+        webhook_url = urljoin(context.webhook_url, f"{self.router.prefix}/webhook/{self.security_token}")
         try:
             loop = asyncio.get_running_loop()
-            loop.create_task(update_bot())
         except RuntimeError:
-            # If no loop is running, use asyncio.run()
-            asyncio.run(update_bot())        
+            loop = None
+        
+        # the profiler samples from its own thread, it does not need the loop
+        if self._profile_on_startup:
+            self.profiler.start(**self._profile_on_startup)
+        app = getattr(context, "app", None)
+        if app is not None:
+            # awaited by the app after the synchronous shutdown hooks
+            app.router.on_shutdown.append(self.aclose)
+        
+        # startup returns right away, the provisioning is tracked by self.provisioning
+        self.provisioning.begin()
+        if loop is None:
+            # The app loop is not running yet, the bots are provisioned from a thread 
+            # with its own loop and pool, so the connector pool is not bound to it
+            threading.Thread(target=asyncio.run,
+                             args=(self.__provision_standalone(webhook_url),),
+                             name="celai-chatwoot-provisioning",
+                             daemon=True).start()
+            return
+        
+        self.http.open()
+        self.webhook_queue.start()
+        self._provisioning_task = loop.create_task(self.__provision(webhook_url, self.http))
+    
+    async def __provision(self, webhook_url: str, http: ChatwootHttpPool):
+        log.debug(f"Updating Chatwoot Bot webhook url to: {webhook_url}")
+        try:
+            bots = await self.provision_bots(webhook_url, http=http)
+        except asyncio.CancelledError as e:
+            self.provisioning.fail(e)
+            raise
+        except Exception as e:
+            # kept in the provisioning state and reported by the health route
+            self.provisioning.fail(e)
+            log.exception(f"Error updating Chatwoot bot: {e}")
+            return
+        self.provisioning.succeed(bots)
+        log.info(f"Chatwoot Bot '{self.bot_name}' ready in {self.provisioning.stats()['duration']}s")
+    
+    async def __provision_standalone(self, webhook_url: str):
+        # The pool session is bound to this temporary loop, 
+        # so it must be closed before the loop ends
+        http = ChatwootHttpPool(ssl=self.ssl, retry_policy=self.http.retry_policy)
+        try:
+            await self.__provision(webhook_url, http)
+        finally:
+            await http.close()
         
     
     def shutdown(self, context: MessageGatewayContext):
         log.debug("Shutting down Chatwoot connector")
         # TODO: remove chatwoot webhook url
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.aclose())
+            return
+        # the shutdown hook registered by startup() awaits it
+        if self._closing is None:
+            self._closing = loop.create_task(self.__close())
+    
+    async def aclose(self):
+        """ Stops the connector: flushes the debounced bursts, drains the webhook queue,
+        sends the outgoing messages and closes the pool. Runs once, startup() 
+        registers it as a shutdown handler of the app so the app awaits it """
+        if self._closing is None:
+            self._closing = asyncio.get_running_loop().create_task(self.__close())
+        await self._closing
+    
+    async def __drain(self):
+        if self.debouncer:
+            # the pending bursts are dispatched once the turns they wait for are answered
+            await self.debouncer.close()
+        await self.webhook_queue.join()
+
+    async def __close(self):
+        try:
+            if self._provisioning_task is not None and not self._provisioning_task.done():
+                self._provisioning_task.cancel()
+            if self.profiler.active:
+                await asyncio.to_thread(self.profiler.stop)
+            for timer in self._lease_timers.values():
+                timer.cancel()
+            try:
+                # the queued webhooks were acknowledged, they are answered before stopping
+                await asyncio.wait_for(self.__drain(), self.shutdown_timeout)
+            except asyncio.TimeoutError:
+                log.warning(f"{self.webhook_queue.depth()} queued webhooks not processed "
+                            f"in {self.shutdown_timeout}s, stopping anyway")
+            await self.webhook_queue.close()
+            await self.outbound.flush()
+        finally:
+            await self.outbound.close()
+            await self.http.close()
+            self.tracer.close()
+            if self.recorder:
+                self.recorder.close()
         
         
     def pause(self):
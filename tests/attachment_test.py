@@ -0,0 +1,136 @@
+import asyncio
+import os
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from celai_chatwoot.connector.http_pool import ChatwootHttpPool
+from celai_chatwoot.connector.model.woot_attachment import AttachmentTooLargeError, WootAttachment
+from cel.gateway.model.attachment import MessageAttachmentType
+
+
+CONTENT = os.urandom(300 * 1024)
+
+
+@pytest_asyncio.fixture
+async def storage_server():
+    """ ActiveStorage like server: the blob url redirects to the storage service """
+    downloads = []
+
+    async def blob(request: web.Request):
+        raise web.HTTPFound(f"/storage/{request.match_info['name']}")
+
+    async def storage(request: web.Request):
+        downloads.append(request.match_info["name"])
+        return web.Response(body=CONTENT, content_type="image/jpeg")
+
+    app = web.Application()
+    app.router.add_get("/rails/active_storage/blobs/redirect/{name}", blob)
+    app.router.add_get("/storage/{name}", storage)
+    server = TestServer(app)
+    await server.start_server()
+    server.downloads = downloads
+    yield server
+    await server.close()
+
+
+def attachment_for(server: TestServer, **kwargs) -> WootAttachment:
+    return WootAttachment(title="Image",
+                          file_url=str(server.make_url("/rails/active_storage/blobs/redirect/photo.jpg")),
+                          type=MessageAttachmentType.IMAGE,
+                          **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_consumers_share_one_download(storage_server):
+    pool = ChatwootHttpPool()
+    pool.open()
+    attach = attachment_for(storage_server, http=pool, spool_bytes=64 * 1024)
+
+    async def consume():
+        return b"".join([chunk async for chunk in attach.read_chunks(chunk_size=10_000)])
+
+    results = await asyncio.gather(*(consume() for _ in range(3)))
+    assert all(r == CONTENT for r in results)
+    assert storage_server.downloads == ["photo.jpg"]
+    assert attach.size == len(CONTENT)
+
+    f = await attach.open()
+    assert f.read() == CONTENT
+    attach.close()
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_save_to(storage_server, tmp_path):
+    attach = attachment_for(storage_server)
+    path = await attach.save_to(str(tmp_path / "photo.jpg"))
+    with open(path, "rb") as f:
+        assert f.read() == CONTENT
+    attach.close()
+
+
+@pytest.mark.asyncio
+async def test_download_is_capped(storage_server):
+    attach = attachment_for(storage_server, max_bytes=100 * 1024)
+    with pytest.raises(AttachmentTooLargeError):
+        await attach.open()
+    assert attach.size is None
+
+
+class PrefetchConnector:
+    """ The connector attributes read by WootAttachment.load_from_message """
+    def __init__(self, http: ChatwootHttpPool):
+        self.http = http
+        self.attachment_prefetch = True
+        self.attachment_concurrency = 4
+
+
+@pytest_asyncio.fixture
+async def slow_storage():
+    async def storage(request: web.Request):
+        await asyncio.sleep(0.2)
+        if request.headers.get("Range") == "bytes=0-0":
+            return web.Response(body=CONTENT[:1], status=206, content_type="image/png",
+                                headers={"Content-Range": f"bytes 0-0/{len(CONTENT)}"})
+        return web.Response(body=CONTENT, content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/storage/{name}", storage)
+    server = TestServer(app)
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_attachments_are_loaded_concurrently(slow_storage):
+    message = {"attachments": [{"id": i, "file_type": "image", "thumb_url": "",
+                                "data_url": str(slow_storage.make_url(f"/storage/photo{i}.jpg"))} for i in range(4)]}
+    pool = ChatwootHttpPool()
+    pool.open()
+
+    started = asyncio.get_running_loop().time()
+    attachments = await WootAttachment.load_from_message(message, connector=PrefetchConnector(pool))
+    elapsed = asyncio.get_running_loop().time() - started
+    await pool.close()
+
+    # about the slowest attachment, not the sum of them
+    assert elapsed < 0.6
+    assert [a.title for a in attachments] == ["Image"] * 4
+    assert all(a.content_length == len(CONTENT) and a.mimeType == "image/png" for a in attachments)
+    assert attachments[0].final_url.endswith("/storage/photo0.jpg")
+
+
+@pytest.mark.asyncio
+async def test_unknown_attachment_types_degrade_to_files():
+    message = {"attachments": [
+        {"id": 1, "file_type": "video", "data_url": "https://chatwoot.local/blob/clip.mp4", "thumb_url": ""},
+        {"id": 2, "file_type": "ig_reel", "data_url": "https://chatwoot.local/blob/reel.mp4"},
+        {"id": 3, "file_type": "fallback", "data_url": None},
+        {"id": 4, "file_type": "image"},
+    ]}
+    attachments = await WootAttachment.load_from_message(message)
+
+    assert [(a.type, a.title) for a in attachments] == [(MessageAttachmentType.VIDEO, "clip.mp4"),
+                                                        (MessageAttachmentType.DOCUMENT, "reel.mp4")]
@@ -0,0 +1,45 @@
+import argparse
+import aiohttp
+import pytest
+from benchmarks.e2e import DEFAULT_FIXTURES, percentile, run
+from benchmarks.fake_chatwoot import FakeChatwoot
+
+
+def args(**kwargs) -> argparse.Namespace:
+    defaults = dict(webhooks=20, concurrency=5, workers=4, outbound_concurrency=4,
+                    latency=0.0, jitter=0.0, rate_limit_rate=0.0, error_rate=0.0,
+                    seed=0, fixtures=DEFAULT_FIXTURES)
+    return argparse.Namespace(**{**defaults, **kwargs})
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert (percentile(values, 50), percentile(values, 99), percentile(values, 100)) == (50, 99, 100)
+    assert percentile([], 50) is None
+
+
+@pytest.mark.asyncio
+async def test_fake_chatwoot_injects_faults():
+    async with FakeChatwoot(rate_limit_rate=0.5, error_rate=0.5, retry_after=2) as fake:
+        url = f"{fake.url}/api/v1/accounts/8/conversations/1/messages"
+        async with aiohttp.ClientSession() as session:
+            statuses = []
+            for _ in range(10):
+                async with session.post(url, json={"content": "hi"}) as res:
+                    statuses.append(res.status)
+                    if res.status == 429:
+                        assert res.headers["Retry-After"] == "2"
+    assert set(statuses) == {429, 502}
+    assert fake.messages == []
+    assert fake.stats.rate_limited + fake.stats.errors == 10
+
+
+@pytest.mark.asyncio
+async def test_e2e_answers_every_webhook():
+    results = await run(args(rate_limit_rate=0.2, error_rate=0.2))
+    assert results["answered"] == 20
+    assert results["statuses"] == {"200": 20}
+    assert results["chatwoot"]["messages"] == 20
+    assert results["chatwoot"]["rate_limited"] + results["chatwoot"]["errors"] > 0
+    assert 0 < results["latency"]["p50"] <= results["latency"]["p99"]
+    assert results["chatwoot"]["sockets_opened"] <= 4
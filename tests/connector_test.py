@@ -0,0 +1,387 @@
+import asyncio
+import json
+import httpx
+import pytest
+from fastapi import FastAPI
+from celai_chatwoot.connector import woo_connector
+from celai_chatwoot.connector.woo_connector import WootConnector
+from celai_chatwoot.connector.routing import InboxRoute
+from celai_chatwoot.connector.model.woot_lead import WootLead
+from celai_chatwoot.connector.model.woot_message import WootMessage
+
+
+class StubGateway:
+    """ Records the messages instead of calling an assistant """
+    def __init__(self, block: asyncio.Event = None):
+        self.messages = []
+        self.block = block
+
+    async def process_message(self, message, mode=None):
+        self.messages.append(message)
+        if self.block:
+            await self.block.wait()
+        yield message.text
+
+
+def load(name: str) -> dict:
+    with open(f'./tests/data/{name}') as f:
+        return json.load(f)
+
+
+def build_connector(**kwargs) -> WootConnector:
+    return WootConnector(bot_name="Test Bot",
+                         account_id="8",
+                         access_key="key",
+                         chatwoot_url="http://chatwoot.local",
+                         inbox_id="211",
+                         **kwargs)
+
+
+def client_for(conn: WootConnector) -> httpx.AsyncClient:
+    app = FastAPI()
+    app.include_router(conn.get_router())
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.mark.asyncio
+async def test_webhook_is_queued_and_processed():
+    conn = build_connector()
+    conn.gateway = StubGateway()
+
+    async with client_for(conn) as client:
+        res = await client.post(f"/chatwoot/webhook/{conn.security_token}", json=load("incoming_text_msg_from_web.json"))
+    assert res.status_code == 200
+
+    await conn.webhook_queue.join()
+    assert len(conn.gateway.messages) == 1
+    assert isinstance(conn.gateway.messages[0], WootMessage)
+    assert conn.gateway.messages[0].text == "asd"
+    assert conn.webhook_stats()["processed"] == 1
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_answers_503():
+    block = asyncio.Event()
+    conn = build_connector(webhook_queue_size=1, webhook_workers=1)
+    conn.gateway = StubGateway(block=block)
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    payload = load("incoming_text_msg_from_web.json")
+
+    async with client_for(conn) as client:
+        # the first webhook keeps the only worker busy, the second one waits in the queue
+        assert (await client.post(url, json=payload)).status_code == 200
+        await asyncio.sleep(0.01)
+        assert (await client.post(url, json=payload)).status_code == 200
+        res = await client.post(url, json=payload)
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
+
+    block.set()
+    await conn.webhook_queue.join()
+    stats = conn.webhook_stats()
+    assert (stats["accepted"], stats["rejected"], stats["processed"]) == (2, 1, 2)
+    assert stats["wait_max"] > 0
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_redelivered_webhook_is_dropped():
+    conn = build_connector()
+    conn.gateway = StubGateway()
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    payload = load("incoming_text_msg_from_web.json")
+
+    async with client_for(conn) as client:
+        for _ in range(3):
+            assert (await client.post(url, json=payload)).status_code == 200
+    await conn.webhook_queue.join()
+
+    assert len(conn.gateway.messages) == 1
+    assert conn.dedup_stats()["duplicates"] == 2
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_debounced_burst_reaches_gateway_once():
+    conn = build_connector(debounce_window=0.05)
+    conn.gateway = StubGateway()
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    payload = load("incoming_text_msg_from_web.json")
+
+    async with client_for(conn) as client:
+        for i, text in enumerate(("hello", "are you there?")):
+            payload["conversation"]["messages"][0]["id"] = 1000 + i
+            payload["conversation"]["messages"][0]["content"] = text
+            assert (await client.post(url, json=payload)).status_code == 200
+    await conn.webhook_queue.join()
+    await asyncio.sleep(0.1)
+    await conn.webhook_queue.join()
+
+    assert [m.text for m in conn.gateway.messages] == ["hello\nare you there?"]
+    assert conn.debounce_stats()["dispatched"] == 1
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_debounced_turns_of_a_conversation_are_answered_in_turn():
+    conn = build_connector(debounce_window=0.02, debounce_max_wait=0.02)
+    block = asyncio.Event()
+    conn.gateway = StubGateway(block)
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    payload = load("incoming_text_msg_from_web.json")
+
+    async with client_for(conn) as client:
+        for i, text in enumerate(("hello", "are you there?", "hello?")):
+            payload["conversation"]["messages"][0]["id"] = 1000 + i
+            payload["conversation"]["messages"][0]["content"] = text
+            assert (await client.post(url, json=payload)).status_code == 200
+            await asyncio.sleep(0.05)
+    # the first turn is still running, the next burst waits for it
+    assert [m.text for m in conn.gateway.messages] == ["hello"]
+    assert conn.debounce_stats()["pending_messages"] == 2
+
+    block.set()
+    await conn.aclose()
+    assert [m.text for m in conn.gateway.messages] == ["hello", "are you there?\nhello?"]
+
+
+@pytest.mark.asyncio
+async def test_shutdown_answers_pending_burst():
+    conn = build_connector(debounce_window=10)
+    conn.gateway = StubGateway()
+
+    async with client_for(conn) as client:
+        res = await client.post(f"/chatwoot/webhook/{conn.security_token}", json=load("incoming_text_msg_from_web.json"))
+    assert res.status_code == 200
+    await conn.webhook_queue.join()
+    assert conn.debounce_stats()["pending_messages"] == 1
+
+    await conn.aclose()
+    assert [m.text for m in conn.gateway.messages] == ["asd"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("raw_webhook", [True, False])
+async def test_outgoing_echo_is_not_queued(raw_webhook):
+    conn = build_connector(raw_webhook=raw_webhook)
+    conn.gateway = StubGateway()
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    payload = load("incoming_text_msg_from_web.json")
+
+    async with client_for(conn) as client:
+        res = await client.post(url, json={**payload, "message_type": "outgoing"})
+        assert res.json() == {"status": "ignored"}
+        assert (await client.post(url, json=payload)).json() == {"status": "ok"}
+    await conn.webhook_queue.join()
+
+    assert len(conn.gateway.messages) == 1
+    assert conn.webhook_stats()["accepted"] == 1
+    assert conn.webhook_filter_stats()["rejected_by_reason"] == {"outgoing": 1}
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("decoder", ["default", "json"])
+async def test_invalid_body_answers_400(decoder, monkeypatch):
+    if decoder == "json":
+        # the fallback without orjson
+        monkeypatch.setattr(woo_connector, "loads", json.loads)
+    conn = build_connector()
+    async with client_for(conn) as client:
+        res = await client.post(f"/chatwoot/webhook/{conn.security_token}", content=b"{not json")
+        assert res.status_code == 400
+        res = await client.post(f"/chatwoot/webhook/{conn.security_token}", content=b'{"content": "\xff\xfe"}')
+    assert res.status_code == 400
+
+
+def conversation_event(conversation_id: int, message_id: int, text: str) -> dict:
+    payload = load("incoming_text_msg_from_web.json")
+    payload["conversation"]["id"] = conversation_id
+    payload["conversation"]["messages"][0]["id"] = message_id
+    payload["conversation"]["messages"][0]["content"] = text
+    return payload
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("ndjson", [False, True])
+async def test_batch_route_keeps_conversation_order(ndjson):
+    conn = build_connector(webhook_workers=4)
+    conn.gateway = StubGateway()
+    events = [conversation_event(1 + i % 3, 100 + i, f"{1 + i % 3}:{i}") for i in range(30)]
+    events.append({**events[0], "message_type": "outgoing"})
+
+    async with client_for(conn) as client:
+        url = f"/chatwoot/webhook/{conn.security_token}/batch"
+        if ndjson:
+            body = "\n".join(json.dumps(e) for e in events) + "\n{broken\n"
+            res = await client.post(url, content=body, headers={"Content-Type": "application/x-ndjson"})
+        else:
+            res = await client.post(url, json=events)
+    await conn.webhook_queue.join()
+
+    summary = res.json()
+    assert summary["accepted"] == 30
+    assert summary["results"][30] == "ignored"
+    if ndjson:
+        assert summary["results"][31] == "invalid"
+    # one queue item per conversation
+    assert conn.webhook_stats()["accepted"] == 3
+    for conversation_id in (1, 2, 3):
+        texts = [m.text for m in conn.gateway.messages if m.lead.conversation_id == str(conversation_id)]
+        assert texts == [f"{conversation_id}:{i}" for i in range(30) if 1 + i % 3 == conversation_id]
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_batch_route_reports_busy_conversations():
+    block = asyncio.Event()
+    conn = build_connector(webhook_queue_size=1, webhook_workers=1)
+    conn.gateway = StubGateway(block=block)
+    events = [conversation_event(c, 200 + c, "hi") for c in (1, 2, 3)]
+
+    async with client_for(conn) as client:
+        res = await client.post(f"/chatwoot/webhook/{conn.security_token}/batch", json=events)
+        # every conversation is offered before the worker takes the first one
+        assert res.json()["results"] == ["ok", "busy", "busy"]
+        assert res.json()["rejected"] == 2
+        invalid = await client.post(f"/chatwoot/webhook/{conn.security_token}/batch", json={"event": "x"})
+        assert invalid.status_code == 400
+    block.set()
+    await conn.webhook_queue.join()
+    await conn.webhook_queue.close()
+
+
+def status_changed(status: str, conversation_id: int = 33) -> dict:
+    return {"event": "conversation_status_changed", "id": conversation_id, "inbox_id": 211, "status": status,
+            "messages": [{"id": 1, "account_id": 8}]}
+
+
+@pytest.mark.asyncio
+async def test_resolved_conversation_drops_queued_work():
+    conn = build_connector(debounce_window=10)
+    conn.gateway = StubGateway()
+    block = asyncio.Event()
+    sent = []
+
+    async def send(i):
+        await block.wait()
+        sent.append(i)
+
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    futures = [conn.outbound.submit("8:33", lambda i=i: send(i)) for i in range(3)]
+    async with client_for(conn) as client:
+        assert (await client.post(url, json=load("incoming_text_msg_from_web.json"))).status_code == 200
+        await conn.webhook_queue.join()
+        assert conn.debounce_stats()["pending_messages"] == 1
+
+        res = await client.post(url, json=status_changed("resolved"))
+        assert res.json() == {"status": "ok"}
+    await conn.webhook_queue.join()
+
+    block.set()
+    await conn.flush()
+    # the answer being sent is not interrupted
+    assert sent == [0]
+    assert [f.cancelled() for f in futures] == [False, True, True]
+    assert conn.debounce_stats()["pending_messages"] == 0
+    assert conn.event_stats()["dispatched"] == {"message_created": 1, "conversation_status_changed": 1}
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_conversation_resolved_event_drops_queued_answers():
+    conn = build_connector()
+    block = asyncio.Event()
+
+    async def send():
+        await block.wait()
+
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    futures = [conn.outbound.submit("8:33", send) for _ in range(2)]
+    async with client_for(conn) as client:
+        res = await client.post(url, json=load("conversation_resolved.json"))
+        assert res.json() == {"status": "ok"}
+    await conn.webhook_queue.join()
+
+    block.set()
+    await conn.flush()
+    assert [f.cancelled() for f in futures] == [False, True]
+    assert conn.event_stats()["dispatched"] == {"conversation_resolved": 1}
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_custom_event_handler():
+    conn = build_connector()
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    updated = []
+
+    async with client_for(conn) as client:
+        # events without handlers are discarded by the route
+        res = await client.post(url, json={"event": "conversation_updated", "id": 33, "inbox_id": 211})
+        assert res.json() == {"status": "ignored"}
+
+        @conn.on_event("conversation_updated")
+        async def on_updated(payload):
+            updated.append(payload["id"])
+
+        res = await client.post(url, json={"event": "conversation_updated", "id": 33, "inbox_id": 211})
+        assert res.json() == {"status": "ok"}
+        res = await client.post(url, json={"event": "conversation_updated", "id": 34, "inbox_id": 216})
+        assert res.json() == {"status": "ignored"}
+    await conn.webhook_queue.join()
+
+    assert updated == [33]
+    assert conn.webhook_filter_stats()["rejected_by_reason"] == {"event": 1, "inbox": 1}
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_webhooks_are_routed_by_inbox():
+    conn = build_connector(routes=[InboxRoute(account_id=9, inbox_id=300, access_key="key9")])
+    conn.gateway = StubGateway()
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    payload = load("incoming_text_msg_from_web.json")
+    other_account = {**payload, "account": {"id": 9}, "inbox": {"id": 300}}
+    other_account["conversation"] = {**payload["conversation"], "messages": [{**payload["conversation"]["messages"][0], "id": 2}]}
+
+    async with client_for(conn) as client:
+        assert (await client.post(url, json=payload)).json() == {"status": "ok"}
+        assert (await client.post(url, json=other_account)).json() == {"status": "ok"}
+        # inbox 300 belongs to account 9
+        assert (await client.post(url, json={**other_account, "account": {"id": 8}})).json() == {"status": "ignored"}
+        assert (await client.post(url, json={**payload, "inbox": {"id": 216}})).json() == {"status": "ignored"}
+    await conn.webhook_queue.join()
+
+    leads = [m.lead for m in conn.gateway.messages]
+    assert [(l.account_id, l.inbox_id) for l in leads] == [("8", "211"), ("9", "300")]
+    assert conn.get_messages_client(leads[0]).access_key == "key"
+    assert conn.get_messages_client(leads[1]).access_key == "key9"
+    # every inbox shares the connector pool
+    assert conn.get_messages_client(leads[1]).http is conn.http
+    # no fallback to the primary access key
+    with pytest.raises(ValueError):
+        conn.get_messages_client(WootLead(account_id="10", inbox_id="400", conversation_id="1"))
+    assert conn.webhook_filter_stats()["rejected_by_reason"] == {"account": 1, "inbox": 1}
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_health_routes_are_scoped_by_connector():
+    first, second = build_connector(), build_connector()
+    second.pause()
+    app = FastAPI()
+    app.include_router(first.get_router())
+    app.include_router(second.get_router())
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        assert (await client.get(f"/chatwoot/health/{first.security_token}")).json()["paused"] is False
+        assert (await client.get(f"/chatwoot/health/{second.security_token}")).json()["paused"] is True
+        assert (await client.get("/chatwoot/health")).status_code == 404
+
+
+def test_default_stream_mode_is_sentence():
+    from cel.gateway.message_gateway import StreamMode
+    assert build_connector().stream_mode == StreamMode.SENTENCE
+    assert build_connector(stream_mode=StreamMode.FULL).stream_mode == StreamMode.FULL
@@ -0,0 +1,123 @@
+import asyncio
+import pytest
+from celai_chatwoot.connector.debounce import MessageDebouncer, merge_messages
+from celai_chatwoot.connector.model.woot_lead import WootLead
+from celai_chatwoot.connector.model.woot_message import WootMessage
+
+
+def message(text: str, conversation_id: str = "1", date: int = 0) -> WootMessage:
+    lead = WootLead(account_id="8", inbox_id="211", conversation_id=conversation_id)
+    return WootMessage(lead=lead, text=text, date=date, metadata={})
+
+
+def test_merge_messages():
+    merged = merge_messages([message("hi", date=1), message("I need help", date=2), message("with my order", date=3)])
+    assert merged.text == "hi\nI need help\nwith my order"
+    assert merged.date == 3
+    assert merged.metadata["merged_messages"] == 3
+
+    single = message("alone")
+    assert merge_messages([single]) is single
+
+
+@pytest.mark.asyncio
+async def test_burst_is_dispatched_once():
+    dispatched = []
+
+    async def handler(msg):
+        dispatched.append(msg)
+
+    debouncer = MessageDebouncer(handler, window=0.05, max_wait=1)
+    for text in ("a", "b", "c"):
+        debouncer.push(message(text))
+        await asyncio.sleep(0.01)
+    debouncer.push(message("other", conversation_id="2"))
+
+    await asyncio.sleep(0.15)
+    assert sorted(m.text for m in dispatched) == ["a\nb\nc", "other"]
+    stats = debouncer.stats()
+    assert (stats["received"], stats["dispatched"], stats["pending_messages"]) == (4, 2, 0)
+
+
+@pytest.mark.asyncio
+async def test_max_wait_bounds_latency():
+    dispatched = []
+
+    async def handler(msg):
+        dispatched.append(msg)
+
+    debouncer = MessageDebouncer(handler, window=0.05, max_wait=0.1)
+    # messages keep arriving inside the window, max_wait closes the burst anyway
+    for i in range(10):
+        debouncer.push(message(str(i)))
+        await asyncio.sleep(0.03)
+    await debouncer.flush()
+
+    assert len(dispatched) >= 2
+    assert "\n".join(m.text for m in dispatched) == "\n".join(str(i) for i in range(10))
+
+
+@pytest.mark.asyncio
+async def test_cancel_drops_pending_burst():
+    dispatched = []
+
+    async def handler(msg):
+        dispatched.append(msg)
+
+    debouncer = MessageDebouncer(handler, window=0.05)
+    debouncer.push(message("a"))
+    debouncer.push(message("b"))
+    assert debouncer.cancel(message("x").lead.get_session_id()) == 2
+    await asyncio.sleep(0.1)
+    assert dispatched == []
+    await debouncer.close()
+
+
+@pytest.mark.asyncio
+async def test_close_dispatches_pending_bursts():
+    dispatched = []
+
+    async def handler(msg):
+        await asyncio.sleep(0.01)
+        dispatched.append(msg.text)
+
+    debouncer = MessageDebouncer(handler, window=10, max_wait=10)
+    debouncer.push(message("a"))
+    debouncer.push(message("b"))
+    debouncer.push(message("other", conversation_id="2"))
+    await debouncer.close()
+    assert sorted(dispatched) == ["a\nb", "other"]
+    assert debouncer.stats()["pending_messages"] == 0
+
+
+@pytest.mark.asyncio
+async def test_turns_of_a_conversation_do_not_overlap():
+    running, overlapped, dispatched = set(), [], []
+    release = asyncio.Event()
+
+    async def handler(msg):
+        key = msg.lead.get_session_id()
+        overlapped.append(key in running)
+        running.add(key)
+        await release.wait()
+        dispatched.append(msg.text)
+        running.discard(key)
+
+    debouncer = MessageDebouncer(handler, window=0.02, max_wait=0.02)
+    debouncer.push(message("a"))
+    await asyncio.sleep(0.05)
+    # closed while "a" is being answered, the burst waits and keeps collecting
+    debouncer.push(message("b"))
+    await asyncio.sleep(0.05)
+    debouncer.push(message("c"))
+    debouncer.push(message("other", conversation_id="2"))
+    await asyncio.sleep(0.05)
+    assert debouncer.stats()["pending_messages"] == 2
+    assert sorted(running) == sorted([message("a").lead.get_session_id(), message("x", conversation_id="2").lead.get_session_id()])
+
+    release.set()
+    await debouncer.close()
+    await asyncio.sleep(0.01)
+    assert sorted(dispatched) == ["a", "b\nc", "other"]
+    assert dispatched.index("a") < dispatched.index("b\nc")
+    assert overlapped == [False, False, False]
@@ -0,0 +1,54 @@
+import json
+import pytest
+from celai_chatwoot.connector.dedup import MemoryDedupBackend, RedisDedupBackend, WebhookDeduplicator
+
+
+class StubRedis:
+    """ Implements the subset of redis.asyncio used by RedisDedupBackend """
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = (value, px)
+        return True
+
+
+@pytest.fixture
+def msg() -> dict:
+    with open('./tests/data/incoming_text_msg_from_web.json') as f:
+        return json.load(f)
+
+
+def test_key_from_payload(msg):
+    message_id = msg["conversation"]["messages"][0]["id"]
+    assert WebhookDeduplicator.key_for(msg) == f"8:{message_id}"
+    assert WebhookDeduplicator.key_for({"event": "conversation_updated"}) is None
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_expires_and_is_bounded():
+    backend = MemoryDedupBackend(max_items=2)
+    assert await backend.check_and_set("a", ttl=60)
+    assert not await backend.check_and_set("a", ttl=60)
+    assert await backend.check_and_set("b", ttl=60)
+    assert await backend.check_and_set("c", ttl=60)
+    # "a" was dropped to keep 2 keys
+    assert backend.stats()["keys"] == 2
+    assert await backend.check_and_set("a", ttl=60)
+
+    assert await backend.check_and_set("d", ttl=0)
+    assert await backend.check_and_set("d", ttl=0)
+
+
+@pytest.mark.asyncio
+async def test_shared_backend_between_replicas(msg):
+    redis = StubRedis()
+    replica1 = WebhookDeduplicator(backend=RedisDedupBackend(redis), ttl=60)
+    replica2 = WebhookDeduplicator(backend=RedisDedupBackend(redis), ttl=60)
+
+    assert not await replica1.is_duplicate(msg)
+    assert await replica2.is_duplicate(msg)
+    assert replica2.stats()["duplicates"] == 1
+    assert list(redis.data.values()) == [(1, 60000)]
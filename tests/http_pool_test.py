@@ -0,0 +1,204 @@
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from celai_chatwoot.connector.http_pool import ChatwootHttpPool, ChatwootApiError, ChatwootRateLimitError
+from celai_chatwoot.connector.retry import RetryPolicy
+from celai_chatwoot.connector.rate_limit import ChatwootRateLimiter, TokenBucket, parse_retry_after
+from celai_chatwoot.connector.msg_utils import ChatwootMessages
+
+
+@pytest_asyncio.fixture
+async def chatwoot_server():
+    received = []
+    peers = set()
+
+    async def create_message(request: web.Request):
+        peers.add(request.transport.get_extra_info("peername"))
+        received.append(await request.json())
+        return web.json_response({"id": len(received)})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/accounts/{account_id}/conversations/{conversation_id}/messages", create_message)
+    server = TestServer(app)
+    await server.start_server()
+    server.received = received
+    server.peers = peers
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connections(chatwoot_server):
+    pool = ChatwootHttpPool(limit=10)
+    client = ChatwootMessages(base_url=str(chatwoot_server.make_url("")).rstrip("/"),
+                              account_id="1",
+                              access_key="key",
+                              http=pool)
+
+    for i in range(5):
+        res = await client.send_text_message(conversation_id="33", content=f"sentence {i}")
+        assert res["id"] == i + 1
+
+    stats = pool.stats()
+    assert stats["open"] is True
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+    assert stats["waiting"] == 0
+    # all the sentences were sent through a single keep-alive connection
+    assert len(chatwoot_server.peers) == 1
+
+    await pool.close()
+    assert pool.closed
+    assert pool.stats()["open"] is False
+
+
+@pytest.mark.asyncio
+async def test_standalone_client_without_pool(chatwoot_server):
+    client = ChatwootMessages(base_url=str(chatwoot_server.make_url("")).rstrip("/"),
+                              account_id="1",
+                              access_key="key")
+    res = await client.send_text_message(conversation_id="33", content="hello")
+    assert res["id"] == 1
+    assert client.http.closed
+
+
+@pytest_asyncio.fixture
+async def limited_server():
+    calls = []
+
+    async def create_message(request: web.Request):
+        calls.append(request.match_info["conversation_id"])
+        if len(calls) <= 2:
+            return web.json_response({"error": "Too many requests"}, status=429, headers={"Retry-After": "0.05"})
+        return web.json_response({"id": len(calls)})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/accounts/{account_id}/conversations/{conversation_id}/messages", create_message)
+    server = TestServer(app)
+    await server.start_server()
+    server.calls = calls
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_request_is_retried(limited_server):
+    limiter = ChatwootRateLimiter(rate=100, inbox_rate=50)
+    pool = ChatwootHttpPool(rate_limiter=limiter, retry_policy=RetryPolicy(base_delay=0.01))
+    client = ChatwootMessages(base_url=str(limited_server.make_url("")).rstrip("/"),
+                              account_id="1",
+                              access_key="key",
+                              inbox_id="2",
+                              http=pool)
+
+    res = await client.send_text_message(conversation_id="33", content="hello")
+    assert res["id"] == 3
+    assert len(limited_server.calls) == 3
+
+    stats = limiter.stats()
+    assert stats["rate_limited"] == 2
+    # the rate was halved twice and starts recovering after the success
+    assert stats["rates"]["account:1"] < 100
+    assert set(pool.throttle()) == {"account:1", "inbox:1:2"}
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_error_after_retries(limited_server):
+    pool = ChatwootHttpPool(retry_policy=RetryPolicy(max_attempts=2, base_delay=0.01))
+    client = ChatwootMessages(base_url=str(limited_server.make_url("")).rstrip("/"),
+                              account_id="1",
+                              access_key="key",
+                              http=pool)
+
+    with pytest.raises(ChatwootRateLimitError) as e:
+        await client.send_text_message(conversation_id="33", content="hello")
+    assert e.value.status == 429
+    await pool.close()
+
+
+def test_token_bucket_pacing():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # third request in the same instant waits for one token
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+
+    bucket.on_rate_limited(retry_after=2)
+    assert bucket.rate == 5
+    assert bucket.throttle == 1.0
+    assert bucket.reserve() == pytest.approx(2, abs=0.05)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert 0 <= parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") < 1
+
+
+@pytest_asyncio.fixture
+async def flaky_server():
+    """ Stores every message but answers 502 to the first post, 
+    like an ingress timing out after Chatwoot processed the request """
+    messages = []
+
+    async def create_message(request: web.Request):
+        data = await request.json()
+        messages.append(data)
+        if len(messages) == 1:
+            return web.Response(status=502, text="Bad Gateway")
+        return web.json_response({"id": len(messages), **data})
+
+    async def list_messages(request: web.Request):
+        return web.json_response({"payload": [{"id": i + 1, **m} for i, m in enumerate(messages)]})
+
+    app = web.Application()
+    url = "/api/v1/accounts/{account_id}/conversations/{conversation_id}/messages"
+    app.router.add_post(url, create_message)
+    app.router.add_get(url, list_messages)
+    server = TestServer(app)
+    await server.start_server()
+    server.messages = messages
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_retry_does_not_post_twice(flaky_server):
+    pool = ChatwootHttpPool(retry_policy=RetryPolicy(base_delay=0.01))
+    client = ChatwootMessages(base_url=str(flaky_server.make_url("")).rstrip("/"),
+                              account_id="1",
+                              access_key="key",
+                              http=pool)
+
+    res = await client.send_text_message(conversation_id="33", content="hello", content_attributes={"foo": 1})
+    assert res["id"] == 1
+    assert len(flaky_server.messages) == 1
+    attrs = flaky_server.messages[0]["content_attributes"]
+    assert attrs["foo"] == 1
+    assert len(attrs["idempotency_key"]) == 32
+
+    # the retry found the message posted by the first attempt instead of posting it again
+    assert pool.retry_stats() == {"messages": {"retries": 1, "recovered": 1}}
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_non_retryable_status_raises(chatwoot_server):
+    pool = ChatwootHttpPool()
+    with pytest.raises(ChatwootApiError) as e:
+        await pool.request("GET", str(chatwoot_server.make_url("/missing")), endpoint="missing")
+    assert e.value.status == 404
+    assert pool.retry_stats() == {"missing": {"failed": 1}}
+    await pool.close()
+
+
+def test_backoff_is_bounded():
+    policy = RetryPolicy(base_delay=1, max_delay=4, jitter=0)
+    assert [policy.backoff(a) for a in range(1, 6)] == [1, 2, 4, 4, 4]
+    assert policy.backoff(1, retry_after=3) == 3
+
+    jittered = RetryPolicy(base_delay=1, max_delay=4, jitter=1)
+    assert all(0 <= jittered.backoff(3) <= 4 for _ in range(100))
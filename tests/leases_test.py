@@ -0,0 +1,200 @@
+import asyncio
+import time
+import pytest
+from celai_chatwoot.connector.leases import (ConversationLeases, LeaseTimeoutError, MemoryLeaseBackend,
+                                             RedisLeaseBackend, SQLiteLeaseBackend)
+from connector_test import StubGateway, build_connector, client_for, load
+
+
+class LocalRedis:
+    """ Stand-in with the redis.asyncio get/set/eval signatures,
+    eval only runs the scripts of RedisLeaseBackend """
+    def __init__(self):
+        self.data = {}
+
+    def __live(self, key):
+        value = self.data.get(key)
+        if value and value[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    async def get(self, key):
+        value = self.__live(key)
+        return value[0].encode() if value else None
+
+    async def set(self, key, value, nx=False, xx=False, px=None):
+        exists = self.__live(key) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        self.data[key] = (value, time.monotonic() + px / 1000)
+        return True
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def eval(self, script, numkeys, key, holder, *args):
+        value = self.__live(key)
+        if value is None or value[0] != holder:
+            return 0
+        if script == RedisLeaseBackend.RELEASE_SCRIPT:
+            del self.data[key]
+        else:
+            assert script == RedisLeaseBackend.EXTEND_SCRIPT
+            self.data[key] = (holder, time.monotonic() + int(args[0]) / 1000)
+        return 1
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryLeaseBackend()
+    if request.param == "sqlite":
+        return SQLiteLeaseBackend(str(tmp_path / "leases.db"))
+    return RedisLeaseBackend(LocalRedis())
+
+
+@pytest.mark.asyncio
+async def test_backend_lease_is_exclusive(backend):
+    assert await backend.acquire("conv", "a", 0.2)
+    assert not await backend.acquire("conv", "b", 0.2)
+    # the holder extends its own lease
+    assert await backend.acquire("conv", "a", 0.2)
+    assert await backend.holder("conv") == "a"
+
+    await backend.release("conv", "b")
+    assert await backend.holder("conv") == "a"
+    await backend.release("conv", "a")
+    assert await backend.holder("conv") is None
+
+    assert await backend.acquire("conv", "a", 0.05)
+    await asyncio.sleep(0.1)
+    # expired leases are taken by other holders
+    assert await backend.acquire("conv", "b", 0.2)
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_not_released_by_its_old_holder(backend):
+    assert await backend.acquire("conv", "a", 0.05)
+    await asyncio.sleep(0.1)
+    assert await backend.acquire("conv", "b", 1)
+    # the old holder can neither extend nor free the lease of the new one
+    assert not await backend.acquire("conv", "a", 1)
+    await backend.release("conv", "a")
+    assert await backend.holder("conv") == "b"
+
+
+@pytest.mark.asyncio
+async def test_waiters_take_the_lease_in_arrival_order():
+    leases = ConversationLeases(MemoryLeaseBackend(), ttl=5)
+    holder = await leases.try_acquire("conv")
+    order = []
+
+    async def wait(i: int):
+        async with leases.hold("conv"):
+            order.append(i)
+            await asyncio.sleep(0.01)
+
+    tasks = []
+    for i, delay in enumerate((0, 0.05, 0.4)):
+        await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(wait(i)))
+    await asyncio.sleep(0.05)
+    await leases.release("conv", holder)
+    await asyncio.gather(*tasks)
+    assert order == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_hold_serializes_work(tmp_path):
+    backend = SQLiteLeaseBackend(str(tmp_path / "leases.db"))
+    replicas = [ConversationLeases(backend, ttl=1, owner=f"replica-{i}") for i in range(2)]
+    running, overlaps = set(), []
+
+    async def work(leases: ConversationLeases, i: int):
+        async with leases.hold("conv"):
+            overlaps.append(bool(running))
+            running.add(i)
+            await asyncio.sleep(0.02)
+            running.discard(i)
+
+    await asyncio.gather(*(work(replicas[i % 2], i) for i in range(6)))
+    assert overlaps == [False] * 6
+    assert sum(r.stats()["contended"] for r in replicas) > 0
+
+    holder = await replicas[0].try_acquire("other")
+    assert ConversationLeases.owner_of(await replicas[1].holder("other")) == "replica-0"
+    with pytest.raises(LeaseTimeoutError):
+        await replicas[1].acquire("other", timeout=0.05)
+    await replicas[0].release("other", holder)
+
+
+@pytest.mark.asyncio
+async def test_busy_conversation_is_forwarded_to_its_owner(tmp_path):
+    backend = SQLiteLeaseBackend(str(tmp_path / "leases.db"))
+    block = asyncio.Event()
+    forwarded = []
+
+    async def forward(owner, message):
+        forwarded.append((owner, message.text))
+        return True
+
+    # both replicas have the same settings, as behind a load balancer
+    owner = build_connector(lease_backend=backend, lease_owner="replica-a", security_token="token")
+    owner.gateway = StubGateway(block=block)
+    other = build_connector(lease_backend=backend, lease_owner="replica-b", security_token="token", lease_forward=forward)
+    other.gateway = StubGateway()
+    payload = load("incoming_text_msg_from_web.json")
+
+    async with client_for(owner) as client:
+        await client.post(f"/chatwoot/webhook/{owner.security_token}", json=payload)
+        await asyncio.sleep(0.05)
+    async with client_for(other) as client:
+        payload["conversation"]["messages"][0]["id"] = 2
+        await client.post(f"/chatwoot/webhook/{other.security_token}", json=payload)
+        await other.webhook_queue.join()
+
+    assert forwarded == [("replica-a", "asd")]
+    assert other.gateway.messages == []
+    assert other.lease_stats()["forwarded"] == 1
+    block.set()
+    await owner.webhook_queue.join()
+    assert owner.lease_stats()["held"] == 0
+    await owner.webhook_queue.close()
+    await other.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_waiting_messages_keep_their_order_without_blocking_workers(tmp_path):
+    backend = SQLiteLeaseBackend(str(tmp_path / "leases.db"))
+    block = asyncio.Event()
+    owner = build_connector(lease_backend=backend, lease_owner="replica-a", security_token="token")
+    owner.gateway = StubGateway(block=block)
+    other = build_connector(lease_backend=backend, lease_owner="replica-b", security_token="token", webhook_workers=1)
+    other.gateway = StubGateway()
+    payload = load("incoming_text_msg_from_web.json")
+
+    async with client_for(owner) as client:
+        await client.post(f"/chatwoot/webhook/{owner.security_token}", json=payload)
+        await asyncio.sleep(0.05)
+    async with client_for(other) as client:
+        for i, delay in enumerate((0, 0.05, 0.45)):
+            await asyncio.sleep(delay)
+            payload["conversation"]["messages"][0]["id"] = i + 2
+            payload["conversation"]["messages"][0]["content"] = f"m{i}"
+            await client.post(f"/chatwoot/webhook/{other.security_token}", json=payload)
+    await asyncio.sleep(0.05)
+    # the messages wait for the lease in their FIFO, not in a worker
+    assert other.webhook_stats()["busy"] == 0
+    assert other.lease_stats()["waiting"] == 3
+    assert other.gateway.messages == []
+
+    block.set()
+    for _ in range(100):
+        if len(other.gateway.messages) == 3:
+            break
+        await asyncio.sleep(0.02)
+    assert [m.text for m in other.gateway.messages] == ["m0", "m1", "m2"]
+    assert other.lease_stats()["waiting"] == 0
+    await owner.webhook_queue.close()
+    await other.webhook_queue.close()
@@ -0,0 +1,266 @@
+import asyncio
+import base64
+import io
+import tracemalloc
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from celai_chatwoot.connector.http_pool import ChatwootHttpPool
+from celai_chatwoot.connector.media import resolve_media, sniff_mime
+from celai_chatwoot.connector.media_cache import CachedMedia, MediaCache
+from celai_chatwoot.connector.msg_utils import ChatwootAttachment, ChatwootMessages
+
+
+SAMPLE_OGG = "./tests/data/sample.ogg"
+
+
+@pytest_asyncio.fixture
+async def chatwoot_server():
+    """ Receives multipart attachments and streams them to a counter,
+    like Chatwoot storing the upload """
+    uploads = []
+    media_requests = []
+
+    async def create_message(request: web.Request):
+        reader = await request.multipart()
+        fields = {}
+        async for part in reader:
+            if part.name == "attachments[]":
+                size, head = 0, b""
+                while chunk := await part.read_chunk():
+                    if not head:
+                        head = chunk[:16]
+                    size += len(chunk)
+                fields["attachment"] = {"filename": part.filename,
+                                        "content_type": part.headers["Content-Type"],
+                                        "size": size,
+                                        "head": head}
+            else:
+                fields[part.name] = await part.text()
+        uploads.append(fields)
+        return web.json_response({"id": len(uploads)})
+
+    async def media(request: web.Request):
+        media_requests.append(request.headers.get("If-None-Match"))
+        return web.FileResponse(SAMPLE_OGG)
+
+    app = web.Application()
+    app.router.add_post("/api/v1/accounts/{account_id}/conversations/{conversation_id}/messages", create_message)
+    app.router.add_get("/media/voice", media)
+    server = TestServer(app)
+    await server.start_server()
+    server.uploads = uploads
+    server.media_requests = media_requests
+    yield server
+    await server.close()
+
+
+@pytest.fixture
+def ogg() -> bytes:
+    with open(SAMPLE_OGG, "rb") as f:
+        return f.read()
+
+
+def test_sniff_mime(ogg):
+    assert sniff_mime(ogg[:261]) == "audio/ogg"
+    assert sniff_mime(b"", "file.pdf") == "application/pdf"
+    assert sniff_mime(b"plain text") == "application/octet-stream"
+
+
+@pytest.mark.asyncio
+async def test_resolve_sources(chatwoot_server, ogg):
+    http = ChatwootHttpPool()
+    url = str(chatwoot_server.make_url("/media/voice"))
+    sources = [
+        SAMPLE_OGG,
+        ogg,
+        memoryview(ogg),
+        io.BytesIO(ogg),
+        base64.b64encode(ogg).decode(),
+        "data:audio/ogg;base64," + base64.b64encode(ogg).decode(),
+        url,
+    ]
+    for content in sources:
+        media = await resolve_media(content, http=http, type="audio")
+        assert media.mime == "audio/ogg", content
+        payload = media.payload()
+        assert payload.content_type == "audio/ogg"
+    await http.close()
+
+
+@pytest.mark.asyncio
+async def test_send_attachment_streams_content(chatwoot_server, ogg):
+    http = ChatwootHttpPool()
+    client = ChatwootMessages(base_url=str(chatwoot_server.make_url("")).rstrip("/"),
+                              account_id="1",
+                              access_key="key",
+                              http=http)
+
+    await client.send_attachment("33", ChatwootAttachment(type="audio", content=SAMPLE_OGG), text="voice")
+    await client.send_attachment("33", ChatwootAttachment(type="audio", content=io.BytesIO(ogg), fileName="note.ogg"))
+    await client.send_attachment("33", ChatwootAttachment(type="audio", content=str(chatwoot_server.make_url("/media/voice"))))
+
+    uploads = chatwoot_server.uploads
+    assert len(uploads) == 3
+    assert uploads[0]["content"] == "voice"
+    assert [u["attachment"]["filename"] for u in uploads] == ["sample.ogg", "note.ogg", "voice"]
+    for upload in uploads:
+        assert upload["attachment"]["content_type"] == "audio/ogg"
+        assert upload["attachment"]["size"] == len(ogg)
+        assert upload["attachment"]["head"] == ogg[:16]
+    await http.close()
+
+
+class Stream(io.RawIOBase):
+    """ File object that can only be read once, like a pipe or a socket """
+
+    def __init__(self, data: bytes):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.data.readinto(buffer)
+
+
+class Writer:
+    def __init__(self):
+        self.data = bytearray()
+
+    async def write(self, chunk: bytes):
+        self.data += chunk
+
+
+@pytest.mark.asyncio
+async def test_non_seekable_file_is_spooled_for_retries(ogg):
+    for mime in ("audio/ogg", None):
+        media = await resolve_media(Stream(ogg), http=None, type="audio", mime=mime)
+        assert media.mime == "audio/ogg"
+        # every attempt of the upload sends the whole content
+        for _ in range(2):
+            writer = Writer()
+            await media.payload().write(writer)
+            assert bytes(writer.data) == ogg
+
+
+@pytest.mark.asyncio
+async def test_large_file_upload_memory(chatwoot_server, tmp_path):
+    path = tmp_path / "large.pdf"
+    size = 20 * 1024 * 1024
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n" + b"\0" * (size - 9))
+
+    http = ChatwootHttpPool()
+    client = ChatwootMessages(base_url=str(chatwoot_server.make_url("")).rstrip("/"),
+                              account_id="1",
+                              access_key="key",
+                              http=http)
+    tracemalloc.start()
+    await client.send_attachment("33", ChatwootAttachment(type="file", content=str(path)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    upload = chatwoot_server.uploads[-1]["attachment"]
+    assert upload["size"] == size
+    assert upload["content_type"] == "application/pdf"
+    # the test server and the client share the process, both stream by chunks
+    assert peak < 4 * 1024 * 1024
+    await http.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_url_media(chatwoot_server, ogg):
+    http = ChatwootHttpPool()
+    cache = MediaCache(ttl=60)
+    url = str(chatwoot_server.make_url("/media/voice"))
+
+    for _ in range(3):
+        media = await resolve_media(url, http=http, type="audio", cache=cache)
+        assert media.mime == "audio/ogg"
+        assert media.size == len(ogg)
+    # one origin fetch for three sends
+    assert chatwoot_server.media_requests == [None]
+
+    # once stale the entry is revalidated with its ETag, the origin answers 304
+    entry = await cache.get(MediaCache.url_key(url))
+    entry.fresh_until = 0
+    media = await resolve_media(url, http=http, type="audio", cache=cache)
+    assert media.mime == "audio/ogg"
+    assert chatwoot_server.media_requests[-1] == entry.etag
+    assert entry.is_fresh()
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["revalidated"]) == (3, 1, 1)
+    await http.close()
+
+
+@pytest.mark.asyncio
+async def test_url_upload_with_a_single_connection(chatwoot_server, ogg):
+    # the download from the origin does not take the only connection of the pool
+    http = ChatwootHttpPool(limit=1)
+    client = ChatwootMessages(base_url=str(chatwoot_server.make_url("")).rstrip("/"),
+                              account_id="1",
+                              access_key="key",
+                              http=http)
+    url = str(chatwoot_server.make_url("/media/voice"))
+    await asyncio.wait_for(client.send_attachment("33", ChatwootAttachment(type="audio", content=url)), 5)
+    assert chatwoot_server.uploads[-1]["attachment"]["size"] == len(ogg)
+    await http.close()
+
+
+@pytest.mark.asyncio
+async def test_uncacheable_url_is_fetched_twice(chatwoot_server, ogg):
+    http = ChatwootHttpPool()
+    client = ChatwootMessages(base_url=str(chatwoot_server.make_url("")).rstrip("/"),
+                              account_id="1",
+                              access_key="key",
+                              http=http,
+                              media_cache=MediaCache(max_entry_bytes=1024))
+    url = str(chatwoot_server.make_url("/media/voice"))
+    await client.send_attachment("33", ChatwootAttachment(type="audio", content=url))
+
+    upload = chatwoot_server.uploads[-1]["attachment"]
+    assert (upload["content_type"], upload["size"]) == ("audio/ogg", len(ogg))
+    # the first response gives the mime type and the size, then the upload streams the url
+    assert len(chatwoot_server.media_requests) == 2
+    await http.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_file_media(tmp_path, ogg):
+    copy = tmp_path / "copy.ogg"
+    copy.write_bytes(ogg)
+    cache = MediaCache(disk_path=str(tmp_path / "cache"))
+
+    await resolve_media(SAMPLE_OGG, http=None, type="audio", cache=cache)
+    media = await resolve_media(SAMPLE_OGG, http=None, type="audio", cache=cache)
+    assert media.mime == "audio/ogg"
+    assert media.filename == "sample.ogg"
+    # same content, another path: the file is read but stored once
+    await resolve_media(str(copy), http=None, type="audio", cache=cache)
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["disk_entries"] == 1
+
+    # a new process finds the content in the disk tier
+    cache = MediaCache(disk_path=str(tmp_path / "cache"))
+    media = await resolve_media(SAMPLE_OGG, http=None, type="audio", cache=cache)
+    assert media.mime == "audio/ogg"
+    assert cache.stats()["disk_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_eviction():
+    cache = MediaCache(max_bytes=100, max_entry_bytes=60)
+    await cache.put("a", CachedMedia(data=b"a" * 50, mime="text/plain"))
+    await cache.put("b", CachedMedia(data=b"b" * 50, mime="text/plain"))
+    await cache.get("a")
+    await cache.put("c", CachedMedia(data=b"c" * 50, mime="text/plain"))
+    await cache.put("big", CachedMedia(data=b"d" * 70, mime="text/plain"))
+
+    assert await cache.get("b") is None
+    assert await cache.get("big") is None
+    assert await cache.get("a") is not None
+    assert cache.stats()["bytes"] == 100
+    assert cache.stats()["evictions"] == 1
@@ -5,6 +5,7 @@ from celai_chatwoot.connector.model import WootLead
 from celai_chatwoot.connector.model.woot_attachment import WootAttachment, WootLocationAttachment
 from celai_chatwoot.connector.model.woot_message import WootMessage
 from cel.gateway.model.base_connector import BaseConnector
+from celai_chatwoot.connector.model.compact import RawPayloadMode, dumps
 
 
 
@@ -59,6 +60,40 @@ async def test_lead_parsing(msg):
     assert lead.conversation_from.email == 'foo@bar.com'
     assert lead.conversation_from.phone == '123456'
     
+
+def test_lead_raw_payload_is_packed(msg):
+    lead = WootLead.from_chatwoot_message(msg)
+    assert lead.metadata.is_packed('raw')
+    # decoded on first access
+    assert lead.metadata['raw'] == msg
+    assert not lead.metadata.is_packed('raw')
+
+    lead = WootLead.from_chatwoot_message(msg)
+    assert json.loads(lead.to_json())['metadata']['raw'] == msg
+    assert {**lead.metadata}['raw'] == msg
+
+
+def test_lead_packed_metadata_serialization(msg):
+    lead = WootLead.from_chatwoot_message(msg)
+    # orjson reads the dict storage without __getitem__
+    assert json.loads(dumps(lead.metadata))['raw'] == msg
+    assert lead.metadata.is_packed('raw')
+
+    text = str(lead.metadata)
+    assert 'PackedPayload' not in text and "'content': 'asd'" in text
+    assert repr(lead.metadata) == text
+    
+
+def test_lead_raw_payload_modes(msg):
+    full = WootLead.from_chatwoot_message(msg, raw_mode=RawPayloadMode.FULL)
+    assert full.metadata['raw'] is msg
+
+    trimmed = WootLead.from_chatwoot_message(msg, raw_mode=RawPayloadMode.TRIMMED).metadata['raw']
+    assert trimmed['conversation'] == {'id': 33, 'inbox_id': 211, 'status': 'open', 
+                                       'channel': 'Channel::WebWidget', 'contact_inbox': {'source_id': msg['conversation']['contact_inbox']['source_id']}}
+    assert trimmed['sender']['id'] == 5094
+    assert 'meta' not in trimmed['conversation'] and 'avatar' not in trimmed['sender']
+    
     
 @pytest.mark.asyncio
 async def test_message_parsing(msg):
@@ -176,4 +211,40 @@ async def test_message_file_pdf(msg_file_from_tg):
     
     assert attach.title == "file_2.pdf"
     assert attach.mimeType == 'application/pdf'
-    assert attach.file_url == 'https://chatwoot.celai.com/rails/active_storage/blobs/redirect/eyJfcmFpbHMiOnsibWVzc2FnZSI6IkJBaHBBcGs4IiwiZXhwIjpudWxsLCJwdXIiOiJibG9iX2lkIn19--67392c158ee9d2e382c576d70eaba10ca95c786e/file_2.pdf'
\ No newline at end of file
+    assert attach.file_url == 'https://chatwoot.celai.com/rails/active_storage/blobs/redirect/eyJfcmFpbHMiOnsibWVzc2FnZSI6IkJBaHBBcGs4IiwiZXhwIjpudWxsLCJwdXIiOiJibG9iX2lkIn19--67392c158ee9d2e382c576d70eaba10ca95c786e/file_2.pdf'
+
+def test_lead_dict_round_trip(msg):
+    lead = WootLead.from_chatwoot_message(msg, connector_name="chatwoot:test")
+    data = json.loads(json.dumps(lead.to_dict()))
+    assert data['conversation_id'] == '33'
+
+    restored = WootLead.from_dict(data)
+    assert restored.to_dict() == lead.to_dict()
+    assert restored.get_session_id() == lead.get_session_id()
+    assert restored.conversation_from.email == 'foo@bar.com'
+    assert restored.message_type == 'incoming'
+
+
+def test_lead_from_legacy_dict():
+    lead = WootLead.from_dict({'metadata': {}, 'account_id': '8', 'inbox_id': '211', 'conversaiton_id': '33'})
+    assert lead.conversation_id == '33'
+
+
+def test_lead_bytes_round_trip(msg):
+    lead = WootLead.from_chatwoot_message(msg, connector_name="chatwoot:test")
+    restored = WootLead.from_bytes(lead.to_bytes())
+
+    # the raw payload stays packed until it is read
+    assert restored.metadata.is_packed('raw')
+    assert restored.tmp_id == lead.tmp_id
+    assert restored.to_dict() == lead.to_dict()
+    assert restored.metadata['raw'] == msg
+
+    trimmed = WootLead.from_chatwoot_message(msg, raw_mode=RawPayloadMode.TRIMMED)
+    assert WootLead.from_bytes(trimmed.to_bytes()).to_dict() == trimmed.to_dict()
+
+    no_raw = WootLead(account_id='8', inbox_id='211', conversation_id='33')
+    assert WootLead.from_bytes(no_raw.to_bytes()).to_dict() == no_raw.to_dict()
+
+    with pytest.raises(ValueError):
+        WootLead.from_bytes(b"XX" + lead.to_bytes()[2:])
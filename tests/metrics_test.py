@@ -0,0 +1,95 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from celai_chatwoot.connector.metrics import MetricsRegistry
+from connector_test import StubGateway, build_connector, client_for, load
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry(prefix="test_")
+    histogram = registry.histogram("latency_seconds", "Latency", ("inbox",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, "211")
+    counter = registry.counter("requests", "Requests", ("status",))
+    counter.inc("200")
+    counter.inc("200", value=2)
+    registry.gauge("depth", "Depth", lambda: 4)
+
+    lines = registry.render().splitlines()
+    assert 'test_latency_seconds_bucket{inbox="211",le="0.1"} 2' in lines
+    assert 'test_latency_seconds_bucket{inbox="211",le="1"} 3' in lines
+    assert 'test_latency_seconds_bucket{inbox="211",le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_count{inbox="211"} 4' in lines
+    assert 'test_latency_seconds_sum{inbox="211"} 3.65' in lines
+    assert 'test_requests_total{status="200"} 3' in lines
+    assert "# TYPE test_depth gauge" in lines
+    assert "test_depth 4" in lines
+
+
+@pytest.mark.asyncio
+async def test_metrics_route_reports_every_stage():
+    conn = build_connector()
+    conn.gateway = StubGateway()
+    url = f"/chatwoot/webhook/{conn.security_token}"
+    outgoing = {**load("incoming_text_msg_from_web.json"), "message_type": "outgoing"}
+
+    async with client_for(conn) as client:
+        assert (await client.post(url, json=load("incoming_text_msg_from_web.json"))).status_code == 200
+        assert (await client.post(url, json=outgoing)).status_code == 200
+        await conn.webhook_queue.join()
+        res = await client.get(f"/chatwoot/metrics/{conn.security_token}")
+
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    lines = res.text.splitlines()
+    assert 'celai_chatwoot_webhooks_received_total{account="8",inbox="211"} 2' in lines
+    assert 'celai_chatwoot_webhooks_rejected_total{account="8",inbox="211",reason="outgoing"} 1' in lines
+    assert 'celai_chatwoot_webhook_queue_wait_seconds_count{account="8",inbox="211"} 1' in lines
+    assert 'celai_chatwoot_message_parse_seconds_count{account="8",inbox="211"} 1' in lines
+    assert 'celai_chatwoot_gateway_first_chunk_seconds_count{account="8",inbox="211"} 1' in lines
+    assert "celai_chatwoot_webhook_queue_depth 0" in lines
+    assert 'celai_chatwoot_http_pool_connections{state="in_use"} 0' in lines
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_metrics_can_be_disabled():
+    conn = build_connector(metrics=False)
+    async with client_for(conn) as client:
+        assert (await client.get(f"/chatwoot/metrics/{conn.security_token}")).status_code == 404
+    assert conn.render_metrics() == ""
+
+
+@pytest.mark.asyncio
+async def test_api_requests_are_timed_by_status():
+    from benchmarks.fake_chatwoot import FakeChatwoot
+    from celai_chatwoot.connector.model.woot_lead import WootLead
+
+    async with FakeChatwoot(rate_limit_rate=0.3, retry_after=0.01, seed=1) as fake:
+        conn = build_connector()
+        conn.chatwoot_url = fake.url
+        lead = WootLead(account_id="8", inbox_id="211", conversation_id=5, connector=conn)
+        for _ in range(5):
+            await conn.send_text_message(lead, "hello")
+        await conn.flush()
+        await conn.http.close()
+
+    requests = conn.metrics.requests
+    assert requests.count("8", "211", "messages", "200") == 5
+    assert requests.count("8", "211", "messages", "429") == fake.stats.rate_limited > 0
+    assert conn.metrics.uploaded.get("8", "211", "messages") > 5 * len("hello")
+
+
+@pytest.mark.asyncio
+async def test_metrics_routes_are_scoped_by_connector():
+    first, second = build_connector(), build_connector()
+    first.metrics.webhooks_received.inc("8", "211")
+    app = FastAPI()
+    app.include_router(first.get_router())
+    app.include_router(second.get_router())
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        first_lines = (await client.get(f"/chatwoot/metrics/{first.security_token}")).text.splitlines()
+        second_lines = (await client.get(f"/chatwoot/metrics/{second.security_token}")).text.splitlines()
+    assert 'celai_chatwoot_webhooks_received_total{account="8",inbox="211"} 1' in first_lines
+    assert not any(line.startswith("celai_chatwoot_webhooks_received_total{") for line in second_lines)
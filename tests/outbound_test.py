@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from celai_chatwoot.connector.outbound import OutboundDispatcher
+
+
+@pytest.mark.asyncio
+async def test_order_is_kept_per_conversation():
+    dispatcher = OutboundDispatcher(concurrency=4)
+    sent = []
+
+    def job(key, i, delay):
+        async def send():
+            await asyncio.sleep(delay)
+            sent.append((key, i))
+            return i
+        return send
+
+    # first chunks are the slowest, they must still be sent first
+    for i in range(5):
+        dispatcher.submit("a", job("a", i, 0.01 * (5 - i)))
+        dispatcher.submit("b", job("b", i, 0.001))
+
+    assert dispatcher.depth("a") == 5
+    assert dispatcher.stats()["queued"] == 10
+
+    await dispatcher.flush()
+    assert [i for k, i in sent if k == "a"] == list(range(5))
+    assert [i for k, i in sent if k == "b"] == list(range(5))
+    # "b" is not blocked behind the slow "a" conversation
+    assert sent.index(("b", 4)) < sent.index(("a", 1))
+    assert dispatcher.stats() == {"conversations": 0, "queued": 0, "max_depth": 0,
+                                  "in_flight": 0, "sent": 10, "failed": 0, "concurrency": 4}
+
+
+@pytest.mark.asyncio
+async def test_global_concurrency_limit():
+    dispatcher = OutboundDispatcher(concurrency=2)
+    running = 0
+    peak = 0
+
+    async def send():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    for conv in range(6):
+        dispatcher.submit(str(conv), send)
+    await dispatcher.flush()
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_job_does_not_block_the_conversation():
+    dispatcher = OutboundDispatcher()
+
+    async def fail():
+        raise ValueError("502")
+
+    async def ok():
+        return "ok"
+
+    failed = dispatcher.submit("a", fail)
+    sent = dispatcher.submit("a", ok)
+    await dispatcher.flush("a")
+
+    assert isinstance(failed.exception(), ValueError)
+    assert sent.result() == "ok"
+    assert dispatcher.stats()["failed"] == 1
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import time
+import pytest
+from celai_chatwoot.connector.profiler import SamplingProfiler, parse_profile_env
+from connector_test import StubGateway, build_connector, client_for, load
+
+
+def busy_work(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+def test_parse_profile_env():
+    assert parse_profile_env("webhooks=200") == {"webhooks": 200}
+    assert parse_profile_env("webhooks=50, seconds=2.5") == {"webhooks": 50, "seconds": 2.5}
+    assert parse_profile_env("minutes=1") is None
+    assert parse_profile_env("") is None
+
+
+def test_profile_is_written_as_collapsed_stacks(tmp_path):
+    profiler = SamplingProfiler(output_dir=str(tmp_path), interval=0.001)
+    assert not profiler.active
+    profiler.start(seconds=5)
+    busy_work(0.1)
+    path = profiler.stop()
+
+    assert not profiler.active
+    assert path == profiler.last_profile and os.path.dirname(path) == str(tmp_path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert profiler.stats()["samples"] == sum(int(line.rsplit(" ", 1)[1]) for line in lines)
+    assert any("busy_work (profiler_test.py" in line.rsplit(" ", 1)[0].split(";")[-1] for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_admin_route_profiles_the_next_webhooks(tmp_path):
+    conn = build_connector(profile_dir=str(tmp_path))
+    conn.gateway = StubGateway()
+    admin = f"/chatwoot/admin/{conn.security_token}/profile"
+
+    async with client_for(conn) as client:
+        res = await client.post(admin, params={"webhooks": 1, "seconds": 10})
+        assert res.json()["active"] and res.json()["remaining_webhooks"] == 1
+        await client.post(f"/chatwoot/webhook/{conn.security_token}", json=load("incoming_text_msg_from_web.json"))
+        await conn.webhook_queue.join()
+        # the session ends by itself after the webhook
+        for _ in range(100):
+            if not conn.profiler.active:
+                break
+            await asyncio.sleep(0.01)
+        status = (await client.get(admin)).json()
+        assert (await client.get("/chatwoot/admin/wrong/profile")).status_code == 404
+
+        assert not status["active"]
+        assert os.path.exists(status["last_profile"])
+
+        await client.post(admin, params={"seconds": 10})
+        res = await client.delete(admin)
+        assert not res.json()["active"]
+    await conn.webhook_queue.close()
@@ -0,0 +1,264 @@
+import asyncio
+import json
+import pytest
+import pytest_asyncio
+import httpx
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from fastapi import FastAPI
+from celai_chatwoot.connector.bot_utils import ChatwootAgentsBots
+from celai_chatwoot.connector.http_pool import ChatwootHttpPool
+from celai_chatwoot.connector.profiler import PROFILE_ENV
+from celai_chatwoot.connector.provisioning import BotIdCache, BotProvisioner, ProvisioningState
+from celai_chatwoot.connector.retry import NO_RETRY
+from celai_chatwoot.connector.routing import InboxRoute
+from celai_chatwoot.connector.woo_connector import WootConnector
+
+
+@pytest_asyncio.fixture
+async def bots_server():
+    """ Agent bots API without pagination, recording every call """
+    bots = {i: {"id": i, "name": f"bot {i}", "description": "", "outgoing_url": ""} for i in range(1, 40)}
+    calls = []
+    assigning = {"now": 0, "max": 0}
+    # cleared by the tests that hold the inbox assignments
+    gate = asyncio.Event()
+    gate.set()
+
+    async def list_bots(request: web.Request):
+        calls.append(("GET", "list"))
+        return web.json_response(list(bots.values()))
+
+    async def get_bot(request: web.Request):
+        calls.append(("GET", "bot"))
+        bot = bots.get(int(request.match_info["bot_id"]))
+        if bot is None:
+            return web.json_response({"error": "not found"}, status=404)
+        return web.json_response(bot)
+
+    async def create_bot(request: web.Request):
+        calls.append(("POST", "bot"))
+        data = await request.json()
+        bot = {"id": max(bots) + 1, "description": "", **data}
+        bots[bot["id"]] = bot
+        return web.json_response(bot)
+
+    async def update_bot(request: web.Request):
+        calls.append(("PATCH", "bot"))
+        bot = bots[int(request.match_info["bot_id"])]
+        bot.update(await request.json())
+        return web.json_response(bot)
+
+    async def assign(request: web.Request):
+        calls.append(("POST", "inbox"))
+        assigning["now"] += 1
+        assigning["max"] = max(assigning["max"], assigning["now"])
+        await gate.wait()
+        await asyncio.sleep(0.02)
+        assigning["now"] -= 1
+        return web.json_response({})
+
+    prefix = "/api/v1/accounts/{account_id}"
+    app = web.Application()
+    app.router.add_get(f"{prefix}/agent_bots", list_bots)
+    app.router.add_post(f"{prefix}/agent_bots", create_bot)
+    app.router.add_get(prefix + "/agent_bots/{bot_id}", get_bot)
+    app.router.add_patch(prefix + "/agent_bots/{bot_id}", update_bot)
+    app.router.add_post(prefix + "/inboxes/{inbox_id}/set_agent_bot", assign)
+    server = TestServer(app)
+    await server.start_server()
+    server.bots = bots
+    server.calls = calls
+    server.assigning = assigning
+    server.gate = gate
+    yield server
+    await server.close()
+
+
+class StubContext:
+    webhook_url = "https://bot.example.com"
+
+
+def connector_for(server: TestServer, tmp_path, **kwargs) -> WootConnector:
+    return WootConnector(bot_name="bot 3",
+                         account_id="8",
+                         access_key="key",
+                         chatwoot_url=str(server.make_url("")).rstrip("/"),
+                         inbox_id="211",
+                         bot_cache_path=str(tmp_path / "bots.json"),
+                         **kwargs)
+
+
+def provisioner_for(server: TestServer, pool: ChatwootHttpPool, cache_path: str) -> BotProvisioner:
+    client = ChatwootAgentsBots(base_url=str(server.make_url("")).rstrip("/"), account_id="8", access_key="key", http=pool)
+    return BotProvisioner(client, cache=BotIdCache(cache_path))
+
+
+@pytest.mark.asyncio
+async def test_warm_cache_skips_lookup_and_patch(bots_server, tmp_path):
+    pool = ChatwootHttpPool()
+    pool.open()
+    cache_path = str(tmp_path / "bots.json")
+    inboxes = list(range(1, 11))
+
+    # cold start: the bot is looked up by name, patched and cached
+    bot = await provisioner_for(bots_server, pool, cache_path).provision("bot 30", "https://bot/webhook", inbox_ids=inboxes)
+    assert bot["id"] == 30
+    assert bots_server.calls.count(("GET", "list")) == 1
+    assert bots_server.calls.count(("PATCH", "bot")) == 1
+    assert bots_server.calls.count(("POST", "inbox")) == 10
+    assert bots_server.assigning["max"] > 1
+
+    # warm start, same webhook url: one get and the assignments
+    bots_server.calls.clear()
+    bot = await provisioner_for(bots_server, pool, cache_path).provision("bot 30", "https://bot/webhook", inbox_ids=inboxes)
+    assert bot["id"] == 30
+    assert [c for c in bots_server.calls if c[1] == "bot" or c[1] == "list"] == [("GET", "bot")]
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_stale_cache_falls_back_to_lookup(bots_server, tmp_path):
+    pool = ChatwootHttpPool()
+    pool.open()
+    cache = BotIdCache(str(tmp_path / "bots.json"))
+    provisioner = provisioner_for(bots_server, pool, cache.path)
+    cache.set(BotIdCache.key(provisioner.client.base_url, "8", "new bot"), 999)
+
+    bot = await provisioner.provision("new bot", "https://bot/webhook", inbox_ids=["1"])
+    assert bot["id"] == 40
+    assert bots_server.calls[:2] == [("GET", "bot"), ("GET", "list")]
+    assert ("POST", "bot") in bots_server.calls
+    assert cache.get(BotIdCache.key(provisioner.client.base_url, "8", "new bot")) == 40
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_connector_provisions_every_account(bots_server, tmp_path):
+    conn = WootConnector(bot_name="bot 3",
+                         account_id=None,
+                         access_key=None,
+                         chatwoot_url=str(bots_server.make_url("")).rstrip("/"),
+                         inbox_id=None,
+                         bot_cache_path=str(tmp_path / "bots.json"),
+                         routes=[InboxRoute(account_id=8, inbox_id=i, access_key="key8") for i in (1, 2, 3)] +
+                                [InboxRoute(account_id=9, inbox_id=i, access_key="key9") for i in (4, 5)])
+    conn.http.open()
+    # the fake server shares the bots between accounts
+    bots = await conn.provision_bots("https://bot/webhook")
+    await conn.http.close()
+
+    assert {acc: bot["id"] for acc, bot in bots.items()} == {"8": 3, "9": 3}
+    assert bots_server.calls.count(("POST", "inbox")) == 5
+    assert (conn.account_id, conn.inbox_id) == ("8", "1")
+
+
+@pytest.mark.asyncio
+async def test_startup_does_not_wait_for_provisioning(bots_server, tmp_path):
+    conn = connector_for(bots_server, tmp_path, reject_until_ready=True)
+    app = FastAPI()
+    app.include_router(conn.get_router())
+    bots_server.gate.clear()
+    with open("./tests/data/incoming_text_msg_from_web.json") as f:
+        webhook = json.load(f)
+
+    conn.startup(StubContext())
+    assert conn.provisioning.state == ProvisioningState.PROVISIONING
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        res = await client.post(f"/chatwoot/webhook/{conn.security_token}", json=webhook)
+        assert res.status_code == 503
+        assert res.headers["Retry-After"] == "5"
+        res = await client.get(f"/chatwoot/health/{conn.security_token}")
+        assert res.status_code == 503
+        assert res.json()["provisioning"]["state"] == "provisioning"
+
+        bots_server.gate.set()
+        assert await conn.wait_ready(timeout=5)
+        res = await client.get(f"/chatwoot/health/{conn.security_token}")
+    assert res.status_code == 200
+    health = res.json()
+    assert health["provisioning"]["bots"] == {"8": 3}
+    assert health["paused"] is False
+    assert health["pool"]["open"] is True
+    assert health["webhook_queue"]["queued"] == 0
+    await conn.aclose()
+
+
+@pytest.mark.asyncio
+async def test_webhooks_are_held_until_ready(bots_server, tmp_path):
+    conn = connector_for(bots_server, tmp_path)
+    processed = []
+
+    @conn.on_event("message_created")
+    async def on_message(payload: dict):
+        processed.append(payload["id"])
+
+    app = FastAPI()
+    app.include_router(conn.get_router())
+    bots_server.gate.clear()
+
+    conn.startup(StubContext())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        with open("./tests/data/incoming_text_msg_from_web.json") as f:
+            res = await client.post(f"/chatwoot/webhook/{conn.security_token}", json=json.load(f))
+    assert res.status_code == 200
+    await asyncio.sleep(0.1)
+    assert processed == []
+
+    bots_server.gate.set()
+    assert await conn.wait_ready(timeout=5)
+    await conn.webhook_queue.join()
+    assert len(processed) == 1
+    await conn.aclose()
+
+
+@pytest.mark.asyncio
+async def test_provisioning_error_is_kept(bots_server, tmp_path):
+    conn = connector_for(bots_server, tmp_path, retry_policy=NO_RETRY)
+    conn.chatwoot_url = str(bots_server.make_url("/missing")).rstrip("/")
+
+    conn.startup(StubContext())
+    assert not await conn.wait_ready(timeout=5)
+    stats = conn.provisioning.stats()
+    assert stats["state"] == ProvisioningState.FAILED
+    assert stats["error"].startswith("ChatwootApiError")
+    assert conn.health()["ready"] is False
+    await conn.http.close()
+    await conn.webhook_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_startup_without_loop_provisions_in_background(bots_server, tmp_path):
+    conn = connector_for(bots_server, tmp_path)
+    bots_server.gate.clear()
+    # a thread without a running loop, as before the app loop starts
+    await asyncio.to_thread(conn.startup, StubContext())
+    assert conn.provisioning.state == ProvisioningState.PROVISIONING
+
+    bots_server.gate.set()
+    assert await conn.wait_ready(timeout=5)
+    assert conn.provisioning.bots["8"]["id"] == 3
+    # the connector pool is not bound to the provisioning loop
+    assert conn.http.closed
+
+
+@pytest.mark.asyncio
+async def test_app_awaits_the_shutdown(bots_server, tmp_path, monkeypatch):
+    monkeypatch.setenv(PROFILE_ENV, "seconds=30")
+    conn = connector_for(bots_server, tmp_path, profile_dir=str(tmp_path))
+    context = StubContext()
+    context.app = FastAPI()
+    await asyncio.to_thread(conn.startup, context)
+    # started without a running loop too
+    assert conn.profiler.active
+    assert await conn.wait_ready(timeout=5)
+    conn.http.open()
+
+    # as the app does: synchronous hooks first, then the async ones
+    conn.shutdown(context)
+    assert not conn.http.closed
+    for hook in context.app.router.on_shutdown:
+        await hook()
+    assert conn.http.closed
+    assert not conn.profiler.active
+    assert conn.profiler.last_profile.startswith(str(tmp_path))
@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+import gzip
+import json
+import pytest
+from celai_chatwoot.connector.recorder import WebhookRecorder, read_recording, redact
+from connector_test import StubGateway, build_connector, client_for, load
+
+
+def test_redact_keeps_size():
+    payload = {"sender": {"name": "Alex", "email": "a@b.co", "id": 7}, "messages": [{"sender": {"phone_number": None}}]}
+    assert redact(payload, frozenset(("name", "email", "phone_number"))) == \
+        {"sender": {"name": "xxxx", "email": "xxxxxx", "id": 7}, "messages": [{"sender": {"phone_number": None}}]}
+
+
+@pytest.mark.asyncio
+async def test_route_records_every_webhook(tmp_path):
+    path = str(tmp_path / "webhooks.ndjson.gz")
+    conn = build_connector(recorder=WebhookRecorder(path))
+    conn.gateway = StubGateway()
+    payload = load("incoming_text_msg_from_web.json")
+    outgoing = {**payload, "message_type": "outgoing"}
+
+    async with client_for(conn) as client:
+        await client.post(f"/chatwoot/webhook/{conn.security_token}", json=payload)
+        await asyncio.sleep(0.02)
+        await client.post(f"/chatwoot/webhook/{conn.security_token}", json=outgoing)
+        await client.post(f"/chatwoot/webhook/{conn.security_token}/batch", json=[payload, outgoing])
+    await conn.webhook_queue.join()
+    await conn.webhook_queue.close()
+    conn.recorder.close()
+
+    with gzip.open(path, "rb") as f:
+        assert len(f.read().splitlines()) == 3
+    records = list(read_recording(path))
+    assert [r["route"] for r in records] == ["webhook", "webhook", "batch"]
+    # filtered webhooks are recorded too, they are part of the traffic
+    assert records[1]["payload"]["message_type"] == "outgoing"
+    assert len(records[2]["payload"]) == 2
+    assert records[0]["t"] == 0 and records[1]["t"] >= 0.02
+    sender = records[0]["payload"]["sender"]
+    assert sender["name"] == "x" * len(payload["sender"]["name"])
+    assert records[0]["payload"]["content"] == payload["content"]
+    assert conn.recorder.stats()["recorded"] == 3
+
+
+@pytest.mark.asyncio
+async def test_replay_reports_lag_against_the_schedule(tmp_path):
+    from benchmarks.replay import run, schedule
+
+    path = str(tmp_path / "webhooks.ndjson.gz")
+    recorder = WebhookRecorder(path)
+    template = load("incoming_text_msg_from_web.json")
+    for i in range(5):
+        payload = json.loads(json.dumps(template))
+        payload["id"] = payload["conversation"]["messages"][0]["id"] = 1000 + i
+        recorder.record(payload)
+        await asyncio.sleep(0.01)
+    recorder.close()
+    # a second recording appended to the same file restarts its clock
+    assert [o for o, _ in schedule([{"t": 0}, {"t": 1}, {"t": 0}, {"t": 0.5}])] == [0, 1, 1, 1.5]
+
+    args = argparse.Namespace(recording=path, speed=2, concurrency=10, workers=2, webhook_queue_size=100,
+                              outbound_concurrency=4, latency=0.0, jitter=0.0, rate_limit_rate=0.0,
+                              error_rate=0.0, seed=0)
+    results = await run(args)
+    assert (results["webhooks"], results["answered"]) == (5, 5)
+    assert results["statuses"] == {"200": 5}
+    assert results["recorded_duration"] >= 0.04
+    assert results["scheduled_duration"] == pytest.approx(results["recorded_duration"] / 2, abs=1e-3)
+    assert results["post_duration"] >= results["scheduled_duration"]
+    assert results["answer_lag"]["p50"] > 0
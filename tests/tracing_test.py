@@ -0,0 +1,105 @@
+import json
+import pytest
+from celai_chatwoot.connector.tracing import (InMemorySpanExporter, JsonlSpanExporter, SpanKind, 
+                                              StatusCode, Tracer)
+from connector_test import build_connector, client_for, load
+
+
+def test_spans_are_nested_in_a_trace():
+    exporter = InMemorySpanExporter()
+    tracer = Tracer(exporter)
+    with tracer.span("root", kind=SpanKind.SERVER, root=True) as root:
+        with tracer.span("child", step=1) as child:
+            child.add_event("first_chunk")
+        assert Tracer.current_span() is root
+    assert Tracer.current_span() is None
+
+    child_span, root_span = exporter.spans()
+    assert child_span.trace_id == root_span.trace_id
+    assert child_span.parent_span_id == root_span.span_id
+    assert root_span.parent_span_id is None
+    assert child_span.to_dict()["attributes"] == {"step": 1}
+    assert child_span.events[0]["name"] == "first_chunk"
+    assert root_span.duration >= child_span.duration
+
+
+def test_errors_and_sampling():
+    exporter = InMemorySpanExporter()
+    tracer = Tracer(exporter)
+    with pytest.raises(ValueError):
+        with tracer.span("failing", root=True):
+            raise ValueError("boom")
+    assert exporter.spans()[0].status_code == StatusCode.ERROR
+
+    # children of a trace not sampled are not recorded either
+    exporter.clear()
+    with Tracer(exporter, sample_rate=0).span("root", root=True):
+        with tracer.span("child"):
+            pass
+    assert exporter.spans() == []
+    with Tracer().span("disabled") as span:
+        span.set_attribute("ignored", True)
+
+
+def test_jsonl_exporter(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(JsonlSpanExporter(str(path), flush_every=100), service_name="test")
+    with tracer.span("root", root=True):
+        with tracer.span("child", conversation=33):
+            pass
+    assert not path.exists()
+    tracer.close()
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [s["name"] for s in spans] == ["child", "root"]
+    assert spans[0]["parent_span_id"] == spans[1]["span_id"]
+    assert spans[0]["attributes"] == {"conversation": 33}
+    assert spans[1]["resource"] == {"service.name": "test"}
+    assert spans[1]["status"] == {"code": StatusCode.UNSET}
+
+
+class SentenceGateway:
+    """ Answers every message with two sentences sent as they are generated """
+    def __init__(self, connector):
+        self.connector = connector
+
+    async def process_message(self, message, mode=None):
+        for text in ("Hello.", "How can I help you?"):
+            await self.connector.send_text_message(message.lead, text)
+            yield text
+
+
+@pytest.mark.asyncio
+async def test_sends_are_traced_back_to_the_webhook():
+    from benchmarks.fake_chatwoot import FakeChatwoot
+
+    exporter = InMemorySpanExporter()
+    async with FakeChatwoot() as fake:
+        conn = build_connector(tracer=Tracer(exporter))
+        conn.chatwoot_url = fake.url
+        conn.gateway = SentenceGateway(conn)
+        async with client_for(conn) as client:
+            url = f"/chatwoot/webhook/{conn.security_token}"
+            assert (await client.post(url, json=load("incoming_text_msg_from_web.json"))).status_code == 200
+            await conn.webhook_queue.join()
+        await conn.webhook_queue.close()
+        await conn.http.close()
+
+    assert len(fake.messages) == 2
+    traces = exporter.traces()
+    assert len(traces) == 1
+    spans = {s.name: s for s in exporter.spans()}
+    webhook, process = spans["chatwoot.webhook"], spans["chatwoot.process_message"]
+    assert webhook.attributes["chatwoot.webhook.status"] == "ok"
+    assert webhook.attributes["chatwoot.conversation_id"] == 33
+    assert process.parent_span_id == webhook.span_id
+    assert spans["chatwoot.parse"].parent_span_id == process.span_id
+    gateway = spans["chatwoot.gateway"]
+    assert gateway.parent_span_id == process.span_id
+    assert gateway.attributes["chatwoot.chunks"] == 2
+    sends = exporter.spans(name="chatwoot.api messages")
+    assert len(sends) == 2
+    assert all(s.parent_span_id == gateway.span_id and s.kind == SpanKind.CLIENT for s in sends)
+    assert all(s.attributes["http.response.status_code"] == 200 for s in sends)
+    # the last send ends before the gateway span, it is part of the critical path
+    assert max(s.end_time_unix_nano for s in sends) <= gateway.end_time_unix_nano
@@ -0,0 +1,37 @@
+import json
+from celai_chatwoot.connector.webhook_filter import WebhookFilter, loads
+
+
+def load(name: str) -> dict:
+    with open(f'./tests/data/{name}') as f:
+        return json.load(f)
+
+
+def test_filter_rejects_irrelevant_events():
+    wf = WebhookFilter(inbox_id="211")
+    incoming = load("incoming_text_msg_from_web.json")
+    assert wf.accept(incoming)
+
+    assert wf.reject_reason({**incoming, "message_type": "outgoing"}) == "outgoing"
+    assert wf.reject_reason({**incoming, "message_type": None}) == "outgoing"
+    assert wf.reject_reason({**incoming, "private": True}) == "private"
+    assert wf.reject_reason({**incoming, "event": "conversation_updated"}) == "event"
+    assert wf.reject_reason({**incoming, "inbox": {"id": 216}}) == "inbox"
+    assert wf.reject_reason([incoming]) == "invalid"
+    # any inbox is accepted when no inbox is configured
+    assert WebhookFilter().reject_reason({**incoming, "inbox": {"id": 216}}) is None
+
+
+def test_filter_stats():
+    wf = WebhookFilter(inbox_id="211")
+    incoming = load("incoming_text_msg_from_web.json")
+    for payload in (incoming, {**incoming, "message_type": "outgoing"}, {**incoming, "message_type": "outgoing"}, {}):
+        wf.accept(payload)
+
+    stats = wf.stats()
+    assert (stats["received"], stats["rejected"], stats["rejection_rate"]) == (4, 3, 0.75)
+    assert stats["rejected_by_reason"] == {"outgoing": 2, "event": 1}
+
+
+def test_loads_raw_body():
+    assert loads(b'{"event": "message_created"}') == {"event": "message_created"}